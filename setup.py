@@ -15,12 +15,18 @@ setup(
         "numpy",
         "trio",
         "python-dotenv",
-        "websockets",
+        "trio-websocket",
     ],
     extras_require={
           "notebook": [
             "bokeh",
         ],
+          "mqtt": [
+            "paho-mqtt",
+        ],
+          "export": [
+            "pyarrow",
+        ],
     },
     author='Daniela Komenda, Livio Bürgisser, Noémie Käser',
     author_email='komendan@students.zhaw.ch, buergli1@students.zhaw.ch, kaeseno1@students.zhaw.ch',
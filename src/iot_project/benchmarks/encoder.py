@@ -0,0 +1,58 @@
+"""
+Micro-Benchmark: represent_for_mongodb vs. AggregationEncoder
+Run with: python -m iot_project.benchmarks.encoder
+"""
+import datetime
+import timeit
+
+import numpy as np
+
+from ..gas_sensors.db_connect import represent_for_mongodb, AggregationEncoder
+from ..gas_sensors.aggregation import StreamingAggregator
+
+GASES = ("NH3", "CO", "O2")
+
+
+def make_aggregation(rng):
+    aggregation = {}
+    for gas, values in zip(GASES, rng.random((len(GASES), 5))):
+        aggregator = StreamingAggregator()
+        for value in values:
+            aggregator.add(value)
+        aggregation[gas] = aggregator.result()
+    aggregation.update(time=datetime.datetime.now(datetime.timezone.utc))
+    return aggregation
+
+
+def main(number=20_000, bulk=1_000):
+    rng = np.random.default_rng(0)
+    aggregation = make_aggregation(rng)
+    encoder = AggregationEncoder(GASES)
+    assert encoder.encode(aggregation) == represent_for_mongodb(aggregation)
+
+    # Seconds per document
+    results = {
+        "represent_for_mongodb": timeit.timeit(lambda: represent_for_mongodb(aggregation), number=number) / number,
+        "AggregationEncoder.encode": timeit.timeit(lambda: encoder.encode(aggregation), number=number) / number,
+    }
+
+    times = [aggregation["time"]] * bulk
+    values = rng.random((bulk, len(GASES), len(encoder.fields)))
+    aggregations = [
+        {gas: dict(zip(encoder.fields, stats)) for gas, stats in zip(GASES, row)} | dict(time=time)
+        for time, row in zip(times, values)
+    ]
+    repeat = max(number // bulk, 1)
+    results["represent_for_mongodb (bulk)"] = timeit.timeit(
+        lambda: [represent_for_mongodb(a) for a in aggregations], number=repeat
+    ) / (bulk * repeat)
+    results["AggregationEncoder.encode_array (bulk)"] = timeit.timeit(
+        lambda: encoder.encode_array(times, values), number=repeat
+    ) / (bulk * repeat)
+
+    for name, seconds in results.items():
+        print(f"{name:40s} {seconds * 1e6:8.2f} µs/document")
+
+
+if __name__ == "__main__":
+    main()
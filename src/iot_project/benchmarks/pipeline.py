@@ -0,0 +1,259 @@
+"""
+End-to-end benchmark of the measurement -> aggregate -> store pipeline on simulated hardware
+Run with: python -m iot_project.benchmarks.pipeline [--duration 10] [--output result.json]
+
+Reports (as JSON, to compare between commits):
+- micro-benchmarks of the single stages (frame-decoding, checksum, aggregation, document-encoding)
+- the full MonitoringSystem.measurement_loop against the simulator and an in-memory sink (or a real mongod with --mongo-uri):
+  samples/s, latency-percentiles per stage, event-loop stalls, memory
+- the floor of measurement_interval / aggregation_interval on this machine
+"""
+import argparse
+import datetime
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+import trio
+
+from .. import metrics
+from ..gas_sensors import hal
+from ..gas_sensors.multigas_sensors import MultiGasSensor, SensorType, CmdCode
+from ..gas_sensors.frames import decode_frames
+from ..gas_sensors.simulation import SimulatedSensor, sine
+from ..gas_sensors.aggregation import StreamingAggregator
+from ..gas_sensors.db_connect import AggregationEncoder, represent_for_mongodb
+from ..gas_sensors.db_writer import BufferedWriter
+from ..gas_sensors.gas_monitoring_system import MonitoringSystem
+from .encoder import make_aggregation
+
+
+def percentiles(values) -> dict[str, float | int | None]:
+    """Percentiles in milliseconds"""
+    if not len(values):
+        return dict(count=0, p50=None, p95=None, p99=None, max=None)
+    values = np.asarray(values) * 1e3
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return dict(count=len(values), p50=p50, p95=p95, p99=p99, max=values.max())
+
+
+def per_call(function, number) -> float:
+    """Microseconds per call"""
+    return timeit.timeit(function, number=number) / number * 1e6
+
+
+def micro_benchmarks(number=20_000) -> dict[str, float]:
+    sensor = SimulatedSensor(SensorType.NH3, sine(20, 5, 60))
+    sensor.write(list(bytes.fromhex("ff0188000000000077")))
+    frame = sensor.response(0.0)
+    payload = frame[2:-1]
+    gas_sensor = MultiGasSensor.__new__(MultiGasSensor)
+    gas_sensor.expected_sensor_type = SensorType.NH3
+
+    frames = b"".join(sensor.response(i * 0.1) for i in range(number))
+    values = np.random.default_rng(0).random(number).tolist()
+    aggregator = StreamingAggregator()
+
+    def aggregate():
+        for value in values:
+            aggregator.add(value)
+
+    aggregation = make_aggregation(np.random.default_rng(0))
+    encoder = AggregationEncoder(("NH3", "CO", "O2"))
+
+    return {
+        "calc_check_sum_us": per_call(lambda: MultiGasSensor.calc_check_sum(frame[1:-2]), number),
+        "check_response_us": per_call(lambda: gas_sensor.check_response(CmdCode.read_all, frame), number),
+        "decode_all_us": per_call(lambda: gas_sensor.decode_all(payload), number),
+        "decode_frames_us": timeit.timeit(lambda: decode_frames(frames), number=1) / number * 1e6,
+        "aggregate_add_us": timeit.timeit(aggregate, number=1) / number * 1e6,
+        "aggregate_result_us": per_call(aggregator.result, number),
+        "represent_for_mongodb_us": per_call(lambda: represent_for_mongodb(aggregation), number),
+        "encode_us": per_call(lambda: encoder.encode(aggregation), number),
+    }
+
+
+class MemoryCollection:
+    """Sink with the part of the pymongo-API used by the writer, measures the write-latency"""
+
+    def __init__(self, database=None):
+        self.database = database
+        self.count = 0
+        self.latencies = []
+
+
+    def insert_many(self, documents, ordered=True):
+        start = time.perf_counter()
+        self.count += len(documents)
+        for document in documents:
+            json.dumps(document, default=str)  # Roughly the serialization-work of the driver
+        self.latencies.append(time.perf_counter() - start)
+
+
+    def bulk_write(self, requests, ordered=True):
+        self.count += len(requests)
+
+
+class MemoryDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = MemoryCollection(self)
+        return collection
+
+
+class SinkWriter(BufferedWriter):
+    """BufferedWriter, that writes into a MemoryCollection instead of a MongoDB"""
+
+    def __init__(self, sink, **kwargs):
+        super().__init__(None, **kwargs)
+        self.sink = sink
+
+
+    async def _connect(self, stack):
+        return self.sink
+
+
+async def scheduling_lag(lags, interval=0.01):
+    """How late a sleeping task is woken up"""
+    while True:
+        start = trio.current_time()
+        await trio.sleep(interval)
+        lags.append(trio.current_time() - start - interval)
+
+
+async def run_pipeline(duration, measurement_interval, aggregation_interval, mongo_uri, settle_time):
+    system = MonitoringSystem(
+        mongo_uri,
+        measurement_interval=measurement_interval,
+        aggregation_interval=aggregation_interval,
+        adaptive=False,  # Fixed intervals, the benchmark measures the floor of the pipeline
+        http_port=None,
+    )
+    for sensor in system.sensors.values():
+        sensor.settle_time = settle_time
+
+    sink = MemoryDatabase()["Raw-Data"]
+    if mongo_uri is None:
+        system.writer = SinkWriter(sink, rollups=False)
+
+    poll_latencies = []
+
+    def timed(poll):
+        async def timed_poll(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await poll(*args, **kwargs)
+            finally:
+                poll_latencies.append(time.perf_counter() - start)
+        return timed_poll
+
+    for bus in system.buses.values():
+        bus.poll = timed(bus.poll)
+
+    put_latencies = []
+    documents = []
+    put = system.writer.put
+
+    def timed_put(document):
+        documents.append(document)
+        start = time.perf_counter()
+        try:
+            return put(document)
+        finally:
+            put_latencies.append(time.perf_counter() - start)
+
+    system.writer.put = timed_put
+
+    stalls = metrics.StallDetector(steps=[])
+    lags = []
+    trio.lowlevel.add_instrument(stalls)
+    with system:
+        with trio.move_on_after(duration):
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(scheduling_lag, lags)
+                nursery.start_soon(system.main_task)
+    trio.lowlevel.remove_instrument(stalls)
+
+    samples = sum(d[gas]["count"] for d in documents for gas in system.sensors)
+    return dict(
+        duration_s=duration,
+        measurement_interval_s=measurement_interval,
+        aggregation_interval_s=aggregation_interval,
+        settle_time_s=settle_time,
+        sensors=len(system.sensors),
+        samples=samples,
+        samples_per_s=samples / duration,
+        documents=len(documents),
+        failures=sum(d[gas]["failures"] for d in documents for gas in system.sensors),
+        latency_ms=dict(
+            poll=percentiles(poll_latencies),
+            aggregate_and_queue=percentiles(put_latencies),
+            db_write=percentiles(sink.latencies),
+        ),
+        event_loop_ms=dict(
+            task_steps=percentiles(stalls.steps),
+            scheduling_lag=percentiles(lags),
+        ),
+        writer=system.writer.stats.__dict__,
+    )
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmark-pipeline")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--aggregation-interval", type=float, default=0.5)
+    parser.add_argument("--settle-time", type=float, default=MultiGasSensor.settle_time, help="Sensor settle-time (s)")
+    parser.add_argument("--mongo-uri", default=None, help="Write to a real mongod instead of the in-memory sink")
+    parser.add_argument("--output", default=None, help="JSON-file (default: stdout)")
+    args = parser.parse_args()
+    hal.set_backend("sim")
+
+    result = dict(
+        time=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        commit=git_commit(),
+        machine=dict(platform=platform.platform(), python=sys.version.split()[0]),
+        micro=micro_benchmarks(),
+    )
+    # measurement_interval=0: the loop measures as fast as it can -> floor of the interval
+    tracemalloc.start()  # Only here, it slows down the micro-benchmarks
+    result["pipeline"] = trio.run(
+        run_pipeline, args.duration, 0.0, args.aggregation_interval, args.mongo_uri, args.settle_time
+    )
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    poll = result["pipeline"]["latency_ms"]["poll"]
+    queue = result["pipeline"]["latency_ms"]["aggregate_and_queue"]
+    result["floor"] = dict(
+        measurement_interval_s=None if poll["p99"] is None else poll["p99"] / 1e3,
+        aggregation_interval_s=None if poll["p99"] is None else (poll["p99"] + (queue["p99"] or 0)) / 1e3,
+    )
+    result["memory"] = dict(
+        python_peak_bytes=peak,
+        max_rss_bytes=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    )
+
+    text = json.dumps(result, indent=2, default=float)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import math
+
+
+class P2Quantile:
+    """
+    Estimate of a quantile with constant memory (5 markers), P²-Algorithm by Jain & Chlamtac (1985)
+    """
+
+    def __init__(self, p: float):
+        self.p = p
+        self.reset()
+
+
+    def reset(self):
+        self._heights = []
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * self.p, 1 + 4 * self.p, 3 + 2 * self.p, 5]
+        self._increments = [0, self.p / 2, self.p, (1 + self.p) / 2, 1]
+
+
+    def add(self, x: float):
+        q = self._heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        # Find the cell of x and update the extreme values
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self._positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        # Adjust the heights of the middle markers
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+
+    @property
+    def value(self) -> float | None:
+        q = self._heights
+        if not q:
+            return None
+        if len(q) < 5:
+            # Exact quantile of the few values so far
+            return q[min(round(self.p * (len(q) - 1)), len(q) - 1)]
+        return q[2]
+
+
+class StreamingAggregator:
+    """
+    Running statistics of one sensor over an aggregation-interval, O(1) per sample and constant memory
+    (no list of the samples, mean and variance with Welford's algorithm)
+    """
+
+    def __init__(self):
+        self._p95 = P2Quantile(0.95)
+        self.reset()
+
+
+    def reset(self):
+        self.count = 0
+        self.failures = 0
+        self.errors = {}  # Error-type -> failures
+        self.min = math.inf
+        self.max = -math.inf
+        self.last = None
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._p95.reset()
+
+
+    def add(self, value: float):
+        self.count += 1
+        self.last = value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+        delta = value - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (value - self._mean)
+        self._p95.add(value)
+
+
+    def add_failure(self, error_type: str = "other"):
+        self.failures += 1
+        self.errors[error_type] = self.errors.get(error_type, 0) + 1
+
+
+    @property
+    def std(self) -> float | None:
+        if self.count == 0:
+            return None
+        return math.sqrt(self._m2 / self.count)
+
+
+    def result(self) -> dict[str, float | int | None]:
+        if self.count == 0:
+            # Sensor seems to be failing for the whole Aggregation-Intervall (no data)
+            return dict(
+                min=None, max=None, avg=None, std=None, p95=None, last=None,
+                count=0, failures=self.failures,
+            )
+
+        return dict(
+            min=self.min,
+            max=self.max,
+            avg=self._mean,
+            std=self.std,
+            p95=self._p95.value,
+            last=self.last,
+            count=self.count,
+            failures=self.failures,
+        )
@@ -1,7 +1,13 @@
-import typing
+import collections
+import time
 
-import anyio
-import RPi.GPIO as GPIO
+import trio
+
+from . import hal
+from .. import logs, metrics
+from .exposure import ExposureLimits, ExposureTracker
+from .multigas_sensors import SensorType
+from .topology import default_exposure, default_limits
 
 nh3_sensor = 19
 co_sensor = 23
@@ -12,46 +18,82 @@ led_green = 31
 buzzerpin = 38
 switch = 29
 
+alert_leds = (nh3_sensor, co_sensor, o2_sensor, other_sensor)
+# LED per gas, the gases without an own LED are shown on `other_sensor`
+gas_leds = {SensorType.NH3: nh3_sensor, SensorType.CO: co_sensor, SensorType.O2: o2_sensor}
 
-class AlertManager:
-
-    def __init__(self):
-        self._nh3_alert = False
-        self._co_alert = False
-        self._o2_alert = False
-        self.nh3_alert_level = 50  # Health risk NH3 above 50 PPM for a 8-Hour-Shift
-        self.co_alert_level = 100  # Health risk CO above 100PPM
-        self.o2_alert_level = 20  # Health risk O2 below 17%
+blink_interval = 0.4
 
+# Every change of the alert-state is logged, the rate-limit only applies to the other events
+log = logs.get_logger(__name__, exempt=("alert", "alert-end", "alarm", "alarm-acknowledged"))
+alarm_latency_seconds = metrics.histogram(
+    "iot_alarm_latency_seconds", "Latency from the threshold-crossing in check_alerts to the buzzer"
+)
+alerts_total = metrics.counter("iot_alerts_total", "Threshold-crossings per sensor", labels=("sensor",))
 
-    def _setup(self):
-        GPIO.setmode(
-            GPIO.BOARD
-        )  # use BOARD PIN Numbering  # use LOGICAL GPIO Numbering
-
-        # Green LED
-        GPIO.setup(led_green, GPIO.OUT)
-        GPIO.output(led_green, GPIO.HIGH)  # make green ledPin output HIGH level
 
-        # NH3-LED
-        GPIO.setup(nh3_sensor, GPIO.OUT)  # set the red ledPin to OUTPUT mode
-        GPIO.output(nh3_sensor, GPIO.LOW)  # make red ledPin output LOW level
+class AlertManager:
+    """
+    Event-driven alert handling:
+    - check_alerts() signals every change of the alert-state
+    - the button is detected by an edge-callback of RPi.GPIO, which is forwarded into the trio-loop
+    - the pins are only written, if their level actually changes
+    - besides the concentration itself, the time-weighted exposure (8 h TWA, 15 min STEL) and the rate of rise
+      can raise an alert, see exposure.py
+    The alarm-latency (threshold crossing in check_alerts -> buzzer on) is measured for every alert
+    """
+
+    def __init__(self, limits=None, leds=None, exposure=None):
+        """
+        limits: sensor-name -> (above, below), an alert is raised above `above` or below `below` (None: no limit)
+        leds: sensor-name -> LED-pin (default: other_sensor)
+        exposure: sensor-name -> ExposureLimits
+        Without limits, the sensors NH3, CO and O2 of the board with their default-limits are used
+        """
+        self.gpio = hal.gpio()
+        if limits is None:
+            limits = {gas.name: default_limits[gas] for gas in gas_leds}
+            leds = {gas.name: pin for gas, pin in gas_leds.items()}
+            exposure = {gas.name: ExposureLimits(**default_exposure.get(gas, {})) for gas in gas_leds}
+        self.limits = dict(limits)
+        self.exposure = ExposureTracker(exposure or {})
+        self.leds = {name: (leds or {}).get(name, other_sensor) for name in (*self.limits, *self.exposure.gases)}
+        self._active = set()  # Sensors with an alert
+
+        self._pin_levels = {}  # Last level written to each output-pin
+        self._changed = trio.Event()  # Set on every change of the alert-state and on button-presses
+        self._button_pressed = False
+        self._trio_token = None
+        self.ready = trio.Event()  # Set when the alert_loop reacts to check_alerts (pins are set up by __enter__)
+        self._alert_start = None  # perf_counter() of the threshold crossing, until the buzzer is on
+        self.alarm_latencies = collections.deque(maxlen=100)  # seconds
+
+        metrics.callback(
+            "iot_exposure",
+            "Exposure per sensor: twa (8 h) and stel (15 min) time-weighted average in ppm, rise in ppm/min",
+            lambda: {(name, kind): v for name, values in self.exposure.values.items() for kind, v in values.items()},
+            labels=("sensor", "kind"),
+        )
 
-        # CO-LED
-        GPIO.setup(co_sensor, GPIO.OUT)  # set the red ledPin to OUTPUT mode
-        GPIO.output(co_sensor, GPIO.LOW)  # make red ledPin output LOW level
 
-        # O2-LED
-        GPIO.setup(o2_sensor, GPIO.OUT)  # set the red ledPin to OUTPUT mode
-        GPIO.output(o2_sensor, GPIO.LOW)  # make red ledPin output LOW level
+    def _setup(self):
+        self.gpio.setmode(
+            self.gpio.BOARD
+        )  # use BOARD PIN Numbering  # use LOGICAL GPIO Numbering
 
-        # Buzzer-Pin
-        GPIO.setup(buzzerpin, GPIO.OUT)  # set buzzerPin to OUTPUT modea
+        # Green LED, NH3-LED, CO-LED, O2-LED, other-LED, Buzzer-Pin
+        for pin in (led_green, *alert_leds, buzzerpin):
+            self.gpio.setup(pin, self.gpio.OUT)
+        self._pin_levels.clear()
+        self.normal_mode()
 
         # Button
-        GPIO.setup(
-            switch, GPIO.IN, pull_up_down=GPIO.PUD_UP
+        self.gpio.setup(
+            switch, self.gpio.IN, pull_up_down=self.gpio.PUD_UP
         )  # set buttonPin to PULL UP INPUT mode
+        self.gpio.add_event_detect(
+            switch, self.gpio.FALLING, callback=self._on_button, bouncetime=50
+        )  # Pressed = LOW -> falling edge
 
 
     def __enter__(self):
@@ -59,115 +101,177 @@ class AlertManager:
 
 
     def __exit__(self, type, value, tb):
-        GPIO.cleanup()
+        self.gpio.cleanup()
+
 
+    def _write(self, pin, level):
+        if self._pin_levels.get(pin) != level:
+            self.gpio.output(pin, level)
+            self._pin_levels[pin] = level
 
-    def check_alerts(self, *, nh3=None, co=None, o2=None):
-        # Check if alerts are True
-        if nh3 is not None:
-            self._nh3_alert = nh3 > self.nh3_alert_level
-        if co is not None:
-            self._co_alert = co > self.co_alert_level
-        if o2 is not None:
-            self._o2_alert = o2 < self.o2_alert_level
 
+    def _signal(self):
+        self._changed.set()
+        self._changed = trio.Event()
 
-    async def wait_for_alert_end(
-        self, max_wait_time, previous_button_state
-    ) -> tuple[typing.Literal["timeout", "button pressed", "no more alert"], bool]:
 
-        with anyio.move_on_after(max_wait_time):  # Runs until max_wait_time is over
-            while True:
-                current_button_state = GPIO.input(switch) == GPIO.LOW
-                if not previous_button_state and current_button_state:
-                    return "button pressed", previous_button_state
+    def _on_button(self, channel):
+        # Runs in the thread of RPi.GPIO -> hand over to the trio-loop
+        if self._trio_token is not None:
+            try:
+                self._trio_token.run_sync_soon(self._button_event)
+            except trio.RunFinishedError:
+                pass
 
-                if not self._any_alert:
-                    return "no more alert", previous_button_state
 
-                previous_button_state = current_button_state
-                await anyio.sleep(0.05)
+    def _button_event(self):
+        self._button_pressed = True
+        self._signal()
 
-        return "timeout", previous_button_state
+
+    def check_alerts(self, now: float | None = None, /, **values):
+        """
+        Check the new values (sensor-name -> concentration), sensors without limits are ignored
+        `now`: time of the values in seconds since the epoch (default: now), for the exposure
+        """
+        if now is None:
+            now = time.time()
+        was_alert = self._any_alert
+        changed = False
+        for name, value in values.items():
+            if value is None:
+                continue
+            reasons = self.exposure.add(name, value, now)
+            limit = self.limits.get(name)
+            if limit is not None:
+                above, below = limit
+                if above is not None and value > above:
+                    reasons.append("above")
+                if below is not None and value < below:
+                    reasons.append("below")
+
+            alert = bool(reasons)
+            if alert != (name in self._active):
+                changed = True
+                if alert:
+                    self._active.add(name)
+                    alerts_total.labels(sensor=name).inc()
+                    log.warning("alert", sensor=name, value=value, reasons=reasons, **self.exposure.values.get(name, {}))
+                else:
+                    self._active.discard(name)
+                    log.info("alert-end", sensor=name, value=value)
+
+        if changed:
+            if not was_alert:
+                self._alert_start = time.perf_counter()
+            elif not self._any_alert:
+                self._alert_start = None
+            self._signal()
 
 
     @property
     def _any_alert(self):
-        return self._nh3_alert or self._co_alert or self._o2_alert
+        return bool(self._active)
+
+
+    def alarm_latency_stats(self) -> dict[str, float | int | None]:
+        """Latency from the threshold crossing to the buzzer (seconds)"""
+        latencies = self.alarm_latencies
+        if not latencies:
+            return dict(count=0, last=None, max=None, avg=None)
+        return dict(
+            count=len(latencies),
+            last=latencies[-1],
+            max=max(latencies),
+            avg=sum(latencies) / len(latencies),
+        )
+
+
+    def _show_alerts(self):
+        pins = {self.leds[name] for name in self._active}
+        for pin in alert_leds:
+            self._write(pin, self.gpio.HIGH if pin in pins else self.gpio.LOW)
+
+
+    def _buzzer_on(self):
+        self._write(buzzerpin, self.gpio.HIGH)
+        if self._alert_start is not None:
+            latency = time.perf_counter() - self._alert_start
+            self._alert_start = None
+            self.alarm_latencies.append(latency)
+            alarm_latency_seconds.observe(latency)
+            log.info("alarm", latency_ms=round(latency * 1000, 1), sensors=sorted(self._active))
+
+
+    async def _blink(self) -> str:
+        """ALERT-MODE: LEDs & Buzzer blinking, until the button is pressed or there is no more alert"""
+        on = True
+        while True:
+            if on:
+                # Blink-On-Phase
+                self._show_alerts()
+                self._buzzer_on()
+            else:
+                # Blink-Off-Phase
+                for pin in (*alert_leds, buzzerpin):
+                    self._write(pin, self.gpio.LOW)
+
+            with trio.move_on_after(blink_interval):
+                while True:
+                    await self._changed.wait()
+                    if self._button_pressed:
+                        return "button pressed"
+                    if not self._any_alert:
+                        return "no more alert"
+                    if on:
+                        self._show_alerts()  # Other gas with alert -> show it immediately
+            on = not on
 
 
     async def alert_loop(self):
         """
         Check if an alert is present or not
-        If alert is not present: normal mode and 10ms sleep
+        If alert is not present: normal mode, wait for the next change
         If alert is present: LED & Buzzer on and blinking
         """
+        self._trio_token = trio.lowlevel.current_trio_token()
+        self.ready.set()
+
         while True:
 
             """NORMAL-MODE"""
             if not self._any_alert:
                 self.normal_mode()
-                await anyio.sleep(0.1)
+                await self._changed.wait()
                 continue
 
             """ALERT-MODE"""
-            GPIO.output(led_green, GPIO.LOW)
-            button_state = True
+            self._write(led_green, self.gpio.LOW)
+            self._button_pressed = False  # Only presses during the alert count
 
-            while True:
-
-                # Blink-On-Phase
-                GPIO.output(nh3_sensor, GPIO.HIGH if self._nh3_alert else GPIO.LOW)
-                GPIO.output(co_sensor, GPIO.HIGH if self._co_alert else GPIO.LOW)
-                GPIO.output(o2_sensor, GPIO.HIGH if self._o2_alert else GPIO.LOW)
-                GPIO.output(buzzerpin, GPIO.HIGH)
-
-                result, button_state = await self.wait_for_alert_end(0.4, button_state)
-                if result != "timeout":
-                    break  # -> to ACKNOWLEDGE-MODE or to Normal-State
-
-                # Blink-Off-Phase
-                GPIO.output(nh3_sensor, GPIO.LOW)
-                GPIO.output(co_sensor, GPIO.LOW)
-                GPIO.output(o2_sensor, GPIO.LOW)
-                GPIO.output(buzzerpin, GPIO.LOW)
-
-                result, button_state = await self.wait_for_alert_end(0.4, button_state)
-                if result != "timeout":
-                    break  # -> to ACKNOWLEDGE-MODE or to Normal-State
+            result = await self._blink()
 
             if result == "button pressed":
+                log.info("alarm-acknowledged", sensors=sorted(self._active))
                 """
                 ACKNOWLEDGE-MODE:
                 - LEDs on, Buzzer off
                 - If Button is pressed again: ACKNOWLEDGE-MODE is aborted
                 -> alert-mode is reactivated if there is still an alert, otherwise it goes back to normal
                 """
-                previous_button_state = True  # Button was pressed before
-                GPIO.output(buzzerpin, GPIO.LOW)
-
-                while self._any_alert:
-                    current_button_state = GPIO.input(switch) == GPIO.LOW
-
-                    if (
-                        not previous_button_state and current_button_state
-                    ):  # Checks if there was a change from not-pressed to pressed
-                        break
-
-                    GPIO.output(nh3_sensor, GPIO.HIGH if self._nh3_alert else GPIO.LOW)
-                    GPIO.output(co_sensor, GPIO.HIGH if self._co_alert else GPIO.LOW)
-                    GPIO.output(o2_sensor, GPIO.HIGH if self._o2_alert else GPIO.LOW)
+                self._button_pressed = False
+                self._write(buzzerpin, self.gpio.LOW)
 
-                    previous_button_state = current_button_state
-                    await anyio.sleep(0.1)
+                while self._any_alert and not self._button_pressed:
+                    self._show_alerts()
+                    await self._changed.wait()
 
 
     def normal_mode(self):
         """
         Mode without alert
         """
-        GPIO.output(led_green, GPIO.HIGH)
-        GPIO.output(nh3_sensor, GPIO.LOW)
-        GPIO.output(co_sensor, GPIO.LOW)
-        GPIO.output(o2_sensor, GPIO.LOW)
-        GPIO.output(buzzerpin, GPIO.LOW)
+        self._write(led_green, self.gpio.HIGH)
+        for pin in alert_leds:
+            self._write(pin, self.gpio.LOW)
+        self._write(buzzerpin, self.gpio.LOW)
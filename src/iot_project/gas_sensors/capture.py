@@ -0,0 +1,214 @@
+"""
+Binary capture of every raw I2C-transfer of the MultiGasSensors, to tune thresholds and reproduce incidents with replay.py
+One file per start of the MonitoringSystem: a 48-byte header followed by fixed-size records of `record_dtype`
+(20 bytes, ~50 MB per day with 3 sensors at 10 Hz). The records are written in the order of the transfers,
+so a capture can be memory-mapped with `load_capture` and its frames decoded with frames.decode_frames.
+"""
+import datetime
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+import trio
+
+from .frames import FRAME_SIZE
+
+MAGIC = b"IOTFRM01"
+
+header_dtype = np.dtype(
+    [
+        ("magic", "S8"),
+        ("clock_offset", "<i8"),  # time.time_ns() - time.monotonic_ns() at the start -> wall-clock of the records
+        ("device", "S32"),
+    ]
+)
+
+record_dtype = np.dtype(
+    [
+        ("time", "<i8"),  # time.monotonic_ns() of the transfer
+        ("bus", "u1"),
+        ("address", "u1"),
+        ("status", "u1"),
+        ("frame", "u1", (FRAME_SIZE,)),  # Response-frame as received (zeros for errors)
+    ]
+)
+
+# Values of the status-field
+FRAME = 0
+READ_ERROR = 1  # OSError while reading the response
+WRITE_ERROR = 2  # OSError while sending the command (no response read)
+
+_record = struct.Struct("<qBBB9s")
+assert _record.size == record_dtype.itemsize
+
+
+class FrameRecorder:
+    """
+    Appends the transfers to a new capture-file in `directory`
+    Called from the worker-threads of the SensorBus, the records are buffered and written by the file-object
+    """
+
+    def __init__(self, directory, device: str = ""):
+        os.makedirs(directory, exist_ok=True)
+        start = datetime.datetime.now(datetime.timezone.utc)
+        self.path = os.path.join(directory, f"capture-{start:%Y%m%dT%H%M%S}.frames")
+        self.file = open(self.path, "xb")
+        self.file.write(
+            np.array(
+                (MAGIC, time.time_ns() - time.monotonic_ns(), device.encode()[:32]), dtype=header_dtype
+            ).tobytes()
+        )
+        self.lock = threading.Lock()
+        self.count = 0
+
+
+    def _write(self, bus: int, address: int, status: int, frame: bytes):
+        record = _record.pack(time.monotonic_ns(), bus, address, status, frame)
+        with self.lock:
+            self.file.write(record)
+            self.count += 1
+
+
+    def record(self, bus: int, address: int, frame: bytes):
+        self._write(bus, address, FRAME, frame)
+
+
+    def record_read_error(self, bus: int, address: int):
+        self._write(bus, address, READ_ERROR, b"")
+
+
+    def record_write_error(self, bus: int, address: int):
+        self._write(bus, address, WRITE_ERROR, b"")
+
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def load_capture(path) -> tuple[np.ndarray, np.ndarray]:
+    """(header, records) of a capture-file, the records are memory-mapped (an incomplete last record is ignored)"""
+    header = np.fromfile(path, dtype=header_dtype, count=1)
+    if len(header) != 1 or header["magic"][0] != MAGIC:
+        raise ValueError(f"{path} is not a frame-capture")
+
+    count = (os.path.getsize(path) - header_dtype.itemsize) // record_dtype.itemsize
+    if count == 0:
+        return header[0], np.empty(0, dtype=record_dtype)
+    records = np.memmap(path, dtype=record_dtype, mode="r", offset=header_dtype.itemsize, shape=(count,))
+    return header[0], records
+
+
+class ReplayBus:
+    """smbus.SMBus-compatible bus, returning the recorded frames of one bus-number"""
+
+    def __init__(self, player, bus_number: int):
+        self.player = player
+        self.bus_number = bus_number
+
+
+    def write_i2c_block_data(self, address, register, data):
+        self.player.write(self.bus_number, address)
+
+
+    def read_i2c_block_data(self, address, register, length):
+        return self.player.read(self.bus_number, address)[:length]
+
+
+class Track:
+    """The records of one sensor (plain arrays, indexing the memory-map per frame is slow)"""
+
+    def __init__(self, records, first_ns):
+        self.times = (records["time"] - first_ns) / 1e9  # Seconds since the first record of the capture
+        self.status = records["status"]
+        self.frames = records["frame"]
+        self.cursor = 0
+
+
+class Player:
+    """The records of a capture, per sensor in the recorded order"""
+
+    def __init__(self):
+        self.header = None
+        self.records = None
+        self.clock_offset = 0
+        self.first_ns = 0
+        self.device = ""
+        self.tracks: dict[tuple[int, int], Track] = {}
+        self.origin = 0.0  # trio-time of the first record
+        self.finished = None
+
+
+    def load(self, path):
+        self.header, self.records = load_capture(path)
+        self.clock_offset = int(self.header["clock_offset"])
+        self.device = self.header["device"].decode()
+
+        # Per sensor its records, the sensors are read independently (like on the bus)
+        self.first_ns = first_ns = int(self.records["time"][0]) if len(self.records) else 0
+        records = np.asarray(self.records).view(np.ndarray)
+        keys = records["bus"].astype(np.uint16) << 8 | records["address"]
+        self.tracks = {
+            (key >> 8, key & 0xFF): Track(records[keys == key], first_ns) for key in np.unique(keys).tolist()
+        }
+        self.finished = trio.Event()
+        if not self.tracks:
+            self.finished.set()  # Empty capture
+
+
+    def bus(self, bus_number: int) -> ReplayBus:
+        return ReplayBus(self, bus_number)
+
+
+    @property
+    def duration(self) -> float:
+        """Seconds between the first and the last record"""
+        if not len(self.records):
+            return 0.0
+        return (int(self.records["time"][-1]) - int(self.records["time"][0])) / 1e9
+
+
+    def wall_time(self) -> datetime.datetime:
+        """Recorded wall-clock time at the current trio-time"""
+        time_ns = self.first_ns + self.clock_offset + round((trio.current_time() - self.origin) * 1e9)
+        return datetime.datetime.fromtimestamp(time_ns / 1e9, datetime.timezone.utc)
+
+
+    def next_time(self, bus_number, address) -> float | None:
+        """trio-time of the next record of a sensor (None at the end of the capture)"""
+        track = self.tracks.get((bus_number, address))
+        if track is None or track.cursor >= len(track.times):
+            return None
+        return self.origin + track.times[track.cursor]
+
+
+    def _track(self, bus_number, address) -> Track:
+        track = self.tracks.get((bus_number, address))
+        if track is None:
+            raise OSError(121, "Remote I/O error")  # Sensor not in the capture
+        if track.cursor >= len(track.times):
+            self.finished.set()
+            raise OSError(121, "End of capture")
+        return track
+
+
+    def write(self, bus_number, address):
+        track = self._track(bus_number, address)
+        if track.status[track.cursor] == WRITE_ERROR:
+            track.cursor += 1
+            raise OSError(121, "Remote I/O error (recorded)")
+
+
+    def read(self, bus_number, address) -> list[int]:
+        track = self._track(bus_number, address)
+        index = track.cursor
+        track.cursor += 1
+        if track.status[index] == READ_ERROR:
+            raise OSError(121, "Remote I/O error (recorded)")
+        return track.frames[index].tolist()
+
+
+# The one player of the replay, here and not in replay.py: that one runs as __main__ (a second module-instance)
+player = Player()
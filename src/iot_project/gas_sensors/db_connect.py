@@ -1,17 +1,120 @@
 import contextlib
+import dataclasses
+import datetime
 
 import pymongo
+import pymongo.errors
 import numpy as np
 
+from .documents import StorageMode, collection_names, AggregationEncoder  # noqa: F401 (imported from here before)
+
+DUPLICATE_KEY = 11000
+
+BUCKET_SECONDS = 60
+
 
 @contextlib.contextmanager
-def connect_to_db(mongodb_uri):
+def connect_to_db(mongodb_uri, mode: StorageMode = StorageMode.documents):
     """Open the connection to the DB and return the collection
     Create collection with unique index, if there is not yet one"""
 
     with pymongo.MongoClient(mongodb_uri) as DBclient:
         db = DBclient["IoT-Project"]
-        yield db["Raw-Data"]
+        yield ensure_collection(db, mode)
+
+
+def ensure_collection(db, mode: StorageMode):
+    """Create the collection (time-series) and the indexes for the storage-mode, if they don't exist yet"""
+    name = collection_names[mode]
+
+    match mode:
+        case StorageMode.documents:
+            collection = db[name]
+            # Unique per device and time: documents replayed from the spool are not stored twice
+            collection.create_index([("meta.device", 1), ("time", 1)], unique=True)
+            collection.create_index("time")
+
+        case StorageMode.timeseries:
+            if name not in db.list_collection_names(filter=dict(name=name)):
+                db.create_collection(
+                    name,
+                    timeseries=dict(timeField="time", metaField="meta", granularity="seconds"),
+                )
+            collection = db[name]
+            # Time-series collections don't support unique indexes
+            collection.create_index([("meta.device", 1), ("time", 1)])
+
+        case StorageMode.buckets:
+            collection = db[name]
+            collection.create_index([("meta.device", 1), ("start", 1)], unique=True)
+            collection.create_index("start")
+
+    return collection
+
+
+def bucket_start(time: datetime.datetime) -> datetime.datetime:
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=datetime.timezone.utc)  # pymongo returns naive UTC-times
+    seconds = time.timestamp() // BUCKET_SECONDS * BUCKET_SECONDS
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+
+
+def bucket_updates(documents) -> list[pymongo.UpdateOne]:
+    """
+    One upsert per document into the bucket of its device and minute. The filter only matches a bucket without a sample
+    of the same time, so a sample already stored (e.g. replayed from the spool) makes the upsert insert a second bucket,
+    which the unique index rejects as duplicate: every document gets its own result, like in the other storage-modes
+    """
+    updates = []
+    for document in documents:
+        sample = dict(document)
+        meta = sample.pop("meta", {})
+        time = sample["time"]
+        updates.append(
+            pymongo.UpdateOne(
+                {"meta.device": meta.get("device"), "start": bucket_start(time), "samples.time": {"$ne": time}},
+                {
+                    "$setOnInsert": {"meta": meta},
+                    "$min": {"first": time},
+                    "$max": {"last": time},
+                    "$push": {"samples": sample},
+                },
+                upsert=True,
+            )
+        )
+    return updates
+
+
+@dataclasses.dataclass
+class WriteResult:
+    written: int = 0
+    duplicates: int = 0
+    failed: int = 0
+    rejected: set[int] = dataclasses.field(default_factory=set)  # Indexes of the documents not written (duplicate or failed)
+    existing: set[int] = dataclasses.field(default_factory=set)  # Indexes of the duplicates (already in the DB)
+
+
+def write_documents(collection, documents, mode: StorageMode) -> WriteResult:
+    """
+    Unordered bulk-write of the documents for the storage-mode
+    Connection-problems are raised, errors of single documents are counted in the result
+    """
+    try:
+        if mode is StorageMode.buckets:
+            collection.bulk_write(bucket_updates(documents), ordered=False)
+        else:
+            collection.insert_many(documents, ordered=False)
+        return WriteResult(written=len(documents))
+    except pymongo.errors.BulkWriteError as ex:
+        errors = ex.details.get("writeErrors", [])
+        existing = {e["index"] for e in errors if e.get("code") == DUPLICATE_KEY}
+        return WriteResult(
+            written=len(documents) - len(errors),
+            duplicates=len(existing),
+            failed=len(errors) - len(existing),
+            rejected={e["index"] for e in errors},
+            existing=existing,
+        )
 
 
 def represent_for_mongodb(obj):
@@ -0,0 +1,275 @@
+import collections
+import contextlib
+import dataclasses
+import importlib
+import time
+
+import trio
+
+from .documents import StorageMode
+from .. import logs, metrics
+
+log = logs.get_logger(__name__)
+db_write_seconds = metrics.histogram(
+    "iot_db_write_seconds", "Duration of a bulk-write of a batch (including the rollups)", buckets=(*metrics.DEFAULT_BUCKETS, 30.0, 60.0)
+)
+
+
+@dataclasses.dataclass
+class WriterStats:
+    queued: int = 0  # Documents accepted by put()
+    written: int = 0  # Documents acknowledged by the DB
+    duplicates: int = 0  # Documents already in the DB (e.g. replayed from the spool)
+    failed: int = 0  # Documents rejected by the DB
+    batches: int = 0
+    write_errors: int = 0  # Failed bulk-writes (e.g. DB not reachable)
+    rollup_errors: int = 0  # Batches not added to the rollups
+    max_queue_depth: int = 0
+
+
+def _key(document) -> tuple:
+    """Unique per document in the DB (see the indexes in db_connect.py)"""
+    return document.get("meta", {}).get("device"), document["time"]
+
+
+class MemoryQueue:
+    """
+    Bounded in-memory queue for the BufferedWriter, the oldest documents are dropped if it is full
+    Documents stay in the queue until they are committed, so a failed batch is simply read again
+    """
+
+    def __init__(self, max_len=10_000):
+        self.max_len = max_len
+        self.dropped = 0
+        self._items = collections.deque()
+        self._start = 0  # Running number of the first document in the queue
+
+
+    def __len__(self):
+        return len(self._items)
+
+
+    @property
+    def fill_level(self) -> float:
+        return len(self._items) / self.max_len
+
+
+    def append(self, document) -> bool:
+        accepted = True
+        if len(self._items) >= self.max_len:
+            self._items.popleft()
+            self._start += 1
+            self.dropped += 1
+            accepted = False
+        self._items.append(document)
+        return accepted
+
+
+    def peek(self, count: int) -> tuple[list, int]:
+        count = min(count, len(self._items))
+        return [self._items[i] for i in range(count)], self._start + count
+
+
+    def commit(self, position: int):
+        """Remove the documents before `position` (returned by peek), the dropped ones are gone already"""
+        while self._start < position and self._items:
+            self._items.popleft()
+            self._start += 1
+
+
+class BufferedWriter:
+    """
+    Writes documents to the DB in the background, so the measurement-loop never waits on the network:
+    put() only appends to a queue (MemoryQueue or the durable Spool) and run() drains it with unordered bulk-writes,
+    as soon as a batch is full or the flush-interval is over
+    """
+
+    def __init__(
+        self,
+        mongo_uri,
+        *,
+        queue=None,
+        mode: StorageMode = StorageMode.documents,
+        rollups=True,
+        batch_size=100,
+        flush_interval=2.0,
+        retry_interval=5.0,
+    ):
+        self.mongo_uri = mongo_uri
+        self.queue = MemoryQueue() if queue is None else queue
+        self.mode = mode
+        self.rollups = rollups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.stats = WriterStats()
+        self._batch_ready = trio.Event()
+        # (device, time) of the documents of failed bulk-writes: they can be in the DB without being in the rollups,
+        # so they are added to the rollups, when they are duplicates in the retry (dict as ordered set)
+        self._unrolled = {}
+
+        # Counted in the stats anyway, only read when scraped
+        metrics.callback(
+            "iot_documents_total",
+            "Documents by outcome: queued by put(), written, duplicates (already in the DB), failed (rejected by the DB)",
+            lambda: {(field,): getattr(self.stats, field) for field in ("queued", "written", "duplicates", "failed")},
+            type="counter",
+            labels=("outcome",),
+        )
+        metrics.callback(
+            "iot_documents_dropped_total", "Documents dropped, because the queue/spool was full", lambda: self.dropped, type="counter"
+        )
+        metrics.callback(
+            "iot_db_write_errors_total", "Failed bulk-writes and connection-attempts", lambda: self.stats.write_errors, type="counter"
+        )
+        metrics.callback("iot_db_queue_depth", "Documents waiting for the DB", lambda: self.queue_depth)
+
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.queue)
+
+
+    @property
+    def dropped(self) -> int:
+        return self.queue.dropped
+
+
+    @property
+    def backpressure(self) -> float:
+        """Fill-level of the queue between 0 (empty) and 1 (full, oldest documents are dropped)"""
+        return self.queue.fill_level
+
+
+    def put(self, document) -> bool:
+        """
+        Queue a document for writing, never blocks
+        Returns False, if the queue was full and the oldest document had to be dropped
+        """
+        accepted = self.queue.append(document)
+        self.stats.queued += 1
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, len(self.queue))
+
+        if len(self.queue) >= self.batch_size:
+            self._batch_ready.set()
+        return accepted
+
+
+    def _write(self, collection, batch):
+        import pymongo.errors
+        from .db_connect import write_documents
+        from .rollups import write_rollups
+
+        result = write_documents(collection, batch, self.mode)
+        if not self.rollups:
+            return result, True
+
+        # Only documents inserted by this or a failed write are added, replayed duplicates are already in the rollups
+        written = [
+            d for i, d in enumerate(batch)
+            if i not in result.rejected or (i in result.existing and _key(d) in self._unrolled)
+        ]
+        try:
+            write_rollups(collection.database, written)
+        except pymongo.errors.PyMongoError as ex:
+            # The raw data is written already, so the batch must not be repeated
+            log.warning("db-problem", stage="rollups", error=repr(ex))
+            return result, False
+        return result, True
+
+
+    async def _queue_io(self, function, *args):
+        # The Spool reads and writes the disk (SD-Card), that must not stall the alarm in the trio-loop
+        if getattr(self.queue, "blocking", False):
+            return await trio.to_thread.run_sync(function, *args)
+        return function(*args)
+
+
+    async def flush(self, collection) -> bool:
+        import pymongo.errors
+
+        while True:
+            batch, position = await self._queue_io(self.queue.peek, self.batch_size)
+            if not batch:
+                return True
+
+            start = time.perf_counter()
+            try:
+                result, rollups_ok = await trio.to_thread.run_sync(
+                    self._write, collection, batch
+                )
+            except pymongo.errors.PyMongoError as ex:
+                # Batch stays in the queue and is written again later
+                log.warning("db-problem", stage="write", error=repr(ex), queue_depth=len(self.queue))
+                self.stats.write_errors += 1
+                self._unrolled.update(dict.fromkeys(map(_key, batch)))
+                while len(self._unrolled) > 10 * self.batch_size:  # Documents dropped from the queue are never retried
+                    del self._unrolled[next(iter(self._unrolled))]
+                return False
+            finally:
+                db_write_seconds.observe(time.perf_counter() - start)
+
+            await self._queue_io(self.queue.commit, position)
+            if self._unrolled:
+                for document in batch:
+                    self._unrolled.pop(_key(document), None)
+            self.stats.batches += 1
+            self.stats.written += result.written
+            self.stats.duplicates += result.duplicates
+            self.stats.failed += result.failed
+            self.stats.rollup_errors += not rollups_ok
+
+
+    def _open(self, stack: contextlib.ExitStack):
+        from .db_connect import connect_to_db
+        from .rollups import ensure_rollups
+
+        # The connection is handed over to `stack` only when the setup succeeded, else it is closed before the retry
+        with contextlib.ExitStack() as connection:
+            collection = connection.enter_context(connect_to_db(self.mongo_uri, self.mode))
+            if self.rollups:
+                ensure_rollups(collection.database)
+            stack.enter_context(connection.pop_all())
+        return collection
+
+
+    async def _connect(self, stack: contextlib.ExitStack):
+        # Connecting (and creating the indexes) runs in a thread and is retried, a missing DB must not stop the measurements
+        # pymongo is imported in the thread too, it is not needed before (see the boot-stages in main.py)
+        await trio.to_thread.run_sync(importlib.import_module, "pymongo")
+        import pymongo.errors
+
+        while True:
+            try:
+                return await trio.to_thread.run_sync(self._open, stack)
+            except pymongo.errors.PyMongoError as ex:
+                log.warning("db-problem", stage="connect", error=repr(ex))
+                self.stats.write_errors += 1
+                await trio.sleep(self.retry_interval)
+
+
+    def close(self):
+        """At the end: the documents of the Spool are synced to the disk"""
+        if hasattr(self.queue, "close"):
+            try:
+                self.queue.close()
+            except OSError as ex:
+                log.error("spool-close-failed", error=repr(ex))
+
+
+    async def run(self):
+        async with trio.open_nursery() as nursery:
+            if hasattr(self.queue, "run"):
+                nursery.start_soon(self.queue.run)
+
+            with contextlib.ExitStack() as stack:
+                collection = await self._connect(stack)
+
+                while True:
+                    if not await self.flush(collection):
+                        await trio.sleep(self.retry_interval)
+                        continue
+
+                    with trio.move_on_after(self.flush_interval):
+                        await self._batch_ready.wait()
+                    self._batch_ready = trio.Event()
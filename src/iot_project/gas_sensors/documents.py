@@ -0,0 +1,81 @@
+"""
+Shape of the documents in the DB: storage-modes with their collections and the encoder of the aggregations
+Without pymongo (and numpy only in the bulk path), so the sampling can start before the DB-driver is imported
+"""
+import enum
+
+
+class StorageMode(enum.Enum):
+    documents = "documents"  # One document per aggregation in "Raw-Data"
+    timeseries = "timeseries"  # MongoDB time-series collection (MongoDB >= 5.0)
+    buckets = "buckets"  # One document per device and minute, samples packed into an array
+
+
+collection_names = {
+    StorageMode.documents: "Raw-Data",
+    StorageMode.timeseries: "Raw-Data-TS",
+    StorageMode.buckets: "Raw-Data-Buckets",
+}
+
+
+class AggregationEncoder:
+    """
+    Builds the DB-document for the aggregations of the MonitoringSystem directly,
+    without the generic recursion (and all the copies) of represent_for_mongodb
+    Document-shape: {<gas>: {<field>: value, ...}, ..., "time": datetime, "meta": {"device": ...}, "health": {<gas>: state},
+    "errors": {<gas>: {<error-type>: failures}} (only gases with failures), "sampling": {"level": ..., "rate": measurements/s, "interval": s}}
+    """
+
+    # field-name -> type stored in the DB, see StreamingAggregator.result
+    fields = dict(
+        min=float, max=float, avg=float, std=float, p95=float, last=float,
+        count=int, failures=int,
+    )
+
+    def __init__(self, gases, fields=None):
+        self.gases = tuple(gases)
+        if fields is not None:
+            self.fields = fields
+        self._items = tuple(self.fields.items())
+
+
+    def encode(self, aggregation) -> dict:
+        document = {}
+        for gas in self.gases:
+            stats = aggregation[gas]
+            document[gas] = {
+                name: None if (value := stats[name]) is None else convert(value)
+                for name, convert in self._items
+            }
+        document["time"] = aggregation["time"]
+        for key in ("meta", "health", "errors", "sampling"):
+            if key in aggregation:
+                document[key] = aggregation[key]
+        return document
+
+
+    def encode_array(self, times, values, meta=None) -> list[dict]:
+        """
+        Fast path for bulk-inserts: `values` is an array of shape (len(times), len(gases), len(fields)), NaN means no data
+        The whole array is converted to Python-floats at once with tolist()
+        """
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.float64)
+        assert values.shape[1:] == (len(self.gases), len(self._items)), values.shape
+
+        items = self._items
+        documents = []
+        for time, row in zip(times, values.tolist()):
+            document = {
+                gas: {
+                    name: None if value != value else convert(value)  # NaN -> None
+                    for (name, convert), value in zip(items, stats)
+                }
+                for gas, stats in zip(self.gases, row)
+            }
+            document["time"] = time
+            if meta is not None:
+                document["meta"] = meta
+            documents.append(document)
+        return documents
@@ -0,0 +1,252 @@
+"""
+Bulk-export of the stored aggregations to columnar files for the notebooks, and the loader for them.
+The export streams a time range out of the DB (projection, large batches, range-scan on the time-index) and writes
+one file per `chunk_size` documents, so the memory stays bounded for any range:
+    OUTPUT/part-00000.npz, part-00001.npz, ...  (or .parquet, if pyarrow is installed)
+Every part holds flat columns: `time` (datetime64[ms], UTC), `device` and `<gas>.<stat>` (float64, NaN without data)
+for the statistics of the aggregation (min, max, avg, std, p95, last, count, failures).
+
+Run with:
+    python -m iot_project.gas_sensors.export OUTPUT [--since 2026-01-01] [--until 2026-04-01] [--format npz]
+and load with `load_export(OUTPUT)` (NumPy record array) or `load_dataframe(OUTPUT)` (pandas).
+"""
+import argparse
+import datetime
+import os
+import pathlib
+
+import numpy as np
+
+from .documents import StorageMode
+
+STATISTICS = ("min", "max", "avg", "std", "p95", "last", "count", "failures")
+FORMATS = ("npz", "parquet")
+
+
+def default_format() -> str:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return "npz"
+    return "parquet"
+
+
+def _naive_utc(time: datetime.datetime | None) -> datetime.datetime | None:
+    if time is None or time.tzinfo is None:
+        return time
+    return time.astimezone(datetime.timezone.utc).replace(tzinfo=None)  # Compared with naive UTC-times from pymongo
+
+
+def _time_range(field: str, since, until) -> dict:
+    query = {}
+    if since is not None:
+        query["$gte"] = since
+    if until is not None:
+        query["$lt"] = until
+    return {field: query} if query else {}
+
+
+def export_documents(collection, mode: StorageMode, *, since=None, until=None, devices=None, gases=None, chunk_size=20_000):
+    """
+    Stream the aggregations of [since, until) in time-order, only the fields of the export are transferred
+    In buckets-mode the buckets are unpacked (the first bucket can start up to a minute before `since`)
+    """
+    since, until = _naive_utc(since), _naive_utc(until)
+    device_query = {} if devices is None else {"meta.device": {"$in": list(devices)}}
+
+    if mode is StorageMode.buckets:
+        start = None if since is None else since - datetime.timedelta(minutes=1)
+        if gases is None:
+            projection = {"_id": 0, "meta.sensors": 0, "samples.health": 0, "samples.errors": 0, "samples.sampling": 0}
+        else:
+            projection = {"_id": 0, "meta.device": 1, "samples.time": 1, **{f"samples.{gas}": 1 for gas in gases}}
+        cursor = collection.find({**_time_range("start", start, until), **device_query}, projection)
+        cursor = cursor.sort("start", 1).hint([("start", 1)]).batch_size(max(chunk_size // 120, 1))
+        for bucket in cursor:
+            for sample in bucket["samples"]:
+                if (since is None or sample["time"] >= since) and (until is None or sample["time"] < until):
+                    yield dict(sample, meta=bucket.get("meta", {}))
+        return
+
+    if gases is None:
+        projection = {"_id": 0, "meta.sensors": 0, "health": 0, "errors": 0, "sampling": 0}
+    else:
+        projection = {"_id": 0, "time": 1, "meta.device": 1, **{gas: 1 for gas in gases}}
+    cursor = collection.find({**_time_range("time", since, until), **device_query}, projection).sort("time", 1)
+    if mode is StorageMode.documents:
+        cursor = cursor.hint([("time", 1)])  # Range-scan on the time-index, not the one per device
+    yield from cursor.batch_size(chunk_size)
+
+
+def flatten(documents: list[dict]) -> dict[str, np.ndarray]:
+    """Columns of a chunk of aggregation-documents (every gas, that has data in one of them)"""
+    gases = {}  # dict as ordered set
+    for document in documents:
+        for key, value in document.items():
+            if isinstance(value, dict) and "avg" in value:
+                gases[key] = None
+
+    columns = {
+        "time": np.array([document["time"] for document in documents], dtype="datetime64[ms]"),
+        "device": np.array([document.get("meta", {}).get("device") or "" for document in documents], dtype=str),
+    }
+    empty = {}
+    for gas in gases:
+        stats = [document.get(gas) or empty for document in documents]
+        for stat in STATISTICS:
+            # None (no data in the window) becomes NaN
+            columns[f"{gas}.{stat}"] = np.array([s.get(stat) for s in stats], dtype=float)
+    return columns
+
+
+def _write_part(path: pathlib.Path, columns: dict[str, np.ndarray], format: str, compress: bool):
+    if format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pq.write_table(pa.table(columns), path, compression="zstd" if compress else "none")
+    elif compress:
+        np.savez_compressed(path, **columns)
+    else:
+        np.savez(path, **columns)
+
+
+def export(collection, output, mode: StorageMode = StorageMode.documents, *, since=None, until=None, devices=None,
+           gases=None, format: str | None = None, chunk_size=20_000, compress=True, progress=None) -> int:
+    """
+    Write the aggregations of [since, until) as parts of `chunk_size` rows to the directory `output`, returns the rows
+    `progress(rows, time)` is called after every part with the rows so far and the time of the last one
+    """
+    format = default_format() if format is None else format
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export-format {format!r}, use one of {FORMATS}")
+    output = pathlib.Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    if any(output.glob("part-*")):
+        raise FileExistsError(f"{output} contains an export already")
+
+    chunk = []
+    parts = total = 0
+
+    def flush():
+        nonlocal chunk, parts, total
+        _write_part(output / f"part-{parts:05d}.{format}", flatten(chunk), format, compress)
+        parts += 1
+        total += len(chunk)
+        if progress is not None:
+            progress(total, chunk[-1]["time"])
+        chunk = []
+
+    for document in export_documents(collection, mode, since=since, until=until, devices=devices, gases=gases, chunk_size=chunk_size):
+        chunk.append(document)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return total
+
+
+def _read_part(path: pathlib.Path, columns) -> dict[str, np.ndarray]:
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, columns=None if columns is None else [c for c in columns if c in pq.read_schema(path).names])
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+    with np.load(path) as part:
+        # Only the requested columns are decompressed
+        return {name: part[name] for name in part.files if columns is None or name in columns}
+
+
+def load_columns(path, columns=None, *, since=None, until=None) -> dict[str, np.ndarray]:
+    """
+    Columns of all parts of an export, `columns` selects some (time and device are always loaded)
+    Parts without a column (gas not measured then) are filled with NaN
+    """
+    if columns is not None:
+        columns = {"time", "device", *columns}
+    parts = []
+    for part in sorted(pathlib.Path(path).glob("part-*")):
+        data = _read_part(part, columns)
+        mask = np.ones(len(data["time"]), dtype=bool)
+        if since is not None:
+            mask &= data["time"] >= np.datetime64(_naive_utc(since), "ms")
+        if until is not None:
+            mask &= data["time"] < np.datetime64(_naive_utc(until), "ms")
+        if not mask.all():
+            data = {name: column[mask] for name, column in data.items()}
+        if len(data["time"]):
+            parts.append(data)
+
+    names = {"time": None, "device": None}
+    for data in parts:
+        names.update(dict.fromkeys(data))
+    result = {}
+    for name in names:
+        if name == "time":
+            empty = np.empty(0, dtype="datetime64[ms]")
+        elif name == "device":
+            empty = np.empty(0, dtype=str)
+        else:
+            empty = np.empty(0, dtype=float)
+        result[name] = np.concatenate(
+            [data.get(name, np.full(len(data["time"]), np.nan)) for data in parts]
+        ) if parts else empty
+    result["device"] = result["device"].astype(str)
+    return result
+
+
+def load_export(path, columns=None, *, since=None, until=None) -> np.ndarray:
+    """An export (see `export`) as NumPy record array, e.g. `data["NH3.avg"]`"""
+    data = load_columns(path, columns, since=since, until=until)
+    return np.rec.fromarrays(list(data.values()), names=list(data))
+
+
+def load_dataframe(path, columns=None, *, since=None, until=None):
+    """An export as pandas DataFrame (needs pandas), the devices as categories"""
+    import pandas as pd
+
+    data = load_columns(path, columns, since=since, until=until)
+    frame = pd.DataFrame(data, copy=False)
+    frame["device"] = frame["device"].astype("category")
+    return frame
+
+
+def main():
+    import dotenv
+
+    from .db_connect import connect_to_db
+
+    parser = argparse.ArgumentParser(prog="export")
+    parser.add_argument("output", help="Directory for the parts of the export")
+    parser.add_argument("--mode", default="documents", choices=[m.value for m in StorageMode])
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat, default=None)
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat, default=None)
+    parser.add_argument("--device", action="append", default=None, help="Only this device (repeatable)")
+    parser.add_argument("--gas", action="append", default=None, help="Only this gas (repeatable)")
+    parser.add_argument("--format", default=None, choices=FORMATS, help="Default: parquet with pyarrow, else npz")
+    parser.add_argument("--chunk-size", type=int, default=20_000, help="Rows per part")
+    parser.add_argument("--no-compress", action="store_true", help="Larger files, faster to load")
+    args = parser.parse_args()
+
+    # Load environment variables from .env file
+    dotenv.load_dotenv()
+
+    with connect_to_db(os.getenv("MONGODB_URI"), StorageMode(args.mode)) as collection:
+        total = export(
+            collection,
+            args.output,
+            StorageMode(args.mode),
+            since=args.since,
+            until=args.until,
+            devices=args.device,
+            gases=args.gas,
+            format=args.format,
+            chunk_size=args.chunk_size,
+            compress=not args.no_compress,
+            progress=lambda rows, time: print(f"{rows} documents exported (until {time})"),
+        )
+    print(f"{total} documents exported to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Time-weighted exposure per gas, like the occupational exposure limits:
+- TWA: average over the last 8 hours, always divided by 8 hours (before the start counts as no exposure)
+- STEL: average over the last 15 minutes
+- rate of rise: increase in ppm per minute over the last minute
+Every sample holds its concentration until the next one (at most `max_gap` seconds). The integral (ppm·s) is kept
+as prefix-sums at the bucket-boundaries in a ring, so a sample costs O(1) and the memory is constant,
+independent of the length of the window (8 hours with 1-minute buckets: 481 prefix-sums per gas).
+"""
+import collections
+import dataclasses
+import math
+
+
+@dataclasses.dataclass(frozen=True)
+class ExposureLimits:
+    twa: float | None = None  # 8-hour time-weighted average
+    stel: float | None = None  # 15-minute short-term exposure limit
+    rise: float | None = None  # Rate of rise in ppm per minute
+
+    @property
+    def enabled(self) -> bool:
+        return any(limit is not None for limit in (self.twa, self.stel, self.rise))
+
+
+class SlidingIntegral:
+    """Integral over the last `seconds`, the start of the window has a resolution of `bucket` seconds"""
+
+    def __init__(self, seconds: float, bucket: float):
+        self.seconds = seconds
+        self.bucket = bucket
+        self.total = 0.0  # Integral since the start
+        # (bucket-index, total at the start of the bucket) of the buckets in the window
+        self._prefix = collections.deque(maxlen=math.ceil(seconds / bucket) + 1)
+
+
+    def _advance(self, index: int):
+        if self._prefix and index <= self._prefix[-1][0]:
+            return
+        # Buckets without samples get the same prefix-sum, at most one window of them is kept anyway
+        first = index if not self._prefix else max(self._prefix[-1][0] + 1, index - self._prefix.maxlen + 1)
+        for i in range(first, index + 1):
+            self._prefix.append((i, self.total))
+
+
+    def add(self, start: float, end: float, value: float):
+        """`value` from time `start` to `end` (split at the bucket-boundaries)"""
+        t = start
+        while t < end:
+            index = int(t // self.bucket)
+            self._advance(index)
+            boundary = min(end, (index + 1) * self.bucket)
+            self.total += value * (boundary - t)
+            t = boundary
+
+
+    def integral(self, now: float) -> float:
+        """Integral from the start of the oldest bucket in the window until `now`"""
+        self._advance(int(now // self.bucket))
+        return self.total - self._prefix[0][1]
+
+
+    def restore(self, intervals):
+        """Add (start, end, value) from before the first `add`, e.g. from the stored aggregates after a restart"""
+        restored = SlidingIntegral(self.seconds, self.bucket)
+        for start, end, value in intervals:
+            restored.add(start, end, value)
+        if not restored._prefix:
+            return
+        if not self._prefix:
+            self._prefix, self.total = restored._prefix, restored.total
+            return
+        first = self._prefix[0][0]
+        prefix = [entry for entry in restored._prefix if entry[0] < first]
+        # The buckets must stay contiguous, the ones between the restored and the first sample have no exposure
+        last = prefix[-1][0] if prefix else first - 1
+        prefix += [(i, restored.total) for i in range(max(last + 1, first - self._prefix.maxlen), first)]
+        prefix += [(index, total + restored.total) for index, total in self._prefix]
+        self._prefix = collections.deque(prefix, maxlen=self._prefix.maxlen)
+        self.total += restored.total
+
+
+class RateOfRise:
+    """Difference of the average of the newest and the oldest bucket in the window, in units per minute"""
+
+    def __init__(self, seconds: float = 60, bucket: float = 5):
+        self.bucket = bucket
+        self._buckets = collections.deque(maxlen=math.ceil(seconds / bucket) + 1)  # [index, sum, count]
+        self._min_span = math.ceil(seconds / bucket) // 2  # Buckets, before there is a rate
+
+
+    def add(self, time: float, value: float):
+        index = int(time // self.bucket)
+        if self._buckets and self._buckets[-1][0] == index:
+            self._buckets[-1][1] += value
+            self._buckets[-1][2] += 1
+        else:
+            self._buckets.append([index, value, 1])
+        while self._buckets[0][0] < index - self._buckets.maxlen + 1:
+            self._buckets.popleft()
+
+
+    @property
+    def value(self) -> float | None:
+        if not self._buckets:
+            return None
+        (first, first_sum, first_count), (last, last_sum, last_count) = self._buckets[0], self._buckets[-1]
+        if last - first < self._min_span:
+            return None
+        return (last_sum / last_count - first_sum / first_count) / ((last - first) * self.bucket) * 60
+
+
+class GasExposure:
+    def __init__(self, limits: ExposureLimits, *, twa_seconds, stel_seconds, max_gap):
+        self.limits = limits
+        self.max_gap = max_gap
+        self.twa_integral = SlidingIntegral(twa_seconds, 60)
+        self.stel_integral = SlidingIntegral(stel_seconds, 10)
+        self.rise = RateOfRise()
+        self.first = None  # Time of the first sample, restored exposure must end before it
+        self.last = None  # (time, value) of the last sample
+
+
+    def add(self, time: float, value: float):
+        if self.last is not None:
+            last_time, last_value = self.last
+            end = min(time, last_time + self.max_gap)  # After a longer gap the exposure is unknown
+            self.twa_integral.add(last_time, end, last_value)
+            self.stel_integral.add(last_time, end, last_value)
+        else:
+            self.first = time
+        self.last = (time, value)
+        self.rise.add(time, value)
+
+
+    def values(self, time: float) -> dict[str, float | None]:
+        return dict(
+            twa=self.twa_integral.integral(time) / self.twa_integral.seconds,
+            stel=self.stel_integral.integral(time) / self.stel_integral.seconds,
+            rise=self.rise.value,
+        )
+
+
+class ExposureTracker:
+    """TWA, STEL and rate of rise of the gases with ExposureLimits, `add` returns the exceeded limits"""
+
+    def __init__(self, limits: dict[str, ExposureLimits], *, twa_seconds=8 * 3600, stel_seconds=15 * 60, max_gap=60):
+        self.twa_seconds = twa_seconds
+        self.gases = {
+            name: GasExposure(gas_limits, twa_seconds=twa_seconds, stel_seconds=stel_seconds, max_gap=max_gap)
+            for name, gas_limits in limits.items()
+            if gas_limits is not None and gas_limits.enabled
+        }
+        self.values = {}  # Gas -> latest exposure-values (see GasExposure.values)
+
+
+    def add(self, name: str, value: float, time: float) -> list[str]:
+        gas = self.gases.get(name)
+        if gas is None:
+            return []
+        gas.add(time, value)
+        values = self.values[name] = gas.values(time)
+        return [
+            kind
+            for kind in ("twa", "stel", "rise")
+            if (limit := getattr(gas.limits, kind)) is not None and values[kind] is not None and values[kind] > limit
+        ]
+
+
+    def restore(self, name: str, intervals):
+        """(start, end, average) in time-order from before the first sample, e.g. the 1-minute rollups"""
+        gas = self.gases.get(name)
+        if gas is None:
+            return
+        intervals = list(intervals)
+        gas.twa_integral.restore(intervals)
+        gas.stel_integral.restore(intervals)
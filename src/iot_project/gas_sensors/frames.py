@@ -0,0 +1,102 @@
+"""
+Vectorized decoding of many response-frames at once (e.g. raw captures of days)
+The frames are decoded directly from a contiguous buffer with a NumPy structured dtype:
+header-, command- and checksum-validation, concentration and thermistor-temperature
+for all frames in a few array-operations instead of one struct.unpack per frame.
+"""
+import binascii
+
+import numpy as np
+
+from .multigas_sensors import CmdCode, MultiGasSensor, SensorType
+
+FRAME_SIZE = 9
+
+# Layout of a read_all-response: FF, code, concentration (big-endian), sensor-type, decimal-places, temperature, checksum
+frame_dtype = np.dtype(
+    [
+        ("header", "u1"),
+        ("code", "u1"),
+        ("concentration", ">u2"),
+        ("sensor_type", "u1"),
+        ("decimal_places", "u1"),
+        ("temperature", ">u2"),
+        ("check_sum", "u1"),
+    ]
+)
+assert frame_dtype.itemsize == FRAME_SIZE
+
+reading_dtype = np.dtype(
+    [
+        ("concentration", "<f8"),  # ppm
+        ("sensor_type", "u1"),
+        ("temperature", "<f8"),  # degree Celsius
+        ("valid", "?"),
+    ]
+)
+
+
+def as_frames(buffer) -> np.ndarray:
+    """Zero-copy view of a buffer (bytes, bytearray, memoryview, mmap, uint8-array) as frames"""
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    if raw.size % FRAME_SIZE:
+        raise ValueError(f"Buffer of {raw.size} bytes is not a multiple of {FRAME_SIZE}")
+    return raw.view(frame_dtype)
+
+
+def check_sums(frames: np.ndarray) -> np.ndarray:
+    """MultiGasSensor.calc_check_sum over bytes 1..6 of every frame"""
+    data = frames.view(np.uint8).reshape(-1, FRAME_SIZE)[:, 1:7]
+    return (-data.sum(axis=1, dtype=np.int64) & 0xFF).astype(np.uint8)
+
+
+def thermistor_temperatures(temperature_raw: np.ndarray) -> np.ndarray:
+    """Vectorized multigas_sensors.thermistor_temperature, invalid raw-values result in NaN"""
+    Vpd3 = 3 * np.asarray(temperature_raw, dtype=np.float64) / 1024
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Rth = Vpd3 * 10000 / (3 - Vpd3)
+        temperature = 1 / (1 / (273.15 + 25) + 1 / 3380.13 * np.log(Rth / 10000)) - 273.15
+    return np.where(np.isfinite(temperature), temperature, np.nan)
+
+
+def validate(frames: np.ndarray, code: CmdCode = CmdCode.read_all, expected_sensor_type: SensorType | None = None) -> np.ndarray:
+    valid = (frames["header"] == 0xFF) & (frames["code"] == code.value) & (frames["check_sum"] == check_sums(frames))
+    if expected_sensor_type is not None:
+        valid &= frames["sensor_type"] == expected_sensor_type.value
+    return valid
+
+
+def decode_frames(buffer, code: CmdCode = CmdCode.read_all, expected_sensor_type: SensorType | None = None) -> np.ndarray:
+    """
+    Decode all read_all-responses in `buffer` (n * 9 bytes) to an array of `reading_dtype`
+    Invalid frames are not raised, they have valid=False (see `frame_errors` for the reason)
+    """
+    frames = as_frames(buffer)
+    readings = np.empty(len(frames), dtype=reading_dtype)
+    readings["concentration"] = frames["concentration"] * 10.0 ** -frames["decimal_places"].astype(np.float64)
+    readings["sensor_type"] = frames["sensor_type"]
+    readings["temperature"] = thermistor_temperatures(frames["temperature"])
+    readings["valid"] = validate(frames, code, expected_sensor_type)
+    return readings
+
+
+def frame_error(frame: bytes, code: CmdCode = CmdCode.read_all, expected_sensor_type: SensorType | None = None) -> str | None:
+    """Same checks and messages as MultiGasSensor.check_response / decode_all for a single frame"""
+    result_str = binascii.hexlify(frame, " ", 1).decode()
+    if frame[0] != 0xFF:
+        return f"Invalid header ({result_str})"
+    if frame[1] != code.value:
+        return f"Unexpected command-code 0x{frame[1]:02x} ({result_str})"
+    check_sum = MultiGasSensor.calc_check_sum(frame[1:-2])
+    if frame[8] != check_sum:
+        return f"CRC failure: received 0x{frame[8]:02x}, calculated 0x{check_sum:02x}, ({result_str})"
+    if expected_sensor_type is not None and frame[4] != expected_sensor_type.value:
+        return f"Unexpected sensor-type 0x{frame[4]:02x}, expected {expected_sensor_type.name} ({result_str})"
+    return None
+
+
+def frame_errors(buffer, readings: np.ndarray, code: CmdCode = CmdCode.read_all, expected_sensor_type: SensorType | None = None):
+    """(index, message) of the invalid frames, the messages are only built here and only for these frames"""
+    raw = np.frombuffer(buffer, dtype=np.uint8).reshape(-1, FRAME_SIZE)
+    for index in np.flatnonzero(~readings["valid"]):
+        yield int(index), frame_error(raw[index].tobytes(), code, expected_sensor_type)
@@ -1,131 +1,408 @@
 import datetime
 import os
+import socket
+from time import perf_counter
 
 import trio
-import anyio
-import numpy as np
 
-from .multigas_sensors import MultiGasSensor, SensorType
-from .alert_handling import AlertManager
-from .db_connect import connect_to_db, represent_for_mongodb
+from .multigas_sensors import MultiGasSensor
+from .sensor_bus import SensorBus
+from .aggregation import StreamingAggregator
+from .alert_handling import AlertManager, gas_leds, other_sensor
+from .exposure import ExposureLimits
+from .topology import Topology, default_topology, load_topology
+from .health import SensorHealth, SensorState, error_type
+from .scheduler import AdaptiveScheduler
+from .documents import AggregationEncoder, StorageMode
+from .db_writer import BufferedWriter
+from .spool import Spool
+from .publisher import LatestReading
+from .. import logs, metrics
+
+DEFAULT_SPOOL_DIR = os.path.expanduser("~/.iot_project/spool")
+
+log = logs.get_logger(__name__)
+sensor_failures_total = metrics.counter(
+    "iot_sensor_failures_total", "Failed measurements per sensor and error-type", labels=("sensor", "error")
+)
+sensor_retries_total = metrics.counter(
+    "iot_sensor_retries_total", "Polls of a sensor after a failure (retries and probes)", labels=("sensor",)
+)
+
+
+class SamplingSystem:
+    """
+    Measures all sensors of the topology (default: the board of the project, see topology.py) and checks the alerts:
+    every I2C-bus has its own measurement-task, so a slow bus or a failing sensor doesn't delay the others.
+    With `adaptive` (default: from the topology) the intervals follow the gas-levels, see scheduler.py.
+    The aggregation-windows are handed to `_aggregate`, that is left to the subclasses: MonitoringSystem stores them,
+    the SafetySystem of the multi-process mode (see workers.py) hands them to the storage-process.
+    `mongo_uri` is only read, to restore the exposure after a restart.
+    """
+
+    def __init__(
+        self,
+        mongo_uri,
+        *,
+        topology: Topology | None = None,
+        measurement_interval: float | None = None,
+        aggregation_interval: float | None = None,
+        adaptive: bool | None = None,
+        device: str | None = None,
+        capture_dir=None,
+    ):
+        self.mongo_uri = mongo_uri
+        self.device = socket.gethostname() if device is None else device
+        self.topology = default_topology(self.device) if topology is None else topology
+        self.measurement_interval = (
+            self.topology.measurement_interval if measurement_interval is None else measurement_interval
+        )
+        self.aggregation_interval = (
+            self.topology.aggregation_interval if aggregation_interval is None else aggregation_interval
+        )
 
-i2cbus = 1
-NH3_ADDRESS = 0x75
-CO_ADDRESS = 0x76
-O2_ADDRESS = 0x77
+        configs = self.topology.sensors
+        self.sensors = {
+            c.name: MultiGasSensor(c.bus, c.address, c.sensor_type) for c in configs
+        }
+        self.buses = {
+            bus_number: self._sensor_bus({c.name: self.sensors[c.name] for c in bus_configs})
+            for bus_number, bus_configs in self.topology.buses().items()
+        }
+        self.health = {name: SensorHealth(seed=name) for name in self.sensors}
+        limits = {c.name: (c.above, c.below) for c in configs}
+        self.alert_manager = AlertManager(
+            limits=limits,
+            leds={c.name: gas_leds.get(c.sensor_type, other_sensor) for c in configs},
+            exposure={c.name: ExposureLimits(c.twa, c.stel, c.rise) for c in configs},
+        )
+        self.scheduler = AdaptiveScheduler(
+            limits,
+            self.measurement_interval,
+            self.aggregation_interval,
+            adaptive=self.topology.adaptive if adaptive is None else adaptive,
+            min_measurement_interval=MultiGasSensor.settle_time,
+        )
+        self.aggregators = {k: StreamingAggregator() for k in self.sensors}
+        self._windows = {}  # Aggregation-interval -> results of the buses, until all buses are done
+        self.first_sample = trio.Event()
+        self.boot_timeout = 2.0  # Seconds main_task waits for the first sample, before it starts the rest anyway
+        self.meta = {
+            device: dict(device=device, sensors={c.name: c.meta for c in device_configs})
+            for device, device_configs in self.topology.devices.items()
+        }
+        # With a capture-directory every raw frame is recorded for a replay (see replay.py)
+        self.capture_dir = capture_dir
+        self.recorder = None
+
+        metrics.callback(
+            "iot_sensor_state",
+            "1 for the current health-state of every sensor",
+            lambda: {(k, state.value): int(h.state is state) for k, h in self.health.items() for state in SensorState},
+            labels=("sensor", "state"),
+        )
+        metrics.callback(
+            "iot_sampling_level", "Level of the adaptive scheduler (0: calm, 1: normal, 2: fast)", lambda: int(self.scheduler.level)
+        )
 
 
-class MonitoringSystem:
+    def _sensor_bus(self, sensors: dict[str, MultiGasSensor]) -> SensorBus:
+        return SensorBus(sensors)
 
-    def __init__(self, mongo_uri, *, measurement_interval=0.1, aggregation_interval=0.5):
-        self.mongo_uri = mongo_uri
-        self.alert_manager = AlertManager()
-        self.measurement_interval = measurement_interval
-        self.aggregation_interval = aggregation_interval
-        self.sensors = dict(
-            NH3=MultiGasSensor(i2cbus, NH3_ADDRESS, SensorType.NH3),
-            CO=MultiGasSensor(i2cbus, CO_ADDRESS, SensorType.CO),
-            O2=MultiGasSensor(i2cbus, O2_ADDRESS, SensorType.O2),
-        )
 
+    def _exposure_history(self, gases, since: datetime.datetime):
+        import pymongo
+        from .rollups import minute_averages
 
-    async def main_task(self):
-        async with trio.open_nursery() as nursery:
-            nursery.start_soon(self.alert_manager.alert_loop)
-            nursery.start_soon(self.measurement_loop)
+        with pymongo.MongoClient(self.mongo_uri, serverSelectionTimeoutMS=10_000) as client:
+            return minute_averages(client["IoT-Project"], self.meta, gases, since)
+
+
+    async def restore_exposure(self):
+        """
+        After a restart: the exposure of the hours before from the 1-minute rollups (best effort, without DB it starts at 0)
+        Only the minutes before the first sample are added, the rest is already counted by the running exposure
+        """
+        exposure = self.alert_manager.exposure
+        if self.mongo_uri is None or not exposure.gases:
+            return
+        since = self.now() - datetime.timedelta(seconds=exposure.twa_seconds)
+        try:
+            history = await trio.to_thread.run_sync(self._exposure_history, list(exposure.gases), since)
+        except Exception as ex:
+            log.warning("exposure-restore-failed", error=repr(ex))
+            return
+        for gas, minutes in history.items():
+            first = exposure.gases[gas].first
+            exposure.restore(gas, [m for m in minutes if first is None or m[1] <= first])
+        log.info("exposure-restored", minutes={gas: len(minutes) for gas, minutes in history.items()})
 
 
     def __enter__(self):
+        if self.capture_dir is not None:
+            from .capture import FrameRecorder
+
+            self.recorder = FrameRecorder(self.capture_dir, self.device)
+            for sensor in self.sensors.values():
+                sensor.recorder = self.recorder
         self.alert_manager.__enter__()
 
 
     def __exit__(self, type, value, tb):
+        if self.recorder is not None:
+            for sensor in self.sensors.values():
+                sensor.recorder = None
+            self.recorder.close()
+            self.recorder = None
         return self.alert_manager.__exit__(type, value, tb)
 
 
-    def aggregate_data(self, alldata: list[tuple[float, float]]) -> dict[str, float]: # tuple(time, data)        
-        if not alldata:
-            # Sensor seems to be failing for the whole Aggregation-Intervall (no data)
-            aggregation = dict(
-                min=None,
-                max=None,
-                avg=None,
-            )
+    def now(self) -> datetime.datetime:
+        """Time of a measurement (the replay uses the time of the recorded frames instead)"""
+        return datetime.datetime.now().astimezone(None).astimezone(datetime.timezone.utc)
 
-        else:
-            data = np.array([data for time, data in alldata])
 
-            min = data.min()
-            max = data.max()
-            avg = data.mean()
+    async def measurement_loop(self):
+        start = trio.current_time()
+        self.scheduler.start(start)
+        async with trio.open_nursery() as nursery:
+            for bus in self.buses.values():
+                nursery.start_soon(self.bus_loop, bus, start)
+
+
+    async def bus_loop(self, bus: SensorBus, start: float):
+        """Measurement-loop of the sensors on one I2C-bus"""
+        scheduler = self.scheduler
+        next_measurement = start + scheduler.rate.measurement_interval
+        window = 0
+        bus_number = next(iter(bus.sensors.values())).bus_number
+        iteration_seconds = metrics.loop_iteration_seconds.labels(loop=f"bus-{bus_number}")
+
+        while True:
+            time = None
+            polls = 0
+
+            # The end of the window can move forward, if the scheduler gets faster
+            while trio.current_time() < scheduler.window_end(window):
+                time = self.now()
+
+                # Failed sensors are skipped during their backoff, offline sensors are only probed now and then
+                now = trio.current_time()
+                names = [k for k in bus.sensors if self.health[k].should_poll(now)]
+                if not names:
+                    await trio.sleep(scheduler.rate.measurement_interval)
+                    continue
+
+                for k in names:
+                    if self.health[k].failures:
+                        sensor_retries_total.labels(sensor=k).inc()
+                iteration_start = perf_counter()
+                results = await bus.poll(names)
+                polls += 1
+                errors = {}
+                timestamp = time.timestamp()
+
+                for k, result in results.items():
+                    if isinstance(result, Exception):
+                        # No re-try within the measurement, that would delay the other sensors on the bus
+                        error = errors[k] = error_type(result)
+                        self.aggregators[k].add_failure(error.value)
+                        sensor_failures_total.labels(sensor=k, error=error.value).inc()
+                        self._state_changed(k, self.health[k].failure(trio.current_time(), error))
+                        continue
 
-            aggregation = dict(
-                min=min,
-                max=max,
-                avg=avg,
-            )
+                    self._state_changed(k, self.health[k].success())
+                    value = result.gas_concentration
+                    self.aggregators[k].add(value)
+                    self.alert_manager.check_alerts(timestamp, **{k: value})
+                    scheduler.update(k, value, trio.current_time())
+
+                if len(errors) < len(results) and not self.first_sample.is_set():
+                    self.first_sample.set()
+                self._record_sample(window, time, results, errors)
+                iteration_seconds.observe(perf_counter() - iteration_start)
+
+                # Wait until the next measurement
+                await self._sleep_until(next_measurement)
+                next_measurement = min(next_measurement, trio.current_time()) + scheduler.rate.measurement_interval
+
+            self._aggregate(bus, window, time, polls)
+            window += 1
+
+
+    async def _sleep_until(self, deadline: float):
+        """Until the deadline, or until the scheduler switches to a faster level"""
+        if not self.scheduler.adaptive:
+            await trio.sleep_until(deadline)
+            return
+        with trio.move_on_at(deadline):
+            await self.scheduler.faster.wait()
+
+
+    def _record_sample(self, window: int, time: datetime.datetime, results: dict, errors: dict):
+        """Raw values of one poll (results: sensor -> SensorData or the exception, errors: sensor -> ErrorType)"""
+
+
+    def _state_changed(self, name, previous: SensorState | None):
+        if previous is not None:
+            log.warning("sensor-state", sensor=name, previous=previous.value, state=self.health[name].state.value)
+
+
+    def _aggregate(self, bus: SensorBus, window: int, time: datetime.datetime | None, polls: int):
+        """A bus is done with an aggregation-window (its aggregators hold the samples of the window)"""
+        raise NotImplementedError
+
+
+class MonitoringSystem(SamplingSystem):
+    """
+    SamplingSystem, that stores the aggregations: per aggregation-interval one document per device,
+    with the device- and sensor-metadata, to the DB-writer and the HTTP-server (/latest, /events, /metrics).
+    main_task starts in stages: alarm and sampling first, the DB-writer and the HTTP-server after the first sample,
+    so the numpy- and pymongo-imports don't delay the alarm (`first_sample` is set when the first value was checked).
+    """
+
+    def __init__(
+        self,
+        mongo_uri,
+        *,
+        spool_dir=None,
+        storage: StorageMode = StorageMode.documents,
+        http_port: int | None = 8080,
+        mqtt_host: str | None = None,
+        **kwargs,
+    ):
+        super().__init__(mongo_uri, **kwargs)
+        # Raw samples of the last 10 minutes for diagnostics and the dashboard (created by main_task after the first sample)
+        self.samples = None
+        self.encoders = {
+            device: AggregationEncoder(c.name for c in device_configs)
+            for device, device_configs in self.topology.devices.items()
+        }
+        self.writer = self._writer(mongo_uri, spool_dir, storage)
+        # Latest aggregation for the dashboards (HTTP/Server-Sent-Events and optional MQTT)
+        self.latest = LatestReading()
+        self.http_port = http_port
+        self.mqtt_host = mqtt_host
+
+
+    def _writer(self, mongo_uri, spool_dir, storage: StorageMode) -> BufferedWriter:
+        # With a spool-directory every document is stored on the disk first and replayed to the DB from there
+        return BufferedWriter(
+            mongo_uri,
+            queue=None if spool_dir is None else Spool(spool_dir),
+            mode=storage,
+        )
 
-        return aggregation
 
+    def _sample_ring(self):
+        from .ring_buffer import SampleRing
 
-    async def measurement_loop(self):
+        fastest = min(rate.measurement_interval for rate in self.scheduler.rates.values())
+        return SampleRing(self.sensors, seconds=600, rate=len(self.buses) / max(fastest, MultiGasSensor.settle_time))
 
-        next_measurement = trio.current_time() + self.measurement_interval
-        next_aggregation = trio.current_time() + self.aggregation_interval
-
-        with connect_to_db(self.mongo_uri) as collection:
-
-            while True:
-                all_data = {k: [] for k in self.sensors}
-                time = None
-                data = {}
-                
-                while trio.current_time() < next_aggregation:                    
-                    time = (
-                        datetime.datetime.now()
-                        .astimezone(None)
-                        .astimezone(datetime.timezone.utc)
-                    )
-                    
-                    for k, v in self.sensors.items():
-                        if k in data:
-                            # If some Sensors fail, there is a re-try. If k is in data, then this Sensor was already successful
-                            continue
-                        try:
-                            result = v.read_all().gas_concentration
-                        except Exception as ex:
-                            #print(f'{ex!r} - retry')
-                            continue
-                        
-                        data[k] = result
-                        all_data[k].append((time, result))
-                        self.alert_manager.check_alerts(
-                            **{k.lower(): result}
-                        )
-
-                    if len(data) < len(self.sensors):
-                        # If not all Sensors have data, there is a re-try after 0.05 seconds
-                        await trio.sleep(0.05)
-                        continue
 
+    async def main_task(self):
+        async with trio.open_nursery() as nursery:
+            # Stage 1: alarm and sampling, nothing else competes for the first second
+            nursery.start_soon(self.alert_manager.alert_loop)
+            nursery.start_soon(self.measurement_loop)
+            with trio.move_on_after(self.boot_timeout):
+                await self.first_sample.wait()
+
+            # Stage 2: the heavy imports run in worker-threads, the sampling goes on meanwhile
+            if self.samples is None:
+                self.samples = await trio.to_thread.run_sync(self._sample_ring)
+            nursery.start_soon(self.writer.run)
+            nursery.start_soon(self.restore_exposure)
+            nursery.start_soon(metrics.measure_scheduling_lag)
+            if self.http_port is not None:
+                nursery.start_soon(self.latest.serve, self.http_port)
+
+
+    def __enter__(self):
+        super().__enter__()
+        if self.mqtt_host is not None:
+            self.latest.connect_mqtt(self.mqtt_host, f"iot_project/{self.device}")
+
+
+    def __exit__(self, type, value, tb):
+        self.latest.disconnect_mqtt()
+        self.writer.close()
+        return super().__exit__(type, value, tb)
+
+
+    def _record_sample(self, window: int, time: datetime.datetime, results: dict, errors: dict):
+        if self.samples is not None:
+            raw = {k: (r.gas_concentration, r.temperature) for k, r in results.items() if k not in errors}
+            self.samples.append(int(time.timestamp() * 1e9), raw)
+
+
+    def _aggregate(self, bus: SensorBus, window: int, time: datetime.datetime | None, polls: int):
+        """Results of the sensors of one bus, the documents are stored when all buses are done with the interval"""
+        pending = self._windows.setdefault(window, dict(results={}, errors={}, buses=0, time=time, polls=0))
+        for k in bus.sensors:
+            pending["results"][k] = self.aggregators[k].result()
+            if self.aggregators[k].errors:
+                pending["errors"][k] = self.aggregators[k].errors
+            self.aggregators[k].reset()
+        pending["buses"] += 1
+        pending["polls"] = max(pending["polls"], polls)
+        if time is not None and (pending["time"] is None or time > pending["time"]):
+            pending["time"] = time
+        if pending["buses"] < len(self.buses):
+            return
+
+        del self._windows[window]
+        duration, level = self.scheduler.close(window)
+        self._store(
+            pending["results"],
+            pending["errors"],
+            health={k: h.state.value for k, h in self.health.items()},
+            time=pending["time"] or self.now(),
+            sampling=sampling_info(level, pending["polls"], duration),
+        )
+
+
+    def _store(self, results: dict, errors: dict, *, health: dict, time: datetime.datetime, sampling: dict):
+        """One document per device for an aggregation-window, to the DB-writer and /latest"""
+        documents = encode_documents(
+            self.encoders, self.meta, results, errors, health=health, time=time, sampling=sampling
+        )
+        for document in documents.values():
+            self.writer.put(document)
+        # With several devices, /latest is an object with the latest document per device
+        self.latest.publish(next(iter(documents.values())) if len(documents) == 1 else documents)
+
+
+def encode_documents(encoders, meta, results, errors, *, health, time, sampling) -> dict[str, dict]:
+    """Documents of an aggregation-window per device (results, errors and health per sensor)"""
+    documents = {}
+    for device, encoder in encoders.items():
+        aggregation = {k: results[k] for k in encoder.gases}
+        aggregation.update(
+            time=time,
+            meta=meta[device],
+            health={k: health[k] for k in encoder.gases},
+            errors={k: errors[k] for k in encoder.gases if k in errors},
+            sampling=sampling,
+        )
+
+        missing = [k for k in encoder.gases if aggregation[k]["count"] == 0]
+        if missing:
+            log.warning("sensor-problem", device=device, no_data=missing, errors=aggregation["errors"])
+        documents[device] = encoder.encode(aggregation)
 
-                    # If there are data from all the sensors, we wait until the next measurement
-                    await anyio.sleep_until(next_measurement)
-                    next_measurement += self.measurement_interval
-                    
-                    # Empty the Data-Set, so all Sensors are measured again
-                    data = {}
+        log.debug("aggregation", aggregation=aggregation)
+    return documents
 
-                # Aggregate Data
-                next_aggregation += self.aggregation_interval
-                aggregation = {k: self.aggregate_data(v) for k, v in all_data.items()}
-                aggregation.update(time=time)
-                
-                if any(v is None for v in aggregation.values()):
-                    print(f"Sensor-Problem: {aggregation}")
-                collection.insert_one(represent_for_mongodb(aggregation))
 
-                print(aggregation)
+def sampling_info(level, polls: int, duration: float) -> dict:
+    """`sampling` of the documents, the effective rate is the measurements per second of the busiest bus"""
+    return dict(
+        level=level.name,
+        rate=round(polls / duration, 3) if duration > 0 else None,
+        interval=round(duration, 3),
+    )
 
 
 async def main():
@@ -133,11 +410,22 @@ async def main():
 
     # Load environment variables from .env file
     dotenv.load_dotenv()
+    logs.setup_logging()
 
     # Get MongoDB-URI
     mongo_uri = os.getenv("MONGODB_URI")
 
-    system = MonitoringSystem(mongo_uri)
+    config_file = os.getenv("CONFIG_FILE")
+
+    system = MonitoringSystem(
+        mongo_uri,
+        topology=None if config_file is None else load_topology(config_file),
+        spool_dir=os.getenv("SPOOL_DIR", DEFAULT_SPOOL_DIR),
+        storage=StorageMode(os.getenv("STORAGE_MODE", "documents")),
+        http_port=int(os.getenv("HTTP_PORT", 8080)),
+        mqtt_host=os.getenv("MQTT_HOST"),
+        capture_dir=os.getenv("CAPTURE_DIR"),
+    )
 
     with system:
         await system.main_task()
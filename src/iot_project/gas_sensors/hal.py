@@ -0,0 +1,44 @@
+"""
+Hardware-Abstraction for the I2C-Bus and the GPIO-Pins
+Backend "pi" (default) uses smbus and RPi.GPIO, backend "sim" the in-process simulator (see simulation.py),
+backend "replay" the frames of a capture (capture.player, see replay.py) with the simulated GPIO-Pins,
+selected with the environment variable IOT_PROJECT_HARDWARE or set_backend()
+"""
+import os
+
+backends = ("pi", "sim", "replay")
+backend = os.getenv("IOT_PROJECT_HARDWARE", "pi")
+
+
+def set_backend(name: str):
+    global backend
+    assert name in backends, name
+    backend = name
+
+
+def open_i2c_bus(bus_number: int):
+    """smbus.SMBus-compatible object (write_i2c_block_data/read_i2c_block_data)"""
+    if backend == "sim":
+        from .simulation import simulator
+
+        return simulator.bus(bus_number)
+    if backend == "replay":
+        from .capture import player
+
+        return player.bus(bus_number)
+
+    import smbus
+
+    return smbus.SMBus(bus_number)
+
+
+def gpio():
+    """RPi.GPIO-compatible module"""
+    if backend in ("sim", "replay"):
+        from .simulation import simulator
+
+        return simulator.gpio
+
+    import RPi.GPIO as GPIO
+
+    return GPIO
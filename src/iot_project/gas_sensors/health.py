@@ -0,0 +1,98 @@
+import collections
+import enum
+import random
+
+from .multigas_sensors import CRCError, HeaderError, SensorTypeError
+
+
+class SensorState(enum.Enum):
+    ok = "ok"
+    degraded = "degraded"  # Fails repeatedly, is retried with exponential backoff
+    offline = "offline"  # Circuit open: only probed every `probe_interval` seconds
+
+
+class ErrorType(enum.Enum):
+    crc = "crc"  # Checksum of the response wrong
+    header = "header"  # Start-byte or command-code of the response wrong
+    os_error = "os_error"  # I2C-transfer failed (e.g. Remote I/O error: no sensor at the address)
+    sensor_type = "sensor_type"  # Other or unknown SensorType than configured
+    other = "other"
+
+
+def error_type(ex: Exception) -> ErrorType:
+    match ex:
+        case CRCError():
+            return ErrorType.crc
+        case HeaderError():
+            return ErrorType.header
+        case SensorTypeError():
+            return ErrorType.sensor_type
+        case OSError():
+            return ErrorType.os_error
+        case _:
+            return ErrorType.other
+
+
+class SensorHealth:
+    """
+    Health of one sensor from its consecutive failures, with retry-policy and circuit-breaker:
+    ok -> degraded (after `degraded_after` failures in a row) -> offline (after `offline_after` failures in a row)
+    After a failure the sensor is skipped for an exponential backoff (`backoff` * 2^(n-1), at most `max_backoff`),
+    an offline sensor is only probed every `probe_interval` seconds, so it doesn't take bus-time from the other sensors.
+    All delays are jittered (50-100 %), so the retries of several sensors don't stay in step.
+    One successful measurement and it is ok again.
+    """
+
+    def __init__(
+        self,
+        *,
+        degraded_after=3,
+        offline_after=10,
+        backoff=0.1,
+        max_backoff=2.0,
+        probe_interval=5.0,
+        seed=None,
+    ):
+        self.degraded_after = degraded_after
+        self.offline_after = offline_after
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.probe_interval = probe_interval
+        self.random = random.Random(seed)  # Seeded per sensor, so a replay retries at the same times
+        self.state = SensorState.ok
+        self.failures = 0  # Consecutive
+        self.next_poll = 0.0
+        self.errors = collections.Counter()  # ErrorType.value -> count since the start
+
+
+    def should_poll(self, now: float) -> bool:
+        return now >= self.next_poll
+
+
+    def _change(self, state: SensorState) -> SensorState | None:
+        """Returns the previous state, if it changed"""
+        previous, self.state = self.state, state
+        return previous if previous is not state else None
+
+
+    def success(self) -> SensorState | None:
+        self.failures = 0
+        self.next_poll = 0.0
+        return self._change(SensorState.ok)
+
+
+    def failure(self, now: float, error: ErrorType = ErrorType.other) -> SensorState | None:
+        self.failures += 1
+        self.errors[error.value] += 1
+
+        if self.failures >= self.offline_after:
+            delay = self.probe_interval
+        else:
+            delay = min(self.backoff * 2 ** (self.failures - 1), self.max_backoff)
+        self.next_poll = now + delay * self.random.uniform(0.5, 1.0)
+
+        if self.failures >= self.offline_after:
+            return self._change(SensorState.offline)
+        if self.failures >= self.degraded_after:
+            return self._change(SensorState.degraded)
+        return None
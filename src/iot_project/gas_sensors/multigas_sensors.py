@@ -1,11 +1,16 @@
 import enum
+import functools
 import time
 import dataclasses
 import struct
 import math
 import binascii
+import threading
 
-import smbus
+import trio
+
+from . import hal
+from .. import metrics
 
 
 class CmdCode(enum.Enum):
@@ -29,6 +34,22 @@ class SensorType(enum.Enum):
     PH3 = 0x45
 
 
+class FrameError(AssertionError):
+    """Invalid response of a sensor (AssertionError, like the former asserts of check_response)"""
+
+
+class HeaderError(FrameError):
+    """Start-byte or command-code of the response wrong"""
+
+
+class CRCError(FrameError):
+    pass
+
+
+class SensorTypeError(FrameError):
+    """Unknown SensorType, or another than expected"""
+
+
 @dataclasses.dataclass
 class SensorData:
     gas_concentration: float  # ppm
@@ -36,21 +57,51 @@ class SensorData:
     temperature: float  # degree Celsius
 
 
+def thermistor_temperature(temperature_raw: int) -> float:
+    """Temperature in degree Celsius from the raw ADC-value (frames.thermistor_temperatures is the vectorized version)"""
+    Vpd3 = 3 * temperature_raw / 1024  # Spannung in Volt
+    Rth = (
+        Vpd3 * 10000 / (3 - Vpd3)
+    )  # Spannung mit Spannnungsteiler vonem 10k-Widerstand
+    return (
+        1 / (1 / (273.15 + 25) + 1 / 3380.13 * (math.log(Rth / 10000))) - 273.15
+    )  # Transfer-Kurve von temperaturfühler mit 10kOhm bei 25°C und alpha-Wert von 3380.13
+
+
+i2c_transfer_seconds = metrics.histogram(
+    "iot_i2c_transfer_seconds", "Duration of an I2C-transfer (including the wait for the bus-lock)", labels=("bus", "operation")
+)
+
+_bus_locks: dict[int, threading.Lock] = {}
+
+
+def bus_lock(bus_number: int) -> threading.Lock:
+    """One lock per I2C-Bus, so transfers from different threads never interleave"""
+    return _bus_locks.setdefault(bus_number, threading.Lock())
+
+
 class MultiGasSensor:
     """
     Class for all Gas-Sensors
     Adapted from https://github.com/DFRobot/DFRobot_MultiGasSensor
     """
 
+    settle_time = 0.1  # Time the sensor needs between command and response (s)
+
     def __init__(
         self,
         bus_number: int,
         i2c_address: int,
         expected_sensor_type: SensorType | None = None,
     ):
-        self.i2c_bus = smbus.SMBus(bus_number)
+        self.i2c_bus = hal.open_i2c_bus(bus_number)
+        self.bus_number = bus_number
         self.i2c_address = i2c_address
         self.expected_sensor_type = expected_sensor_type
+        self.lock = bus_lock(bus_number)
+        self.recorder = None  # capture.FrameRecorder, records every transfer for a later replay
+        self._write_seconds = i2c_transfer_seconds.labels(bus=bus_number, operation="write")
+        self._read_seconds = i2c_transfer_seconds.labels(bus=bus_number, operation="read")
 
 
     @classmethod
@@ -58,29 +109,86 @@ class MultiGasSensor:
         return (~sum(data) + 1) & 0xFF
 
 
-    def command(self, code: CmdCode, *args: bytes) -> bytes:
+    @classmethod
+    @functools.lru_cache(maxsize=64)
+    def command_frame(cls, code: CmdCode, *args: bytes) -> list[int]:
+        """Command-frame as list for smbus (cached and shared, must not be modified)"""
         data = bytes([0xFF, 0x01, code.value]) + b"".join(args)
         data += b"\x00" * (8 - len(data))
-        data += bytes([self.calc_check_sum(data[1:-1])])
-        self.i2c_bus.write_i2c_block_data(self.i2c_address, 0, list(data))
-        time.sleep(0.1)  # TO-DO: async-sleep machen
+        data += bytes([cls.calc_check_sum(data[1:-1])])
+        return list(data)
+
+
+    def send(self, code: CmdCode, *args: bytes):
+        """Write the command-frame to the sensor (first half of a command)"""
+        data = self.command_frame(code, *args)
+        start = time.perf_counter()
+        with self.lock:
+            try:
+                self.i2c_bus.write_i2c_block_data(self.i2c_address, 0, data)
+            except OSError:
+                if self.recorder is not None:
+                    self.recorder.record_write_error(self.bus_number, self.i2c_address)
+                raise
+            finally:
+                self._write_seconds.observe(time.perf_counter() - start)
+
+
+    def receive(self, code: CmdCode) -> bytes:
+        """Read and check the response-frame (second half of a command)"""
+        start = time.perf_counter()
+        with self.lock:
+            try:
+                result = bytes(self.i2c_bus.read_i2c_block_data(self.i2c_address, 0, 9))
+            except OSError:
+                if self.recorder is not None:
+                    self.recorder.record_read_error(self.bus_number, self.i2c_address)
+                raise
+            finally:
+                self._read_seconds.observe(time.perf_counter() - start)
+        if self.recorder is not None:
+            self.recorder.record(self.bus_number, self.i2c_address, result)  # Also invalid frames, before they are checked
+        return self.check_response(code, result)
 
-        result = self.i2c_bus.read_i2c_block_data(self.i2c_address, 0, 9)
-        result = bytes(result)
-        result_str = binascii.hexlify(result, " ", 1)
 
-        assert result[0] == 0xFF, result_str
-        assert result[1] == code.value, result_str
-        assert result[8] == self.calc_check_sum(
-            result[1:-2]
-        ), f"CRC failure: received 0x{result[8]:02x}, calculated 0x{self.calc_check_sum(result[1:-1]):02x}, ({result_str})"
+    def command(self, code: CmdCode, *args: bytes) -> bytes:
+        """Blocking command, e.g. for the notebooks"""
+        self.send(code, *args)
+        time.sleep(self.settle_time)
+        return self.receive(code)
+
+
+    async def command_async(self, code: CmdCode, *args: bytes) -> bytes:
+        """Same as `command`, but the transfers run in a worker-thread and the event-loop is not blocked during the settle-time"""
+        await trio.to_thread.run_sync(self.send, code, *args)
+        await trio.sleep(self.settle_time)
+        return await trio.to_thread.run_sync(self.receive, code)
+
+
+    def check_response(self, code: CmdCode, result: bytes) -> bytes:
+        # The messages are only formatted if the check fails
+        if result[0] != 0xFF:
+            raise HeaderError(f"Invalid header ({binascii.hexlify(result, ' ', 1).decode()})")
+        if result[1] != code.value:
+            raise HeaderError(f"Unexpected command-code 0x{result[1]:02x} ({binascii.hexlify(result, ' ', 1).decode()})")
+        check_sum = self.calc_check_sum(result[1:-2])
+        if result[8] != check_sum:
+            raise CRCError(
+                f"CRC failure: received 0x{result[8]:02x}, calculated 0x{check_sum:02x}, ({binascii.hexlify(result, ' ', 1).decode()})"
+            )
 
         return result[2:-1]
 
 
     def read_all(self) -> SensorData:
-        result = self.command(CmdCode.read_all)
+        return self.decode_all(self.command(CmdCode.read_all))
+
+
+    async def read_all_async(self) -> SensorData:
+        return self.decode_all(await self.command_async(CmdCode.read_all))
+
 
+    def decode_all(self, result: bytes) -> SensorData:
         # '>': big-endian encoded struct (MSB first: most significant byte first);
         # 'H': 2 Bytes unsigned integer ("half long integer")
         # 'B': 1 Byte unsigned integer  ("byte")
@@ -88,18 +196,14 @@ class MultiGasSensor:
             struct.unpack(">HBBH", result)
         )
         gas_concentration = gas_concentration_raw * 10**-decimal_places
-        sensor_type = SensorType(sensor_type)
-
-        Vpd3 = 3 * temperature_raw / 1024  # Spannung in Volt
-        Rth = (
-            Vpd3 * 10000 / (3 - Vpd3)
-        )  # Spannung mit Spannnungsteiler vonem 10k-Widerstand
-        temperature = (
-            1 / (1 / (273.15 + 25) + 1 / 3380.13 * (math.log(Rth / 10000))) - 273.15
-        )  # Transfer-Kurve von temperaturfühler mit 10kOhm bei 25°C und alpha-Wert von 3380.13
-
-        if self.expected_sensor_type is not None:
-            assert sensor_type == self.expected_sensor_type
+        try:
+            sensor_type = SensorType(sensor_type)
+        except ValueError:
+            raise SensorTypeError(f"Unknown sensor-type 0x{sensor_type:02x}") from None
+        temperature = thermistor_temperature(temperature_raw)
+
+        if self.expected_sensor_type is not None and sensor_type != self.expected_sensor_type:
+            raise SensorTypeError(f"Unexpected sensor-type {sensor_type.name}, expected {self.expected_sensor_type.name}")
 
         return SensorData(
             gas_concentration=gas_concentration,
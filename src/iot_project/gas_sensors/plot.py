@@ -73,3 +73,18 @@ def plot(handle, ds, time, ammonia, carbon_monoxide, oxygen):
         rollover=600,
     )  # Neue Daten werden an das Ende der Kolonnen angehängt, ab 600 werden die ältesten Daten herausgeworfen
     bk.io.push_notebook(handle=handle)
+
+
+def plot_samples(handle, ds, samples, seconds=None):
+    """
+    Show the raw samples of a SampleRing (e.g. MonitoringSystem.samples) instead of streaming single points
+    All columns are replaced at once as NumPy-arrays, so thousands of points are cheap
+    """
+    rows = samples.view() if seconds is None else samples.last_seconds(seconds)
+    ds.data = dict(
+        time=rows["time"].view("datetime64[ns]"),
+        nh3_level=rows["NH3"],
+        co_level=rows["CO"],
+        oxygenlevel=rows["O2"],
+    )
+    bk.io.push_notebook(handle=handle)
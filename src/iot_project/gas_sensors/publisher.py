@@ -0,0 +1,146 @@
+import datetime
+import json
+
+import trio
+
+from .. import metrics
+from ..tasks import keep_running
+
+
+def to_json(document) -> bytes:
+    def default(obj):
+        if isinstance(obj, datetime.datetime):
+            return obj.isoformat()
+        raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+    return json.dumps(document, default=default).encode()
+
+
+class MetricsServer:
+    """
+    HTTP GET /metrics: the metrics of all tasks of this process in the Prometheus text-format (see metrics.py)
+    Alone e.g. in the safety-process of the multi-process mode, that stores nothing (see workers.SafetySystem)
+    """
+
+    async def serve(self, port: int = 8080, *, task_status=trio.TASK_STATUS_IGNORED):
+        """HTTP-server, an error (e.g. the port is in use) is logged and the server started again (see keep_running)"""
+        await keep_running(f"http-{port}", self._serve, port, task_status=task_status)
+
+
+    async def _serve(self, port: int, *, task_status=trio.TASK_STATUS_IGNORED):
+        await trio.serve_tcp(self._handle, port, task_status=task_status)
+
+
+    async def _handle(self, stream: trio.SocketStream):
+        try:
+            request = b""
+            with trio.move_on_after(5):
+                while b"\r\n\r\n" not in request and len(request) < 8192:
+                    data = await stream.receive_some(4096)
+                    if not data:
+                        return
+                    request += data
+
+            method, path, *_ = request.split(b"\r\n", 1)[0].decode(errors="replace").split(" ") + [""]
+            path = path.split("?")[0]
+            if method != "GET":
+                await self._respond(stream, "405 Method Not Allowed", b"")
+            else:
+                await self._get(stream, path)
+        except trio.BrokenResourceError:
+            pass  # Client disconnected
+        finally:
+            await trio.aclose_forcefully(stream)
+
+
+    async def _get(self, stream, path: str):
+        if path == "/metrics":
+            await self._respond(stream, "200 OK", metrics.registry.render(), "text/plain; version=0.0.4")
+        else:
+            await self._respond(stream, "404 Not Found", b"")
+
+
+    @staticmethod
+    async def _respond(stream, status, body, content_type="application/json"):
+        header = (
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        await stream.send_all(header.encode() + body)
+
+
+class LatestReading(MetricsServer):
+    """
+    Holds the current aggregation for the dashboards, so they don't have to query the DB
+    - HTTP GET /latest: the latest aggregation as JSON
+    - HTTP GET /events: Server-Sent-Events, every new aggregation is pushed as soon as it is there
+    - HTTP GET /metrics: see MetricsServer
+    - MQTT (optional, needs paho-mqtt): retained message on `<topic>/latest`
+    """
+
+    def __init__(self):
+        self.payload = b"null"  # JSON of the latest aggregation, serialized only once per update
+        self.sequence = 0
+        self._updated = trio.Event()
+        self._mqtt = None
+
+
+    def publish(self, document):
+        self.payload = to_json(document)
+        self.sequence += 1
+        self._updated.set()
+        self._updated = trio.Event()
+
+        if self._mqtt is not None:
+            client, topic = self._mqtt
+            client.publish(f"{topic}/latest", self.payload, retain=True)  # Only queued, sent by the paho-thread
+
+
+    async def wait_for_update(self, sequence: int) -> int:
+        """Wait until there is a newer aggregation than `sequence` and return its sequence-number"""
+        while self.sequence <= sequence:
+            await self._updated.wait()
+        return self.sequence
+
+
+    def connect_mqtt(self, host: str, topic: str, port: int = 1883):
+        import paho.mqtt.client as mqtt
+
+        client = mqtt.Client()
+        client.connect_async(host, port)
+        client.loop_start()
+        self._mqtt = (client, topic)
+
+
+    def disconnect_mqtt(self):
+        if self._mqtt is not None:
+            client, _ = self._mqtt
+            client.loop_stop()
+            client.disconnect()
+            self._mqtt = None
+
+
+    async def _get(self, stream, path: str):
+        if path == "/latest":
+            await self._respond(stream, "200 OK", self.payload)
+        elif path == "/events":
+            await self._stream_events(stream)
+        else:
+            await super()._get(stream, path)
+
+
+    async def _stream_events(self, stream):
+        await stream.send_all(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Access-Control-Allow-Origin: *\r\n\r\n"
+        )
+        sequence = self.sequence
+        await stream.send_all(b"data: " + self.payload + b"\n\n")
+        while True:
+            sequence = await self.wait_for_update(sequence)
+            await stream.send_all(b"data: " + self.payload + b"\n\n")
@@ -0,0 +1,207 @@
+"""
+Replay of a frame-capture (see capture.py) through the MonitoringSystem:
+the recorded frames are returned by the I2C-Buses of the hardware-backend "replay", so the measurement_loop,
+the AlertManager and the aggregation/storage run exactly like during the recording (including the failed transfers).
+The trio-time follows the recorded times of the frames and the document-times are derived from it,
+so a replay gives the same documents every time. Every sensor gets exactly its recorded frames, only a sample
+close to the end of an aggregation-interval can end up in the neighbouring aggregation.
+
+Run with:
+    python -m iot_project.gas_sensors.replay CAPTURE-FILE [--speed 10 | --fast] [--store] [--config topology.toml]
+--speed runs the replay N times faster than real time, --fast as fast as possible (virtual time, that jumps to the next deadline).
+"""
+import argparse
+import math
+import os
+import time
+
+import trio
+import trio.testing
+
+from . import hal
+from .capture import player
+from .db_connect import StorageMode
+from .db_writer import MemoryQueue, BufferedWriter
+from .gas_monitoring_system import MonitoringSystem
+from .sensor_bus import SensorBus
+from .topology import load_topology
+from .. import logs
+
+log = logs.get_logger(__name__)
+
+
+class FastClock(trio.abc.Clock):
+    """
+    Virtual time for the replay as fast as possible: as soon as all tasks wait, it jumps to the next deadline
+    (like trio.testing.MockClock(autojump_threshold=0), but without the extra task-switches per jump)
+    """
+
+    def __init__(self):
+        self.time = 0.0
+
+
+    def start_clock(self):
+        pass
+
+
+    def current_time(self) -> float:
+        return self.time
+
+
+    def deadline_to_sleep_time(self, deadline: float) -> float:
+        if deadline == math.inf:
+            return math.inf  # Only waiting for threads or I/O
+        self.time = max(self.time, deadline)
+        return 0.0
+
+
+    def advance_to(self, time: float):
+        self.time = max(self.time, time)
+
+
+class ReplaySensorBus(SensorBus):
+    """
+    SensorBus on the ReplayBuses: instead of the settle-time, it waits until the recorded time of the responses,
+    so the measurement_loop sees the same timing as during the recording (in trio-time, i.e. also with the MockClock)
+    The transfers only copy memory, so they run in the event-loop (no worker-threads -> deterministic)
+    """
+
+    def __init__(self, sensors):
+        super().__init__(sensors, threaded=False)
+        self._sent = []  # Sensors of the current poll, that got the command
+
+
+    def _send_all(self, names, code):
+        sent, failed = super()._send_all(names, code)
+        self._sent = sent
+        return sent, failed
+
+
+    async def _settle(self):
+        times = [player.next_time(self.sensors[n].bus_number, self.sensors[n].i2c_address) for n in self._sent]
+        times = [t for t in times if t is not None]
+        if not times:
+            await trio.sleep(self.settle_time)
+            return
+
+        clock = trio.lowlevel.current_clock()
+        if isinstance(clock, FastClock):
+            clock.advance_to(max(times))  # Like a blocking transfer, saves a task-switch per poll
+        else:
+            await trio.sleep_until(max(times))
+
+
+class ReplaySystem(MonitoringSystem):
+    """MonitoringSystem on the recorded frames of the `player`, stops at the end of the capture"""
+
+    def __init__(self, mongo_uri, *, storage=StorageMode.documents, device=None, **kwargs):
+        super().__init__(
+            mongo_uri,
+            storage=storage,
+            device=f"{player.device}-replay" if device is None else device,
+            http_port=None,
+            adaptive=False,  # The recorded frames set the timing
+            **kwargs,
+        )
+        if not player.tracks:
+            raise ValueError("The capture is empty")
+        # A sensor without records would never reach the end of the capture
+        missing = [
+            name for name, sensor in self.sensors.items() if (sensor.bus_number, sensor.i2c_address) not in player.tracks
+        ]
+        if missing:
+            raise ValueError(f"Sensors {missing} are not in the capture, replay it with the topology of the recording (--config)")
+
+
+    def _sensor_bus(self, sensors):
+        return ReplaySensorBus(sensors)
+
+
+    def _writer(self, mongo_uri, spool_dir, storage):
+        # The replay produces the documents much faster than in real time
+        return BufferedWriter(mongo_uri, queue=MemoryQueue(max_len=100_000), mode=storage)
+
+
+    def now(self):
+        return player.wall_time()
+
+
+    async def main_task(self):
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(self.alert_manager.alert_loop)
+            if self.mongo_uri is not None:
+                nursery.start_soon(self.writer.run)
+
+            # The first poll starts one settle-time before the first recorded response
+            player.origin = trio.current_time() + max(bus.settle_time for bus in self.buses.values())
+            async with trio.open_nursery() as measurement:
+                measurement.start_soon(self.measurement_loop)
+                await player.finished.wait()
+                measurement.cancel_scope.cancel()  # The last, incomplete aggregation is not stored
+
+            if self.mongo_uri is not None:
+                while self.writer.queue_depth:
+                    await trio.sleep(self.writer.flush_interval)
+            nursery.cancel_scope.cancel()
+
+
+    def summary(self) -> dict:
+        return dict(
+            aggregations=self.writer.stats.queued,
+            written=self.writer.stats.written,
+            alarm_latency=self.alert_manager.alarm_latency_stats(),
+        )
+
+
+def main():
+    import dotenv
+
+    parser = argparse.ArgumentParser(prog="replay")
+    parser.add_argument("capture", help="Capture-file (CAPTURE_DIR/capture-*.frames)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Times faster than real time (default: 1)")
+    parser.add_argument("--fast", action="store_true", help="As fast as possible")
+    parser.add_argument("--measurement-interval", type=float, default=0.1)
+    parser.add_argument("--aggregation-interval", type=float, default=0.5)
+    parser.add_argument("--store", action="store_true", help="Write the aggregations to the DB (MONGODB_URI)")
+    parser.add_argument("--storage", default="documents", choices=[m.value for m in StorageMode])
+    parser.add_argument("--device", default=None, help="Device in the documents (default: <recorded device>-replay)")
+    parser.add_argument("--config", default=None, help="Topology of the recording (default: CONFIG_FILE, else one default board)")
+    parser.add_argument("--quiet", action="store_true", help="Don't log the aggregations, only the events")
+    args = parser.parse_args()
+
+    # Load environment variables from .env file
+    dotenv.load_dotenv()
+    logs.setup_logging("INFO" if args.quiet else "DEBUG", os.getenv("LOG_FORMAT", "text"))
+
+    config_file = os.getenv("CONFIG_FILE") if args.config is None else args.config
+
+    hal.set_backend("replay")
+    player.load(args.capture)
+    log.info("replay-start", frames=len(player.records), hours=round(player.duration / 3600, 2), device=player.device)
+
+    system = ReplaySystem(
+        os.getenv("MONGODB_URI") if args.store else None,
+        storage=StorageMode(args.storage),
+        device=args.device,
+        topology=None if config_file is None else load_topology(config_file),
+        measurement_interval=args.measurement_interval,
+        aggregation_interval=args.aggregation_interval,
+    )
+    if args.fast:
+        clock = FastClock()
+    else:
+        clock = trio.testing.MockClock(rate=args.speed)
+
+    start = time.perf_counter()
+    with system:
+        trio.run(system.main_task, clock=clock)
+    elapsed = time.perf_counter() - start
+
+    log.info(
+        "replay-done", hours=round(player.duration / 3600, 2), seconds=round(elapsed, 1),
+        speed=round(player.duration / elapsed), **system.summary()
+    )
+
+
+if __name__ == "__main__":
+    main()
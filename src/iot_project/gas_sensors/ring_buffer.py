@@ -0,0 +1,84 @@
+import numpy as np
+
+
+class SampleRing:
+    """
+    Preallocated circular buffer with the last raw samples for diagnostics and the dashboard
+    One row per measurement: time (int64, ns since epoch) and concentration + temperature (float32) per gas, NaN = no data.
+    Every row is written twice (at i and i + capacity), so the last `capacity` rows are always one contiguous block
+    and readers get views instead of copies. The views show the live memory, copy them if they are kept for longer.
+    The rows are kept in time-order (`between` searches the times): the buses are polled by their own tasks,
+    so a row can arrive after a newer one of an other bus, it is inserted before those (only they are moved).
+    """
+
+    def __init__(self, gases, *, seconds=600, rate=10, max_bytes=8 * 1024**2):
+        self.gases = tuple(gases)
+        self.dtype = np.dtype(
+            [("time", "<i8")]
+            + [(gas, "<f4") for gas in self.gases]
+            + [(f"{gas}_temp", "<f4") for gas in self.gases]
+        )
+        # Hard memory-cap, independent of the requested duration
+        self.capacity = max(min(int(seconds * rate), max_bytes // (2 * self.dtype.itemsize)), 1)
+        self._data = np.zeros(2 * self.capacity, dtype=self.dtype)
+        self._count = 0
+
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+
+    def append(self, time_ns: int, values: dict):
+        """`values`: gas -> (concentration, temperature), missing gases are stored as NaN"""
+        nan = (np.nan, np.nan)
+        row = (time_ns,) + tuple(
+            values.get(gas, nan)[0] for gas in self.gases
+        ) + tuple(values.get(gas, nan)[1] for gas in self.gases)
+
+        # Position in the time-order, counted from the oldest row ever appended: usually at the end
+        position = self._count
+        oldest = max(self._count - self.capacity + 1, 0)  # Oldest position, that is still kept after this append
+        while position > oldest and self._data[(position - 1) % self.capacity]["time"] > time_ns:
+            position -= 1
+        if position == oldest > 0 and self._data[(position - 1) % self.capacity]["time"] > time_ns:
+            return  # Older than all rows kept, it would be the one dropped
+
+        for p in range(self._count, position, -1):
+            self._set(p, self._data[(p - 1) % self.capacity])
+        self._set(position, row)
+        self._count += 1
+
+
+    def _set(self, position: int, row):
+        i = position % self.capacity
+        self._data[i] = row
+        self._data[i + self.capacity] = row
+
+
+    def view(self, n: int | None = None) -> np.ndarray:
+        """The last `n` rows (default: all), oldest first, without copying"""
+        n = len(self) if n is None else min(n, len(self))
+        end = self._count % self.capacity + self.capacity
+        if self._count <= self.capacity:
+            end = self._count  # Not wrapped yet -> first copy
+        return self._data[end - n:end]
+
+
+    def between(self, start_ns: int, end_ns: int | None = None) -> np.ndarray:
+        """Rows with start_ns <= time < end_ns as a view"""
+        rows = self.view()
+        times = rows["time"]
+        first = np.searchsorted(times, start_ns, side="left")
+        last = len(rows) if end_ns is None else np.searchsorted(times, end_ns, side="left")
+        return rows[first:last]
+
+
+    def last_seconds(self, seconds: float) -> np.ndarray:
+        if not len(self):
+            return self.view()
+        return self.between(int(self.view(1)["time"][0] - seconds * 1e9))
@@ -0,0 +1,211 @@
+"""
+Downsampled rollups of the aggregations (1 minute / 1 hour / 1 day) for long-range charts
+Every rollup-document holds min, max, sum and count per gas (avg = sum / count, see `with_avg`)
+and is updated incrementally with $min/$max/$inc-upserts as the aggregations are written.
+
+Rebuild the rollups from the stored raw data with:
+    python -m iot_project.gas_sensors.rollups backfill
+"""
+import argparse
+import collections
+import datetime
+import os
+
+import pymongo
+
+from .db_connect import StorageMode, collection_names
+from .. import logs
+
+log = logs.get_logger(__name__)
+
+tiers = {
+    "Rollup-1min": 60,
+    "Rollup-1h": 60 * 60,
+    "Rollup-1d": 24 * 60 * 60,
+}
+
+
+def tier_start(time: datetime.datetime, seconds: int) -> datetime.datetime:
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=datetime.timezone.utc)  # pymongo returns naive UTC-times
+    start = time.timestamp() // seconds * seconds
+    return datetime.datetime.fromtimestamp(start, datetime.timezone.utc)
+
+
+def ensure_rollups(db):
+    for name in tiers:
+        db[name].create_index([("meta.device", 1), ("start", 1)], unique=True)
+        db[name].create_index("start")
+
+
+def gas_statistics(document):
+    """(gas, min, max, sum, count) of all gases with data in an aggregation-document"""
+    for gas, stats in document.items():
+        if not isinstance(stats, dict) or stats.get("avg") is None:
+            continue  # time, meta or no data
+        count = stats.get("count", 1)  # Documents before the streaming-aggregation have no count
+        yield gas, stats["min"], stats["max"], stats["avg"] * count, count
+
+
+class RollupAccumulator:
+    """Combines the aggregations of a batch per tier, device and interval, so there is only one upsert per rollup-document"""
+
+    def __init__(self):
+        self.rollups = {name: {} for name in tiers}
+
+
+    def add(self, document):
+        meta = document.get("meta", {})
+        device = meta.get("device")
+        statistics = list(gas_statistics(document))
+
+        for name, seconds in tiers.items():
+            key = (device, tier_start(document["time"], seconds))
+            rollup = self.rollups[name].get(key)
+            if rollup is None:
+                rollup = self.rollups[name][key] = dict(
+                    meta=meta, min={}, max={}, sum=collections.Counter(), count=collections.Counter()
+                )
+
+            for gas, min_, max_, sum_, count in statistics:
+                rollup["min"][gas] = min(rollup["min"].get(gas, min_), min_)
+                rollup["max"][gas] = max(rollup["max"].get(gas, max_), max_)
+                rollup["sum"][gas] += sum_
+                rollup["count"][gas] += count
+
+
+    def updates(self) -> dict[str, list[pymongo.UpdateOne]]:
+        result = {}
+        for name, rollups in self.rollups.items():
+            result[name] = [
+                pymongo.UpdateOne(
+                    {"meta.device": device, "start": start},
+                    {
+                        "$setOnInsert": {"meta": rollup["meta"]},
+                        "$min": {f"{gas}.min": v for gas, v in rollup["min"].items()},
+                        "$max": {f"{gas}.max": v for gas, v in rollup["max"].items()},
+                        "$inc": {
+                            **{f"{gas}.sum": v for gas, v in rollup["sum"].items()},
+                            **{f"{gas}.count": v for gas, v in rollup["count"].items()},
+                        },
+                    },
+                    upsert=True,
+                )
+                for (device, start), rollup in rollups.items()
+                if rollup["count"]
+            ]
+        return result
+
+
+def write_rollups(db, documents):
+    """Add the aggregation-documents to all rollup-tiers (one unordered bulk-write per tier)"""
+    accumulator = RollupAccumulator()
+    for document in documents:
+        accumulator.add(document)
+
+    for name, updates in accumulator.updates().items():
+        if updates:
+            db[name].bulk_write(updates, ordered=False)
+
+
+def with_avg(rollup: dict) -> dict:
+    """Add avg = sum / count to every gas of a rollup-document"""
+    for stats in rollup.values():
+        if isinstance(stats, dict) and stats.get("count"):
+            stats["avg"] = stats["sum"] / stats["count"]
+    return rollup
+
+
+def minute_averages(db, devices, gases, since: datetime.datetime) -> dict[str, list[tuple[float, float, float]]]:
+    """(start, end, avg) in seconds since the epoch of every minute since `since` per gas, e.g. to restore the exposure"""
+    since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)  # Compared with naive UTC-times from pymongo
+    projection = {"_id": 0, "start": 1, **{f"{gas}.sum": 1 for gas in gases}, **{f"{gas}.count": 1 for gas in gases}}
+    cursor = db["Rollup-1min"].find({"meta.device": {"$in": list(devices)}, "start": {"$gte": since}}, projection)
+
+    averages = {gas: [] for gas in gases}
+    for rollup in cursor.sort("start", 1):
+        start = rollup["start"].replace(tzinfo=datetime.timezone.utc).timestamp()
+        for gas, stats in with_avg(rollup).items():
+            if gas in averages and "avg" in stats:
+                averages[gas].append((start, start + tiers["Rollup-1min"], stats["avg"]))
+    return averages
+
+
+def raw_documents(collection, mode: StorageMode, since=None, chunk_size=10_000):
+    """Stream the stored aggregations in time-order, the buckets are unpacked again"""
+    if mode is StorageMode.buckets:
+        query = {} if since is None else {"last": {"$gte": since}}
+        cursor = collection.find(query).sort("start", 1).batch_size(max(chunk_size // 120, 1))
+        for bucket in cursor:
+            for sample in bucket["samples"]:
+                if since is None or sample["time"] >= since:
+                    yield dict(sample, meta=bucket.get("meta", {}))
+    else:
+        query = {} if since is None else {"time": {"$gte": since}}
+        yield from collection.find(query, {"_id": 0}).sort("time", 1).batch_size(chunk_size)
+
+
+def backfill(db, mode: StorageMode = StorageMode.documents, *, since=None, chunk_size=10_000, drop=True):
+    """
+    Rebuild the rollups from the stored aggregations in chunks of `chunk_size` documents (bounded memory), returns the documents
+    `since` is rounded down to the start of its day, so the rollups of every tier are rebuilt from the start of an interval
+    `drop` deletes the rollups from `since` on (all without `since`) before, the older ones are kept.
+    Without `drop`, the documents are added to the existing rollups (only useful for a time range not yet rolled up)
+    """
+    if since is not None:
+        # Naive UTC like the times from pymongo
+        since = tier_start(since, max(tiers.values())).replace(tzinfo=None)
+
+    if drop:
+        for name in tiers:
+            if since is None:
+                db[name].drop()
+            else:
+                db[name].delete_many({"start": {"$gte": since}})
+    ensure_rollups(db)
+
+    chunk = []
+    total = 0
+    for document in raw_documents(db[collection_names[mode]], mode, since, chunk_size):
+        chunk.append(document)
+        if len(chunk) >= chunk_size:
+            write_rollups(db, chunk)
+            total += len(chunk)
+            chunk = []
+            log.info("backfill-progress", documents=total, until=document["time"])
+
+    if chunk:
+        write_rollups(db, chunk)
+        total += len(chunk)
+    log.info("backfill-done", documents=total, since=since)
+    return total
+
+
+def main():
+    import dotenv
+
+    parser = argparse.ArgumentParser(prog="rollups")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_backfill = subparsers.add_parser("backfill", help="Rebuild the rollups from the raw data")
+    parser_backfill.add_argument("--mode", default="documents", choices=[m.value for m in StorageMode])
+    parser_backfill.add_argument("--since", type=datetime.datetime.fromisoformat, default=None)
+    parser_backfill.add_argument("--chunk-size", type=int, default=10_000)
+    parser_backfill.add_argument("--keep", action="store_true", help="Don't delete the existing rollups (from --since on)")
+    args = parser.parse_args()
+    logs.setup_logging(format=os.getenv("LOG_FORMAT", "text"))
+
+    # Load environment variables from .env file
+    dotenv.load_dotenv()
+
+    with pymongo.MongoClient(os.getenv("MONGODB_URI")) as DBclient:
+        backfill(
+            DBclient["IoT-Project"],
+            StorageMode(args.mode),
+            since=args.since,
+            chunk_size=args.chunk_size,
+            drop=not args.keep,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Adaptive sampling of the MonitoringSystem:
+while all readings are stable and far from their alert-thresholds, the sensors are measured slowly and aggregated coarsely
+(less I2C-traffic, CPU and documents). As soon as a value comes close to a threshold, trends toward it or its variance
+jumps, the scheduler switches to the configured or to the fastest intervals, so the response near danger is faster.
+"""
+import dataclasses
+import enum
+import math
+
+import trio
+
+
+class SamplingLevel(enum.IntEnum):
+    calm = 0  # Stable and far from the thresholds
+    normal = 1  # Configured intervals: variance-spike
+    fast = 2  # Close to / trending toward a threshold, or beyond it (alert)
+
+
+@dataclasses.dataclass(frozen=True)
+class Rate:
+    measurement_interval: float  # s
+    aggregation_interval: float  # s
+
+
+class Trend:
+    """
+    Exponentially weighted mean, slope and variance of one sensor
+    The time-constants are in seconds, so the trend doesn't depend on the current sample-rate
+    """
+
+    def __init__(self, *, time_constant=5.0, baseline_time_constant=120.0):
+        self.time_constant = time_constant
+        self.baseline_time_constant = baseline_time_constant
+        self.time = None
+        self.mean = 0.0
+        self.slope = 0.0  # Per second
+        self.variance = 0.0
+        self.baseline_variance = 0.0  # Slowly following variance, reference for the spikes
+
+
+    def add(self, value: float, now: float):
+        if self.time is None:
+            self.time, self.mean = now, value
+            return
+        dt = max(now - self.time, 1e-3)
+        self.time = now
+
+        alpha = 1 - math.exp(-dt / self.time_constant)
+        delta = value - self.mean
+        previous, self.mean = self.mean, self.mean + alpha * delta
+        self.slope += alpha * ((self.mean - previous) / dt - self.slope)
+        self.variance = (1 - alpha) * (self.variance + alpha * delta * delta)
+        self.baseline_variance += (1 - math.exp(-dt / self.baseline_time_constant)) * (
+            self.variance - self.baseline_variance
+        )
+
+
+class AdaptiveScheduler:
+    """
+    Sampling-level of all sensors of the MonitoringSystem (the buses share the aggregation-windows):
+    - fast: a value beyond a threshold, within `near` of it, or predicted to cross it within `horizon` seconds
+    - normal: the variance of a sensor is `spike_factor` times its baseline-variance
+    - calm: otherwise, the intervals are `calm_factor` times the configured ones
+    A faster level is taken immediately (and cuts the open aggregation-window), a slower one only after `hold` seconds.
+    `near` is relative to the threshold: for `above`-limits the value is close at `near_above` * above
+    (gases normally near 0), for `below`-limits at (1 + `near_below`) * below (O2 normally at 20.9 %).
+    With adaptive=False the level is always normal, i.e. the configured intervals.
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, tuple[float | None, float | None]],
+        measurement_interval: float,
+        aggregation_interval: float,
+        *,
+        adaptive=True,
+        min_measurement_interval=0.0,
+        calm_factor=10,
+        near_above=0.5,
+        near_below=0.025,
+        horizon=60.0,
+        spike_factor=4.0,
+        min_std=0.01,
+        hold=30.0,
+    ):
+        self.limits = dict(limits)
+        self.adaptive = adaptive
+        self.rates = {
+            SamplingLevel.calm: Rate(measurement_interval * calm_factor, aggregation_interval * calm_factor),
+            SamplingLevel.normal: Rate(measurement_interval, aggregation_interval),
+            SamplingLevel.fast: Rate(
+                min(measurement_interval, max(measurement_interval / 2, min_measurement_interval)),
+                aggregation_interval / 2,
+            ),
+        }
+        self.near_above = near_above
+        self.near_below = near_below
+        self.horizon = horizon
+        self.spike_factor = spike_factor
+        self.min_std = min_std  # Relative to the threshold: variance-floor for sensors with constant readings
+        self.hold = hold
+
+        self.trends = {name: Trend() for name in self.limits}
+        self._wanted = {name: SamplingLevel.calm for name in self.limits}
+        self.level = SamplingLevel.calm if adaptive else SamplingLevel.normal
+        self._needed = 0.0  # trio-time, when the current level was needed the last time
+        self.faster = trio.Event()  # Set (and replaced) on every switch to a faster level
+        self._ends = {}  # Aggregation-window -> trio-time of its end, window -1 is the start
+        self._levels = {}  # Aggregation-window -> fastest level during the window
+
+
+    @property
+    def rate(self) -> Rate:
+        return self.rates[self.level]
+
+
+    def _sensor_level(self, name, value) -> SamplingLevel:
+        above, below = self.limits.get(name, (None, None))
+        trend = self.trends[name]
+        predicted = trend.mean + trend.slope * self.horizon
+
+        for limit, close, beyond in (
+            (above, lambda v: v >= above * self.near_above, lambda v: v > above),
+            (below, lambda v: v <= below * (1 + self.near_below), lambda v: v < below),
+        ):
+            if limit is not None and (close(value) or beyond(predicted)):
+                return SamplingLevel.fast
+
+        scale = max(abs(limit) for limit in (above, below, 1.0) if limit is not None)
+        if trend.variance > self.spike_factor * max(trend.baseline_variance, (self.min_std * scale) ** 2):
+            return SamplingLevel.normal
+        return SamplingLevel.calm
+
+
+    def update(self, name: str, value: float, now: float):
+        """New value of a sensor at trio-time `now`"""
+        if not self.adaptive:
+            return
+        if name in self.trends:
+            self.trends[name].add(value, now)
+            self._wanted[name] = self._sensor_level(name, value)
+
+        wanted = max(self._wanted.values(), default=SamplingLevel.calm)
+        if wanted >= self.level:
+            faster = wanted > self.level
+            self.level = wanted
+            self._needed = now
+            if faster:
+                self._cut_windows(now)
+                self.faster.set()
+                self.faster = trio.Event()
+        elif now - self._needed >= self.hold:
+            self.level = SamplingLevel(self.level - 1)  # One level at a time
+            self._needed = now
+
+
+    def _cut_windows(self, now: float):
+        """The open aggregation-windows end at the latest one (new) aggregation-interval from now"""
+        end = now + self.rate.aggregation_interval
+        for window, window_end in self._ends.items():
+            if window >= 0:
+                self._levels[window] = self.level
+                if window_end > end:
+                    self._ends[window] = max(end, self._ends.get(window - 1, end))
+
+
+    def start(self, now: float):
+        self._ends = {-1: now}
+        self._levels = {}
+
+
+    def window_end(self, window: int) -> float:
+        """trio-time of the end of an aggregation-window, fixed by the first bus that reaches it"""
+        if window not in self._ends:
+            self._ends[window] = self.window_end(window - 1) + self.rate.aggregation_interval
+            self._levels[window] = self.level
+        return self._ends[window]
+
+
+    def close(self, window: int) -> tuple[float, SamplingLevel]:
+        """Duration and level of a finished aggregation-window (all buses are done with it)"""
+        start = self._ends.pop(window - 1)
+        return self._ends[window] - start, self._levels.pop(window)
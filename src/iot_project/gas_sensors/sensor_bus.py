@@ -0,0 +1,78 @@
+import trio
+
+from .multigas_sensors import MultiGasSensor, SensorData, CmdCode
+
+
+class SensorBus:
+    """
+    Pipelined polling of several MultiGasSensors on the same I2C-Bus:
+    The command is sent to all sensors first, then the settle-time is waited only once and afterwards all responses are collected.
+    The bus-transfers stay serialized, only the waiting overlaps.
+    """
+
+    def __init__(self, sensors: dict[str, MultiGasSensor], *, threaded=True):
+        self.sensors = sensors
+        # False for buses, that don't block (the replay): the transfers then run directly in the event-loop
+        self.threaded = threaded
+
+
+    @property
+    def settle_time(self) -> float:
+        return max((s.settle_time for s in self.sensors.values()), default=0)
+
+
+    def _send_all(self, names, code):
+        sent = []
+        failed = {}
+        for name in names:
+            try:
+                self.sensors[name].send(code)
+            except Exception as ex:
+                failed[name] = ex
+                continue
+            sent.append(name)
+        return sent, failed
+
+
+    def _receive_all(self, names, code):
+        results = {}
+        for name in names:
+            try:
+                results[name] = self.sensors[name].receive(code)
+            except Exception as ex:
+                results[name] = ex
+        return results
+
+
+    async def _run(self, function, *args):
+        if self.threaded:
+            return await trio.to_thread.run_sync(function, *args)
+        return function(*args)
+
+
+    async def _settle(self):
+        await trio.sleep(self.settle_time)
+
+
+    async def poll(self, names=None) -> dict[str, SensorData | Exception]:
+        """
+        Read all values of the given sensors (default: all sensors) in one poll-cycle
+        Returns SensorData for every sensor, or the exception if the sensor failed
+        """
+        code = CmdCode.read_all
+        names = list(self.sensors) if names is None else list(names)
+
+        sent, results = await self._run(self._send_all, names, code)
+        if sent:
+            await self._settle()
+            received = await self._run(self._receive_all, sent, code)
+
+            for name, result in received.items():
+                if not isinstance(result, Exception):
+                    try:
+                        result = self.sensors[name].decode_all(result)
+                    except Exception as ex:
+                        result = ex
+                results[name] = result
+
+        return {name: results[name] for name in names}
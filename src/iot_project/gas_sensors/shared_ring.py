@@ -0,0 +1,159 @@
+"""
+Sample-channel between the processes of the multi-process mode (see iot_project/supervisor.py):
+the safety-process appends every poll and every closed aggregation-window, the storage-worker reads them.
+One writer, any number of readers (only the storage-worker writes `stored_window`), no locks: every slot carries its sequence-number, the writer marks the slot
+(seq = -1) before it changes it and sets the sequence-number afterwards, so a reader detects slots, that were
+overwritten while it copied them (the writer never waits for a reader, a slow reader loses the oldest rows).
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+SAMPLE = 0  # One poll of the sensors of a bus
+WINDOW = 1  # All buses are done with an aggregation-window
+
+# Status of a gas in a SAMPLE-row, a failed sensor has FIRST_ERROR + index in health.ErrorType
+NOT_POLLED = 0
+OK = 1
+FIRST_ERROR = 2
+
+_MAGIC = 0x10770001
+_HEADER = 5  # int64: magic, capacity, number of gases, number of appended rows, last window stored
+_HEAD = 3
+_STORED = 4
+
+
+def row_dtype(n_gases: int) -> np.dtype:
+    return np.dtype(
+        [
+            ("seq", "<i8"),
+            ("kind", "u1"),
+            ("level", "u1"),  # scheduler.SamplingLevel
+            ("polls", "<i4"),  # WINDOW: measurements of the busiest bus
+            ("time", "<i8"),  # ns since epoch
+            ("window", "<i8"),
+            ("duration", "<f8"),  # WINDOW: seconds
+            ("value", "<f8", (n_gases,)),
+            ("temperature", "<f4", (n_gases,)),
+            ("status", "u1", (n_gases,)),  # NOT_POLLED, OK or error
+            ("state", "u1", (n_gases,)),  # Index in health.SensorState
+        ],
+        align=True,
+    )
+
+
+class SharedSampleRing:
+    """
+    Circular buffer of rows (see `row_dtype`) in shared memory
+    `create` in the process that owns it (unlinks it at the end), `attach` by name in the other processes
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, gases, *, owner=False):
+        self.gases = tuple(gases)
+        self.dtype = row_dtype(len(self.gases))
+        self._memory = memory
+        self._owner = owner
+        self._header = np.ndarray((_HEADER,), dtype="<i8", buffer=memory.buf)
+        if self._header[0] != _MAGIC or self._header[2] != len(self.gases):
+            raise ValueError(f"{memory.name} is no sample-ring for {len(self.gases)} gases")
+        self.capacity = int(self._header[1])
+        self._rows = np.ndarray(
+            (self.capacity,), dtype=self.dtype, buffer=memory.buf, offset=_HEADER * 8
+        )
+
+
+    @classmethod
+    def create(cls, gases, capacity: int, name: str | None = None) -> "SharedSampleRing":
+        gases = tuple(gases)
+        size = _HEADER * 8 + capacity * row_dtype(len(gases)).itemsize
+        memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((_HEADER,), dtype="<i8", buffer=memory.buf)
+        header[:] = (_MAGIC, capacity, len(gases), 0, -1)
+        del header  # No exported buffers may be left, when the memory is closed
+        ring = cls(memory, gases, owner=True)
+        ring._rows["seq"] = -1
+        return ring
+
+
+    @classmethod
+    def attach(cls, name: str, gases) -> "SharedSampleRing":
+        return cls(shared_memory.SharedMemory(name=name), gases)
+
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+
+    @property
+    def head(self) -> int:
+        """Number of rows appended so far (= sequence-number of the next row)"""
+        return int(self._header[_HEAD])
+
+
+    @property
+    def stored_window(self) -> int:
+        """Last window stored by the reader (written only by the storage-worker), so a restarted one continues there"""
+        return int(self._header[_STORED])
+
+
+    @stored_window.setter
+    def stored_window(self, window: int):
+        self._header[_STORED] = window
+
+
+    def append(self, kind, *, time_ns=0, window=0, level=0, polls=0, duration=0.0, value=None, temperature=None, status=None, state=None):
+        """Only from one process (the safety-process), per-gas fields as sequences in the order of `gases`"""
+        seq = int(self._header[_HEAD])
+        row = self._rows[seq % self.capacity]
+        row["seq"] = -1
+        row["kind"] = kind
+        row["level"] = level
+        row["polls"] = polls
+        row["time"] = time_ns
+        row["window"] = window
+        row["duration"] = duration
+        row["value"] = np.nan if value is None else value
+        row["temperature"] = np.nan if temperature is None else temperature
+        row["status"] = NOT_POLLED if status is None else status
+        row["state"] = 0 if state is None else state
+        row["seq"] = seq
+        self._header[_HEAD] = seq + 1
+
+
+    def read(self, position: int, max_rows: int | None = None) -> tuple[np.ndarray, int, int]:
+        """
+        Copy of the rows from sequence-number `position` on
+        Returns the rows, the position after them and the number of rows lost (overwritten before they were read)
+        """
+        head = int(self._header[_HEAD])
+        lost = 0
+        if head - position > self.capacity:
+            lost = head - self.capacity - position
+            position = head - self.capacity
+        end = head if max_rows is None else min(head, position + max_rows)
+        if end <= position:
+            return np.empty(0, dtype=self.dtype), position, lost
+
+        first, last = position % self.capacity, (end - 1) % self.capacity
+        if first <= last:
+            rows = self._rows[first:last + 1].copy()
+            after = self._rows["seq"][first:last + 1]
+        else:
+            rows = np.concatenate((self._rows[first:], self._rows[:last + 1]))
+            after = np.concatenate((self._rows["seq"][first:], self._rows["seq"][:last + 1]))
+
+        # Slots overwritten during the copy have an other sequence-number before or after it
+        expected = np.arange(position, end)
+        valid = (rows["seq"] == expected) & (after == expected)
+        if not valid.all():
+            lost += int((~valid).sum())
+            rows = rows[valid]
+        return rows, end, lost
+
+
+    def close(self):
+        self._header = self._rows = None
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
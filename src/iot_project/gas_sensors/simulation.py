@@ -0,0 +1,256 @@
+"""
+In-process simulator of the DFRobot MultiGas-Sensors and the GPIO-Pins
+Used with the hardware-backend "sim" (IOT_PROJECT_HARDWARE=sim), so the gas_sensors run and can be load-tested
+on a normal Linux-Computer. The simulated sensors speak the same frame-protocol as the real ones
+(header, command-code, checksum, read_all-layout), with configurable latency, error- and CRC-failure-rates
+and scripted gas-concentrations.
+"""
+import math
+import random
+import struct
+import threading
+import time
+
+from .multigas_sensors import CmdCode, SensorType, MultiGasSensor
+
+
+# Scripted gas-concentrations: functions of the time in seconds since the start of the simulator
+
+def constant(value):
+    return lambda t: value
+
+
+def ramp(start, end, duration, delay=0.0):
+    """From `start` to `end` within `duration` seconds, starting after `delay` seconds"""
+    def curve(t):
+        x = min(max((t - delay) / duration, 0.0), 1.0)
+        return start + (end - start) * x
+    return curve
+
+
+def sine(mean, amplitude, period):
+    return lambda t: mean + amplitude * math.sin(2 * math.pi * t / period)
+
+
+def steps(*points):
+    """Piecewise constant: steps((0, 10), (60, 80), (120, 10)) -> 10 ppm, after 60 s 80 ppm, after 120 s 10 ppm"""
+    def curve(t):
+        value = points[0][1]
+        for start, v in points:
+            if t >= start:
+                value = v
+        return value
+    return curve
+
+
+default_curves = {
+    SensorType.NH3: constant(5.0),
+    SensorType.CO: constant(10.0),
+    SensorType.O2: constant(20.9),
+}
+
+
+def temperature_raw(temperature: float) -> int:
+    """Inverse of the thermistor-conversion in multigas_sensors.thermistor_temperature"""
+    Rth = 10000 * math.exp(3380.13 * (1 / (273.15 + temperature) - 1 / (273.15 + 25)))
+    Vpd3 = 3 * Rth / (10000 + Rth)
+    return round(Vpd3 * 1024 / 3)
+
+
+class SimulatedSensor:
+    """One MultiGas-Sensor on a simulated bus"""
+
+    def __init__(
+        self,
+        sensor_type: SensorType,
+        curve=None,
+        *,
+        temperature=25.0,
+        decimal_places=2,
+        noise=0.0,
+        error_rate=0.0,
+        crc_error_rate=0.0,
+        seed=None,
+    ):
+        self.sensor_type = sensor_type
+        self.curve = default_curves.get(sensor_type, constant(0.0)) if curve is None else curve
+        self.temperature = temperature
+        self.decimal_places = decimal_places
+        self.noise = noise
+        self.error_rate = error_rate  # Probability of an OSError per transfer
+        self.crc_error_rate = crc_error_rate  # Probability of a response with a wrong checksum
+        self.random = random.Random(seed)
+        self._command = None
+
+
+    def write(self, data: list[int]):
+        frame = bytes(data)
+        if (
+            len(frame) != 9
+            or frame[0] != 0xFF
+            or frame[8] != MultiGasSensor.calc_check_sum(frame[1:-1])
+        ):
+            self._command = None  # Invalid frames are ignored
+            return
+        self._command = frame[2]
+
+
+    def response(self, t: float) -> bytes:
+        concentration = self.curve(t)
+        if self.noise:
+            concentration = max(concentration + self.random.gauss(0, self.noise), 0)
+        raw = min(round(concentration * 10**self.decimal_places), 0xFFFF)
+        code = self._command if self._command is not None else 0
+
+        match code:
+            case CmdCode.read_temp.value:
+                body = struct.pack(">H4x", temperature_raw(self.temperature))
+            case _:
+                body = struct.pack(
+                    ">HBBH",
+                    raw,
+                    self.sensor_type.value,
+                    self.decimal_places,
+                    temperature_raw(self.temperature),
+                )
+        frame = bytes([0xFF, code]) + body
+        checksum = MultiGasSensor.calc_check_sum(frame[1:-1])
+        if self.random.random() < self.crc_error_rate:
+            checksum ^= 0xFF
+        return frame + bytes([checksum])
+
+
+class SimulatedBus:
+    """smbus.SMBus-compatible bus with the simulated sensors of one bus-number"""
+
+    def __init__(self, simulator, bus_number: int):
+        self.simulator = simulator
+        self.bus_number = bus_number
+        self.sensors: dict[int, SimulatedSensor] = {}
+        self.latency = 0.0  # Seconds per transfer (blocking, like the real bus)
+
+
+    def _sensor(self, address) -> SimulatedSensor:
+        if self.latency:
+            time.sleep(self.latency)
+        sensor = self.sensors.get(address)
+        if sensor is None or sensor.random.random() < sensor.error_rate:
+            raise OSError(121, "Remote I/O error")
+        return sensor
+
+
+    def write_i2c_block_data(self, address, register, data):
+        self._sensor(address).write(data)
+
+
+    def read_i2c_block_data(self, address, register, length):
+        return list(self._sensor(address).response(self.simulator.time())[:length])
+
+
+class SimulatedGPIO:
+    """RPi.GPIO-compatible module, the output-levels can be checked in `levels`"""
+
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_UP = 22
+    PUD_DOWN = 21
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.levels = {}
+        self.inputs = {}
+        self.callbacks = {}
+        self.writes = 0
+
+
+    def setmode(self, mode):
+        pass
+
+
+    def setup(self, pin, direction, pull_up_down=None):
+        if direction == self.IN:
+            self.inputs[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+
+
+    def output(self, pin, level):
+        self.levels[pin] = level
+        self.writes += 1
+
+
+    def input(self, pin):
+        return self.inputs.get(pin, self.LOW)
+
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = (edge, callback)
+
+
+    def cleanup(self):
+        self.levels.clear()
+        self.callbacks.clear()
+
+
+    def press(self, pin):
+        """Simulate a button-press (pulled up -> LOW) from another thread, like RPi.GPIO"""
+        self.inputs[pin] = self.LOW
+        edge, callback = self.callbacks.get(pin, (None, None))
+        if callback is not None and edge in (self.FALLING, self.BOTH):
+            threading.Thread(target=callback, args=(pin,)).start()
+
+
+    def release(self, pin):
+        self.inputs[pin] = self.HIGH
+        edge, callback = self.callbacks.get(pin, (None, None))
+        if callback is not None and edge in (self.RISING, self.BOTH):
+            threading.Thread(target=callback, args=(pin,)).start()
+
+
+class Simulator:
+    """All simulated buses and the GPIO-Pins, the sensors of the MonitoringSystem are there by default"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.start = clock()
+        self.buses: dict[int, SimulatedBus] = {}
+        self.gpio = SimulatedGPIO()
+
+
+    def time(self) -> float:
+        """Seconds since the start of the simulation (input of the curves)"""
+        return self.clock() - self.start
+
+
+    def bus(self, bus_number: int) -> SimulatedBus:
+        if bus_number not in self.buses:
+            self.buses[bus_number] = SimulatedBus(self, bus_number)
+        return self.buses[bus_number]
+
+
+    def add_sensor(self, bus_number: int, address: int, sensor_type: SensorType, curve=None, **kwargs) -> SimulatedSensor:
+        sensor = SimulatedSensor(sensor_type, curve, **kwargs)
+        self.bus(bus_number).sensors[address] = sensor
+        return sensor
+
+
+    def reset(self):
+        self.start = self.clock()
+        self.buses.clear()
+        self.gpio.__init__()  # Same object, the AlertManager keeps its reference
+        self.add_default_sensors()
+
+
+    def add_default_sensors(self):
+        # Same as the real board: NH3, CO and O2 on bus 1
+        self.add_sensor(1, 0x75, SensorType.NH3)
+        self.add_sensor(1, 0x76, SensorType.CO)
+        self.add_sensor(1, 0x77, SensorType.O2)
+
+
+simulator = Simulator()
+simulator.add_default_sensors()
@@ -0,0 +1,296 @@
+import datetime
+import functools
+import os
+import pathlib
+import threading
+
+import trio
+
+from .. import logs
+
+log = logs.get_logger(__name__)
+
+
+@functools.cache
+def json_options():
+    # bson (part of pymongo) is imported on first use, not at the start of the sampling
+    from bson import json_util
+
+    return json_util.RELAXED_JSON_OPTIONS.with_options(tz_aware=True, tzinfo=datetime.timezone.utc)
+
+
+class Spool:
+    """
+    Durable write-ahead queue on the local disk (SD-Card) for the DB-Writer
+    Every document is appended as one JSON-line to the current segment-file, segments are rotated by size.
+    The position of the last document acknowledged by the DB is stored in the `ack`-file,
+    so after a restart the replay continues from there without scanning the old segments.
+    Only `append` runs in the trio-loop (one buffered write, errors of the disk are counted as dropped documents),
+    rotation, fsync and the disk-limit run in worker-threads of `run`, the BufferedWriter calls peek and commit
+    in worker-threads too (`blocking`), so a slow SD-Card never stalls the alarm.
+    """
+
+    blocking = True  # peek and commit read and write the disk, the BufferedWriter runs them in worker-threads
+
+    def __init__(
+        self,
+        directory,
+        *,
+        segment_size=4 * 1024**2,
+        max_bytes=256 * 1024**2,
+        fsync_interval=5.0,
+    ):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.dropped = 0  # Documents lost, because the disk-limit was reached
+
+        segments = self._segments()
+        self._write_segment = segments[-1] + 1 if segments else 0
+        self._cursor = self._load_ack(segments)
+        # Documents not yet acknowledged, including the backlog of a previous process
+        self.depth = self._count_unacknowledged(segments)
+        # Bytes of the closed segments, kept up to date by rotation and deletion, so a scrape doesn't list the directory
+        self._closed_bytes = sum(self._size(s) for s in segments)
+        self._file = open(self._path(self._write_segment), "ab")
+        self._peeked = None, 0  # Position returned by the last peek and the lines up to it
+        self._unsynced = False
+        self._rotate_due = False
+        self._wake = trio.Event()  # Set by append, when the segment is full
+        # Cursor, depth, dropped and the closed bytes are changed by worker-threads (commit, disk-limit) and the trio-loop
+        self._lock = threading.Lock()
+        self._ack_lock = threading.Lock()  # Only one thread writes the ack-file at a time
+
+
+    def _path(self, segment: int) -> pathlib.Path:
+        return self.directory / f"segment-{segment:010d}.jsonl"
+
+
+    def _segments(self) -> list[int]:
+        return sorted(int(p.stem.split("-")[1]) for p in self.directory.glob("segment-*.jsonl"))
+
+
+    def _load_ack(self, segments) -> tuple[int, int]:
+        try:
+            segment, offset = map(int, (self.directory / "ack").read_text().split())
+        except (FileNotFoundError, ValueError):
+            segment, offset = -1, 0
+
+        if segment not in segments:
+            # Acknowledged segment is already deleted -> start with the oldest one
+            later = [s for s in segments if s > segment]
+            return (later[0] if later else self._write_segment), 0
+        return segment, offset
+
+
+    def _count_unacknowledged(self, segments) -> int:
+        count = 0
+        segment, offset = self._cursor
+        for s in segments:
+            if s < segment:
+                continue
+            try:
+                with open(self._path(s), "rb") as f:
+                    f.seek(offset if s == segment else 0)
+                    while chunk := f.read(1024**2):
+                        count += chunk.count(b"\n")  # A line cut off by a crash has no newline and isn't counted
+            except FileNotFoundError:
+                pass
+        return count
+
+
+    def _save_ack(self):
+        with self._ack_lock:
+            segment, offset = self._cursor
+            tmp = self.directory / "ack.tmp"
+            tmp.write_text(f"{segment} {offset}")
+            os.replace(tmp, self.directory / "ack")
+
+
+    def _size(self, segment: int) -> int:
+        try:
+            return self._path(segment).stat().st_size
+        except FileNotFoundError:
+            return 0  # Deleted by commit in the meantime
+
+
+    def _delete(self, segment: int):
+        size = self._size(segment)
+        try:
+            self._path(segment).unlink()
+        except FileNotFoundError:
+            return  # Deleted by the other thread (commit or disk-limit), it subtracted the size
+        with self._lock:
+            self._closed_bytes -= size
+
+
+    @property
+    def used_bytes(self) -> int:
+        return self._closed_bytes + self._file.tell()
+
+
+    @property
+    def fill_level(self) -> float:
+        return self.used_bytes / self.max_bytes
+
+
+    def append(self, document) -> bool:
+        """
+        Append a document to the spool, it is handed to the OS immediately (fsync and rotation happen in run())
+        Returns False, if the disk failed (full, I/O-error): the document is counted as dropped
+        """
+        from bson import json_util
+
+        try:
+            self._file.write(json_util.dumps(document, json_options=json_options()).encode() + b"\n")
+            self._file.flush()
+        except OSError as ex:
+            with self._lock:
+                self.dropped += 1
+            log.error("spool-write-failed", error=repr(ex), dropped=self.dropped)
+            return False
+        self._unsynced = True
+        with self._lock:
+            self.depth += 1
+
+        if not self._rotate_due and self._file.tell() >= self.segment_size:
+            self._rotate_due = True
+            self._wake.set()
+        return True
+
+
+    async def _rotate(self):
+        segment = self._write_segment + 1
+        new_file = await trio.to_thread.run_sync(open, self._path(segment), "ab")
+        # Swapped in the trio-loop, so append always has an open file
+        old_file, self._file = self._file, new_file
+        with self._lock:
+            self._closed_bytes += old_file.tell()
+        self._write_segment = segment
+        self._rotate_due = False
+        self._unsynced = False
+        await trio.to_thread.run_sync(self._close_segment, old_file)
+        await trio.to_thread.run_sync(self._enforce_limit)
+
+
+    @staticmethod
+    def _close_segment(file):
+        try:
+            os.fsync(file.fileno())
+        finally:
+            file.close()
+
+
+    def _enforce_limit(self):
+        """Delete the oldest segments above `max_bytes` (in a worker-thread), the documents not yet replayed are dropped"""
+        segments = self._segments()
+        total = self.used_bytes
+        for segment in segments[:-1]:
+            if total <= self.max_bytes:
+                break
+            path = self._path(segment)
+            total -= self._size(segment)
+            cursor = self._cursor
+            if segment >= cursor[0] and path.exists():
+                # Not yet replayed -> count the lost documents
+                with open(path, "rb") as f:
+                    f.seek(cursor[1] if segment == cursor[0] else 0)
+                    lost = f.read().count(b"\n")
+                with self._lock:
+                    self.dropped += lost
+                    self.depth = max(self.depth - lost, 0)
+                    self._cursor = max(self._cursor, (segment + 1, 0))
+                self._save_ack()
+                log.warning("spool-full", segment=segment, dropped=lost)
+            self._delete(segment)
+
+
+    def peek(self, count: int) -> tuple[list, tuple[int, int]]:
+        """Read up to `count` documents from the acknowledged position, returns the documents and the position after them"""
+        from bson import json_util
+
+        documents = []
+        lines = 0  # Read, including the ones that aren't valid JSON, commit subtracts them from the depth
+        segment, offset = self._cursor
+
+        while len(documents) < count and segment <= self._write_segment:
+            try:
+                f = open(self._path(segment), "rb")
+            except FileNotFoundError:
+                segment, offset = segment + 1, 0
+                continue
+
+            with f:
+                f.seek(offset)
+                while len(documents) < count:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break  # End of segment (or a line cut off by a crash)
+                    offset += len(line)
+                    lines += 1
+                    try:
+                        documents.append(json_util.loads(line, json_options=json_options()))
+                    except ValueError:
+                        pass
+
+            if len(documents) < count and segment < self._write_segment:
+                segment, offset = segment + 1, 0
+            else:
+                break
+
+        self._peeked = (segment, offset), lines
+        return documents, (segment, offset)
+
+
+    def commit(self, position: tuple[int, int]):
+        """Mark all documents before `position` (returned by peek) as written to the DB"""
+        peeked, lines = self._peeked
+        with self._lock:
+            self._cursor = max(self._cursor, position)  # The disk-limit could have moved it already
+            if position == peeked:
+                self.depth = max(self.depth - lines, 0)
+        self._save_ack()
+        for segment in self._segments():
+            if segment >= position[0]:
+                break
+            self._delete(segment)  # The disk-limit could have deleted it already
+
+
+    def __len__(self):
+        return self.depth
+
+
+    @staticmethod
+    def _sync(fd):
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+    async def run(self):
+        """Rotation when a segment is full and fsync in batches, so not every document causes a write to the SD-Card"""
+        while True:
+            with trio.move_on_after(self.fsync_interval):
+                await self._wake.wait()
+            self._wake = trio.Event()
+            try:
+                if self._rotate_due:
+                    await self._rotate()
+                elif self._unsynced:
+                    self._unsynced = False
+                    # Own file-descriptor, so a rotation in the meantime doesn't close it under our feet
+                    fd = os.dup(self._file.fileno())
+                    await trio.to_thread.run_sync(self._sync, fd)
+            except OSError as ex:
+                # Disk full or broken: append counts the lost documents, the next attempt follows
+                log.error("spool-problem", error=repr(ex))
+
+
+    def close(self):
+        try:
+            os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
@@ -0,0 +1,164 @@
+"""
+Topology of the gas-sensors: the devices, their MultiGas-Sensors (I2C-bus, address, SensorType) and the alert-thresholds
+Loaded from a TOML-file (CONFIG_FILE, see topology.example.toml), without a file the board of the project is used:
+
+    measurement_interval = 0.1
+    aggregation_interval = 0.5
+    adaptive = true             # Slower intervals while the air is stable (see scheduler.py)
+
+    [thresholds]                # Per gas, for all sensors of this gas
+    NH3 = { above = 35, twa = 25, stel = 35 }
+
+    [[devices]]
+    id = "lab-1"                # Stored as meta.device in every document (default: hostname)
+
+    [[devices.sensors]]
+    type = "NH3"                # SensorType
+    bus = 1
+    address = 0x75
+    name = "NH3"                # Optional (default: type), unique over all devices
+    above = 50                  # Optional alert-thresholds of this sensor (`above` and/or `below`)
+    rise = 10                   # Optional exposure-limits: `twa` (8 h), `stel` (15 min), `rise` (ppm/min), see exposure.py
+"""
+import dataclasses
+import socket
+import tomllib
+
+from .multigas_sensors import SensorType
+
+# Alert-thresholds (above, below) of the gases, for the thresholds not in the config
+default_limits = {
+    SensorType.NH3: (50, None),  # Health risk NH3 above 50 PPM for a 8-Hour-Shift
+    SensorType.CO: (100, None),  # Health risk CO above 100PPM
+    SensorType.O2: (None, 20),  # Health risk O2 below 17%
+}
+
+# Exposure-limits (ppm) of the gases, for the limits not in the config, the 8-hour limit is the time-weighted average
+default_exposure = {
+    SensorType.NH3: dict(twa=25, stel=35),  # NIOSH REL
+    SensorType.CO: dict(twa=25),  # ACGIH TLV
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class SensorConfig:
+    name: str
+    device: str
+    sensor_type: SensorType
+    bus: int
+    address: int
+    above: float | None = None  # Alert above this concentration
+    below: float | None = None  # Alert below this concentration
+    twa: float | None = None  # Alert above this 8-hour time-weighted average
+    stel: float | None = None  # Alert above this 15-minute average
+    rise: float | None = None  # Alert when the concentration rises faster (ppm per minute)
+
+    @property
+    def meta(self) -> dict:
+        return dict(type=self.sensor_type.name, bus=self.bus, address=self.address)
+
+
+@dataclasses.dataclass
+class Topology:
+    devices: dict[str, list[SensorConfig]]
+    measurement_interval: float = 0.1
+    aggregation_interval: float = 0.5
+    adaptive: bool = True
+
+    @property
+    def sensors(self) -> list[SensorConfig]:
+        return [sensor for sensors in self.devices.values() for sensor in sensors]
+
+
+    def buses(self) -> dict[int, list[SensorConfig]]:
+        """Sensors per I2C-bus (of all devices)"""
+        buses = {}
+        for sensor in self.sensors:
+            buses.setdefault(sensor.bus, []).append(sensor)
+        return buses
+
+
+def default_topology(device: str | None = None) -> Topology:
+    """NH3, CO and O2 on bus 1, like the board of the project"""
+    return parse_topology(
+        dict(
+            devices=[
+                dict(
+                    id=device,
+                    sensors=[
+                        dict(type="NH3", bus=1, address=0x75),
+                        dict(type="CO", bus=1, address=0x76),
+                        dict(type="O2", bus=1, address=0x77),
+                    ],
+                )
+            ]
+        )
+    )
+
+
+def _sensor_type(name) -> SensorType:
+    try:
+        return SensorType[name]
+    except KeyError:
+        raise ValueError(f"Unknown sensor-type {name!r}, one of {[t.name for t in SensorType]}") from None
+
+
+def parse_topology(config: dict) -> Topology:
+    thresholds = {_sensor_type(gas): limits for gas, limits in config.get("thresholds", {}).items()}
+
+    devices = {}
+    names = set()
+    addresses = set()
+    for device_config in config.get("devices", []):
+        device = device_config.get("id") or socket.gethostname()
+        if device in devices:
+            raise ValueError(f"Device {device!r} is configured twice")
+
+        sensors = devices[device] = []
+        for sensor_config in device_config.get("sensors", []):
+            sensor_type = _sensor_type(sensor_config["type"])
+            name = sensor_config.get("name", sensor_type.name)
+            if name in names:
+                raise ValueError(f"Sensor-name {name!r} is used twice, set a unique `name` for the sensor")
+            names.add(name)
+
+            bus, address = sensor_config.get("bus", 1), sensor_config["address"]
+            if (bus, address) in addresses:
+                raise ValueError(f"Address 0x{address:02x} on bus {bus} is used twice")
+            addresses.add((bus, address))
+
+            # Every limit on its own: of the sensor, of its gas or the default,
+            # so e.g. `CO = { twa = 25 }` doesn't drop the default `above` of CO
+            gas_limits = thresholds.get(sensor_type, {})
+            above, below = default_limits.get(sensor_type, (None, None))
+            defaults = dict(above=above, below=below, **default_exposure.get(sensor_type, {}))
+            limits = {
+                key: sensor_config.get(key, gas_limits.get(key, defaults.get(key)))
+                for key in ("above", "below", "twa", "stel", "rise")
+            }
+
+            sensors.append(
+                SensorConfig(
+                    name=name,
+                    device=device,
+                    sensor_type=sensor_type,
+                    bus=bus,
+                    address=address,
+                    **limits,
+                )
+            )
+
+    if not names:
+        raise ValueError("No sensors configured")
+
+    return Topology(
+        devices,
+        measurement_interval=config.get("measurement_interval", Topology.measurement_interval),
+        aggregation_interval=config.get("aggregation_interval", Topology.aggregation_interval),
+        adaptive=config.get("adaptive", Topology.adaptive),
+    )
+
+
+def load_topology(path) -> Topology:
+    with open(path, "rb") as f:
+        return parse_topology(tomllib.load(f))
@@ -0,0 +1,252 @@
+"""
+The two gas-processes of the multi-process mode (see iot_project/supervisor.py), connected by a SharedSampleRing:
+- SafetySystem: sensors, alarm and sampling only, a DB- or car-problem can't delay the alarm (own /metrics-port)
+- StorageWorker: aggregation of the samples into the documents of the MonitoringSystem, DB-writer and HTTP-server
+"""
+import datetime
+import math
+import socket
+
+import numpy as np
+import trio
+
+from .aggregation import StreamingAggregator
+from .db_writer import BufferedWriter
+from .documents import AggregationEncoder, StorageMode
+from .gas_monitoring_system import SamplingSystem, encode_documents, sampling_info
+from .health import ErrorType, SensorState
+from .publisher import LatestReading, MetricsServer
+from .scheduler import SamplingLevel
+from .shared_ring import SAMPLE, WINDOW, OK, FIRST_ERROR, NOT_POLLED, SharedSampleRing
+from .spool import Spool
+from .topology import Topology, default_topology
+from .. import logs, metrics
+
+log = logs.get_logger(__name__)
+
+_error_types = tuple(ErrorType)  # Status FIRST_ERROR + i
+_sensor_states = tuple(SensorState)
+_error_codes = {error: FIRST_ERROR + i for i, error in enumerate(_error_types)}
+_state_codes = {state: i for i, state in enumerate(_sensor_states)}
+
+
+def _time_ns(time: datetime.datetime) -> int:
+    return int(time.timestamp() * 1e9)
+
+
+class SafetySystem(SamplingSystem):
+    """
+    Sampling and alarm without DB-writer and dashboard: every poll and the end of every aggregation-window
+    are appended to the ring, the StorageWorker (other process) aggregates and stores them
+    The metrics of this process (alarm-latency, I2C-transfers, stalls) are served on their own `metrics_port`
+    """
+
+    def __init__(self, ring: SharedSampleRing, mongo_uri=None, *, metrics_port: int | None = None, **kwargs):
+        super().__init__(mongo_uri, **kwargs)
+        self.metrics_port = metrics_port
+        self.ring = ring
+        self._index = {name: i for i, name in enumerate(ring.gases)}
+        missing = set(self.sensors) - set(self._index)
+        if missing:
+            raise ValueError(f"Sensors {sorted(missing)} are not in the sample-ring")
+        # After a restart the windows continue after the ones of the previous process in the ring
+        rows, _, _ = ring.read(0)
+        self._window_offset = int(rows["window"].max()) + 1 if len(rows) else 0
+
+
+    async def main_task(self):
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(self.alert_manager.alert_loop)
+            nursery.start_soon(self.measurement_loop)
+            with trio.move_on_after(self.boot_timeout):
+                await self.first_sample.wait()
+            nursery.start_soon(self.restore_exposure)
+            nursery.start_soon(metrics.measure_scheduling_lag)
+            if self.metrics_port is not None:
+                nursery.start_soon(MetricsServer().serve, self.metrics_port)
+
+
+    def _states(self) -> list[int]:
+        states = [0] * len(self.ring.gases)
+        for name, health in self.health.items():
+            states[self._index[name]] = _state_codes[health.state]
+        return states
+
+
+    def _record_sample(self, window, time, results, errors):
+        n = len(self.ring.gases)
+        value, temperature, status = [math.nan] * n, [math.nan] * n, [NOT_POLLED] * n
+        for name, result in results.items():
+            i = self._index[name]
+            if name in errors:
+                status[i] = _error_codes[errors[name]]
+            else:
+                value[i], temperature[i], status[i] = result.gas_concentration, result.temperature, OK
+        self.ring.append(
+            SAMPLE,
+            time_ns=_time_ns(time),
+            window=self._window_offset + window,
+            level=self.scheduler.level,
+            value=value,
+            temperature=temperature,
+            status=status,
+            state=self._states(),
+        )
+
+
+    def _aggregate(self, bus, window, time, polls):
+        # The samples are aggregated by the StorageWorker, only the end of the window is appended
+        for name in bus.sensors:
+            self.aggregators[name].reset()
+        pending = self._windows.setdefault(window, dict(buses=0, time=time, polls=0))
+        pending["buses"] += 1
+        pending["polls"] = max(pending["polls"], polls)
+        if time is not None and (pending["time"] is None or time > pending["time"]):
+            pending["time"] = time
+        if pending["buses"] < len(self.buses):
+            return
+
+        del self._windows[window]
+        duration, level = self.scheduler.close(window)
+        self.ring.append(
+            WINDOW,
+            time_ns=_time_ns(pending["time"] or self.now()),
+            window=self._window_offset + window,
+            level=level,
+            polls=pending["polls"],
+            duration=duration,
+            state=self._states(),
+        )
+
+
+class StorageWorker:
+    """
+    Reads the ring of the SafetySystem and stores the same documents as the MonitoringSystem
+    After a restart it continues with the first window not yet closed, the samples of it are still in the ring
+    """
+
+    def __init__(
+        self,
+        ring: SharedSampleRing,
+        mongo_uri,
+        *,
+        topology: Topology | None = None,
+        spool_dir=None,
+        storage: StorageMode = StorageMode.documents,
+        device: str | None = None,
+        http_port: int | None = 8080,
+        mqtt_host: str | None = None,
+        poll_interval=0.05,
+    ):
+        self.ring = ring
+        self.device = socket.gethostname() if device is None else device
+        self.topology = default_topology(self.device) if topology is None else topology
+        self.encoders = {
+            device: AggregationEncoder(c.name for c in device_configs)
+            for device, device_configs in self.topology.devices.items()
+        }
+        self.meta = {
+            device: dict(device=device, sensors={c.name: c.meta for c in device_configs})
+            for device, device_configs in self.topology.devices.items()
+        }
+        self.writer = BufferedWriter(
+            mongo_uri,
+            queue=None if spool_dir is None else Spool(spool_dir),
+            mode=storage,
+        )
+        self.latest = LatestReading()
+        self.http_port = http_port
+        self.mqtt_host = mqtt_host
+        self.poll_interval = poll_interval
+
+        self.position = None  # Sequence-number of the next row to read
+        self.lost = 0  # Rows overwritten before they were read
+        self._closed = -1  # Last window stored
+        self._windows = {}  # Window -> sensor -> StreamingAggregator
+
+        metrics.callback(
+            "iot_ring_lost_rows_total", "Samples overwritten in the shared ring before the storage-worker read them",
+            lambda: self.lost, type="counter",
+        )
+        metrics.callback(
+            "iot_ring_lag_rows", "Rows in the shared ring not yet read by the storage-worker",
+            lambda: None if self.position is None else self.ring.head - self.position,
+        )
+
+
+    def __enter__(self):
+        if self.mqtt_host is not None:
+            self.latest.connect_mqtt(self.mqtt_host, f"iot_project/{self.device}")
+
+
+    def __exit__(self, type, value, tb):
+        self.latest.disconnect_mqtt()
+        self.writer.close()
+
+
+    async def main_task(self):
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(self.consume_loop)
+            nursery.start_soon(self.writer.run)
+            nursery.start_soon(metrics.measure_scheduling_lag)
+            if self.http_port is not None:
+                nursery.start_soon(self.latest.serve, self.http_port)
+
+
+    def _start_position(self) -> int:
+        """First row of the oldest window not yet stored"""
+        self._closed = self.ring.stored_window
+        rows, end, _ = self.ring.read(0)
+        open_rows = np.flatnonzero(rows["window"] > self._closed)
+        return int(rows["seq"][open_rows[0]]) if len(open_rows) else end
+
+
+    async def consume_loop(self):
+        self.position = self._start_position()
+        while True:
+            rows, self.position, lost = self.ring.read(self.position, max_rows=1000)
+            if lost:
+                self.lost += lost
+                log.warning("ring-overrun", lost=lost)
+            for row in rows:
+                if row["window"] <= self._closed:
+                    continue  # Read again after a restart, the window is stored already
+                if row["kind"] == SAMPLE:
+                    self._add(row)
+                else:
+                    self._store(row)
+            await trio.sleep(self.poll_interval if len(rows) < 1000 else 0)
+
+
+    def _add(self, row):
+        window = int(row["window"])
+        aggregators = self._windows.get(window)
+        if aggregators is None:
+            aggregators = self._windows[window] = {name: StreamingAggregator() for name in self.ring.gases}
+        for name, value, status in zip(self.ring.gases, row["value"].tolist(), row["status"].tolist()):
+            if status == OK:
+                aggregators[name].add(value)
+            elif status >= FIRST_ERROR:
+                aggregators[name].add_failure(_error_types[status - FIRST_ERROR].value)
+
+
+    def _store(self, row):
+        window = int(row["window"])
+        # Windows before this one are incomplete (started before the ring was read, or the SafetySystem was restarted)
+        for older in [w for w in self._windows if w < window]:
+            del self._windows[older]
+        aggregators = self._windows.pop(window, None) or {name: StreamingAggregator() for name in self.ring.gases}
+
+        documents = encode_documents(
+            self.encoders,
+            self.meta,
+            {name: aggregator.result() for name, aggregator in aggregators.items()},
+            {name: aggregator.errors for name, aggregator in aggregators.items() if aggregator.errors},
+            health={name: _sensor_states[state].value for name, state in zip(self.ring.gases, row["state"].tolist())},
+            time=datetime.datetime.fromtimestamp(int(row["time"]) / 1e9, datetime.timezone.utc),
+            sampling=sampling_info(SamplingLevel(int(row["level"])), int(row["polls"]), float(row["duration"])),
+        )
+        for document in documents.values():
+            self.writer.put(document)
+        self.latest.publish(next(iter(documents.values())) if len(documents) == 1 else documents)
+        self._closed = self.ring.stored_window = window
@@ -0,0 +1,117 @@
+"""
+Structured, rate-limited logging instead of prints: every record is an event with fields,
+written as one JSON-object per line (journald keeps the lines, `jq` reads them) or as `event key=value` text
+
+    log = logs.get_logger(__name__)
+    log.warning("sensor-problem", sensor="NH3", failures=3)
+
+Every event of a logger is rate-limited on its own (token-bucket: `burst` records, then one every 1/`rate` seconds),
+so a failing sensor can't flood the journal. The number of suppressed records is added to the next one (`suppressed`).
+Safety-relevant events (e.g. the alerts) are passed as `exempt` to get_logger, they are never suppressed.
+Records below the log-level cost only the level-check, the fields are not formatted.
+"""
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+_reserved = ("exc_info", "stack_info", "stacklevel", "extra")
+
+
+class RateLimiter:
+    """Token-bucket per key"""
+
+    def __init__(self, rate=0.1, burst=5, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._buckets = {}  # key -> [tokens, last time, suppressed]
+        self._lock = threading.Lock()
+
+
+    def allow(self, key) -> tuple[bool, int]:
+        """(allowed, suppressed since the last allowed record)"""
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                bucket[2] += 1
+                return False, 0
+            bucket[0] = tokens - 1
+            suppressed, bucket[2] = bucket[2], 0
+            return True, suppressed
+
+
+class EventLogger(logging.LoggerAdapter):
+    """logging.Logger with keyword-fields and rate-limiting per event"""
+
+    def __init__(self, logger: logging.Logger, limiter: RateLimiter | None, exempt=()):
+        super().__init__(logger, {})
+        self.limiter = limiter
+        self.exempt = frozenset(exempt)  # Events without rate-limit
+
+
+    def log(self, level, msg, *args, **kwargs):
+        if not self.isEnabledFor(level):
+            return
+        fields = {k: kwargs.pop(k) for k in list(kwargs) if k not in _reserved}
+        if self.limiter is not None and msg not in self.exempt:
+            allowed, suppressed = self.limiter.allow(msg)
+            if not allowed:
+                return
+            if suppressed:
+                fields["suppressed"] = suppressed
+        kwargs["extra"] = {**kwargs.get("extra", {}), "fields": fields}
+        kwargs.setdefault("stacklevel", 3)  # Location of the caller, not of the adapter
+        self.logger.log(level, msg, *args, **kwargs)
+
+
+def get_logger(name: str, *, rate=0.1, burst=5, exempt=()) -> EventLogger:
+    """rate=None: no rate-limit, `exempt`: events, that are always logged"""
+    return EventLogger(logging.getLogger(name), None if rate is None else RateLimiter(rate, burst), exempt)
+
+
+def _default(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    return repr(obj)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        event = dict(
+            time=datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            level=record.levelname.lower(),
+            logger=record.name,
+            event=record.getMessage(),
+        )
+        event.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            event["exception"] = self.formatException(record.exc_info)
+        return json.dumps(event, default=_default)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{k}={v}" for k, v in getattr(record, "fields", {}).items())
+        line = f"{self.formatTime(record)} {record.levelname:<7} {record.name}: {record.getMessage()} {fields}".rstrip()
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def setup_logging(level: str | None = None, format: str | None = None):
+    """Log-level (default: LOG_LEVEL or INFO) and format `json` or `text` (default: LOG_FORMAT or json) of the root-logger"""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if (format or os.getenv("LOG_FORMAT", "json")) == "json" else TextFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
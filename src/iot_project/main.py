@@ -1,9 +1,37 @@
-import os
+from time import perf_counter
 
-import trio
+BOOT_START = perf_counter()  # Before the imports, they are a good part of the start on a Raspberry Pi
 
-from .sunfounder_picar.picarx_control import car_control_loop
-from .gas_sensors.gas_monitoring_system import MonitoringSystem
+import importlib  # noqa: E402
+import os  # noqa: E402
+
+import trio  # noqa: E402
+
+from .gas_sensors.gas_monitoring_system import MonitoringSystem, DEFAULT_SPOOL_DIR  # noqa: E402
+from .gas_sensors.documents import StorageMode  # noqa: E402
+from .gas_sensors.topology import load_topology  # noqa: E402
+from . import logs, metrics  # noqa: E402
+from .tasks import keep_running  # noqa: E402
+
+log = logs.get_logger(__name__)
+boot_seconds = metrics.gauge(
+    "iot_boot_seconds", "Seconds from the start of main.py to the boot-milestones", labels=("milestone",)
+)
+
+
+def _milestone(name: str) -> float:
+    seconds = perf_counter() - BOOT_START
+    boot_seconds.labels(milestone=name).set(round(seconds, 4))
+    return seconds
+
+
+async def _boot_report(system: MonitoringSystem):
+    """Time to alarm-ready (GPIO set up, alert_loop running) and to the first checked sample"""
+    await system.alert_manager.ready.wait()
+    alarm_ready = _milestone("alarm_ready")
+    await system.first_sample.wait()
+    first_sample = _milestone("first_sample")
+    log.info("boot", alarm_ready_s=round(alarm_ready, 3), first_sample_s=round(first_sample, 3))
 
 
 async def main():
@@ -11,17 +39,51 @@ async def main():
 
     # Load environment variables from .env file
     dotenv.load_dotenv()
+    logs.setup_logging()
+
+    # Optional: report task-steps, that block the event-loop longer than STALL_THRESHOLD seconds
+    stall_threshold = os.getenv("STALL_THRESHOLD")
+    if stall_threshold is not None:
+        trio.lowlevel.add_instrument(metrics.StallDetector(float(stall_threshold)))
 
     # Get MongoDB-URI
     mongo_uri = os.getenv("MONGODB_URI")
 
-    system = MonitoringSystem(mongo_uri)
+    config_file = os.getenv("CONFIG_FILE")
+
+    system = MonitoringSystem(
+        mongo_uri,
+        topology=None if config_file is None else load_topology(config_file),
+        spool_dir=os.getenv("SPOOL_DIR", DEFAULT_SPOOL_DIR),
+        storage=StorageMode(os.getenv("STORAGE_MODE", "documents")),
+        http_port=int(os.getenv("HTTP_PORT", 8080)),
+        mqtt_host=os.getenv("MQTT_HOST"),
+        capture_dir=os.getenv("CAPTURE_DIR"),
+    )
 
     with system:
+        _milestone("gpio_ready")
         async with trio.open_nursery() as nursery:
-            nursery.start_soon(car_control_loop)
+            # Boot-stages: alarm and sampling first, MonitoringSystem.main_task adds the DB-writer and the HTTP-server,
+            # the car (picarx, websocket-server) is imported last in a worker-thread
+            nursery.start_soon(_boot_report, system)
             nursery.start_soon(system.main_task)
+            with trio.move_on_after(system.boot_timeout):
+                await system.first_sample.wait()
+
+            car = await trio.to_thread.run_sync(
+                importlib.import_module, f"{__package__}.sunfounder_picar.picarx_control"
+            )
+            # An error of the car (PiCar-X, websocket-server) is logged and the car started again, the alarm goes on
+            nursery.start_soon(keep_running, "car", car.car_control_loop)
+            _milestone("car_started")
 
 
 if __name__ == "__main__":
-    trio.run(main)
+    # PROCESS_MODE=multi: safety-path, storage and car in their own processes, see supervisor.py
+    if os.getenv("PROCESS_MODE", "single") == "multi":
+        from .supervisor import run_processes
+
+        trio.run(run_processes)
+    else:
+        trio.run(main)
@@ -0,0 +1,280 @@
+"""
+Metrics of the trio-tasks (gas_sensors and sunfounder_picar) in the Prometheus text-format,
+served by the HTTP-server of the gas_sensors at GET /metrics (see gas_sensors/publisher.py)
+
+    latency = metrics.histogram("iot_i2c_transfer_seconds", "Duration of an I2C-transfer", labels=("bus", "operation"))
+    read_latency = latency.labels(bus="1", operation="read")  # Look up the child once, outside of the hot path
+    read_latency.observe(0.0012)
+
+Observing is a lock, a bisect and two additions, so the metrics can stay on in production.
+Values, that are counted elsewhere anyway (e.g. WriterStats), are read only when scraped with `callback`.
+StallDetector (optional trio-instrument) reports task-steps, that block the event-loop.
+"""
+import bisect
+import math
+import threading
+import time
+
+import trio
+
+from . import logs
+
+log = logs.get_logger(__name__)
+
+# Seconds, from fast I2C-transfers up to stalled DB-writes
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _format_labels(names, values, extra="") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterValue:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()  # Also incremented from worker-threads
+
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeValue(_CounterValue):
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one: +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {}
+        if not self.label_names:
+            self._default = self.labels()
+
+
+    def _new_value(self):
+        raise NotImplementedError
+
+
+    def labels(self, **labels):
+        """The value of one label-combination (created on first use)"""
+        key = tuple(str(labels[name]) for name in self.label_names)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_value()
+        return child
+
+
+    def samples(self):
+        """(suffix, label-string, value) of all children"""
+        for key, child in list(self._children.items()):
+            yield "", _format_labels(self.label_names, key), child.value
+
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_value(self):
+        return _CounterValue()
+
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_value(self):
+        return _GaugeValue()
+
+
+    def set(self, value):
+        self._default.set(value)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels)
+
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+
+    def samples(self):
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for le, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield "_bucket", _format_labels(self.label_names, key, f'le="{_format_value(le)}"'), cumulative
+            yield "_sum", _format_labels(self.label_names, key), total
+            yield "_count", _format_labels(self.label_names, key), cumulative
+
+
+class Callback(Metric):
+    """Read from `function` when scraped: a number, or a dict label-values (tuple) -> number"""
+
+    def __init__(self, name: str, help: str, function, *, type="gauge", labels=()):
+        self.function = function
+        self.type = type
+        super().__init__(name, help, labels)
+
+
+    def _new_value(self):
+        return None
+
+
+    def samples(self):
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            if value is not None:
+                yield "", _format_labels(self.label_names, key), value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+
+    def register(self, metric: Metric) -> Metric:
+        """Registering the same name again replaces the metric (e.g. a new MonitoringSystem in the notebooks)"""
+        self.metrics[metric.name] = metric
+        return metric
+
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception as ex:
+                log.warning("metric-failed", metric=metric.name, error=repr(ex))
+        return ("\n".join(lines) + "\n").encode()
+
+
+registry = Registry()
+
+
+def counter(name, help, labels=()) -> Counter:
+    return registry.register(Counter(name, help, labels))
+
+
+def gauge(name, help, labels=()) -> Gauge:
+    return registry.register(Gauge(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, help, labels, buckets))
+
+
+def callback(name, help, function, *, type="gauge", labels=()) -> Callback:
+    return registry.register(Callback(name, help, function, type=type, labels=labels))
+
+
+loop_iteration_seconds = histogram(
+    "iot_loop_iteration_seconds",
+    "Duration of one iteration of a control-loop (e.g. a sensor-poll with its settle-time), without the wait for the next one",
+    labels=("loop",),
+)
+scheduling_lag_seconds = histogram(
+    "iot_trio_scheduling_lag_seconds", "How late a sleeping trio-task is woken up"
+)
+task_step_seconds = histogram(
+    "iot_trio_task_step_seconds", "Duration of the trio task-steps (only with the StallDetector)"
+)
+stalls_total = counter(
+    "iot_trio_stalls_total", "Task-steps longer than the stall-threshold, the event-loop was blocked (StallDetector)"
+)
+
+
+async def measure_scheduling_lag(interval=0.5):
+    """Task, that sleeps `interval` seconds in a loop and records how late it wakes up"""
+    while True:
+        start = trio.current_time()
+        await trio.sleep(interval)
+        scheduling_lag_seconds.observe(max(trio.current_time() - start - interval, 0.0))
+
+
+class StallDetector(trio.abc.Instrument):
+    """
+    trio-instrument: duration of every task-step, a step longer than `threshold` seconds blocked all other tasks
+    (e.g. a blocking I2C- or DB-call outside of a worker-thread). Enabled with STALL_THRESHOLD, see main.py
+    `steps`: list, that collects the duration of every step too (the percentiles of benchmarks/pipeline.py)
+    """
+
+    def __init__(self, threshold=0.05, steps: list | None = None):
+        self.threshold = threshold
+        self.steps = steps
+        self._start = None
+
+
+    def before_task_step(self, task):
+        self._start = time.perf_counter()
+
+
+    def after_task_step(self, task):
+        if self._start is None:
+            return
+        duration = time.perf_counter() - self._start
+        self._start = None
+        task_step_seconds.observe(duration)
+        if self.steps is not None:
+            self.steps.append(duration)
+        if duration > self.threshold:
+            stalls_total.inc()
+            log.warning("event-loop-stall", task=task.name, duration_ms=round(duration * 1e3, 1))
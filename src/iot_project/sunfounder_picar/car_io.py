@@ -0,0 +1,160 @@
+"""
+I/O of the PiCar-X for the car_control_loop, without blocking the trio-loop (shared with the gas-sampling and alerting):
+- the sensors (ultrasonic distance, grayscale) are read in worker-threads at their own rates,
+  the control-loop only takes the latest reading with its time from the cache
+- motor and steering commands go through a coalescing queue: a worker applies only the newest command of each actuator
+The robot-hat is on the I2C-bus (grayscale-ADC, motor- and servo-PWM), so these transfers share one lock;
+the ultrasonic-sensor only uses GPIO-pins and can wait for its echo at the same time.
+"""
+import dataclasses
+import math
+import threading
+from time import perf_counter
+
+import trio
+
+from .. import logs, metrics
+
+log = logs.get_logger(__name__)
+sensor_read_seconds = metrics.histogram(
+    "iot_car_sensor_read_seconds", "Duration of a sensor-read of the PiCar-X (worker-thread)", labels=("sensor",)
+)
+sensor_errors_total = metrics.counter("iot_car_sensor_errors_total", "Failed sensor-reads of the PiCar-X", labels=("sensor",))
+actuator_commands_total = metrics.counter(
+    "iot_car_actuator_commands_total",
+    "Motor- and steering-commands: applied, or coalesced (replaced by a newer one before they were applied)",
+    labels=("actuator", "result"),
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class Reading:
+    value: object
+    time: float  # trio-time of the end of the read
+
+
+class CarIO:
+    """
+    Sensors and actuators of a picarx.Picarx (px=None: no car, the commands are only logged)
+    `run` is the task of the worker-loops, `reading`/`drive`/`steer` are called from the control-loop and never block
+    """
+
+    def __init__(self, px=None, *, distance_interval=0.05, grayscale_interval=0.02):
+        self.px = px
+        self.readings: dict[str, Reading] = {}
+        self._i2c_lock = threading.Lock()  # Robot-hat: grayscale-ADC and PWM of motors and servos
+        self._sensors = {}
+        if px is not None:
+            self._sensors = dict(
+                distance=(px.get_distance, distance_interval, None),
+                grayscale=(px.get_grayscale_data, grayscale_interval, self._i2c_lock),
+            )
+        self._commands = {}  # Actuator -> newest command, not yet applied
+        self._applied = {}  # Actuator -> last applied command
+        self._pending = trio.Event()
+
+
+    @property
+    def sensors(self) -> tuple[str, ...]:
+        return tuple(self._sensors)
+
+
+    def reading(self, sensor: str) -> Reading | None:
+        return self.readings.get(sensor)
+
+
+    def age(self, sensor: str) -> float:
+        """Seconds since the latest reading of a sensor (inf without reading)"""
+        reading = self.readings.get(sensor)
+        return math.inf if reading is None else trio.current_time() - reading.time
+
+
+    def _command(self, actuator: str, value):
+        if actuator in self._commands:
+            if self._commands[actuator] == value:
+                return
+            actuator_commands_total.labels(actuator=actuator, result="coalesced").inc()
+        elif self._applied.get(actuator) == value:
+            return
+        self._commands[actuator] = value
+        self._pending.set()
+
+
+    def drive(self, speed: int):
+        """Speed from -100 (backward) to 100 (forward)"""
+        self._command("motor", speed)
+
+
+    def steer(self, angle: float):
+        self._command("steering", angle)
+
+
+    async def run(self):
+        async with trio.open_nursery() as nursery:
+            for sensor in self._sensors:
+                nursery.start_soon(self._sensor_loop, sensor)
+            nursery.start_soon(self._actuator_loop)
+
+
+    def _read(self, read, lock):
+        if lock is None:
+            return read()
+        with lock:
+            return read()
+
+
+    async def _sensor_loop(self, sensor: str):
+        read, interval, lock = self._sensors[sensor]
+        read_seconds = sensor_read_seconds.labels(sensor=sensor)
+        errors = sensor_errors_total.labels(sensor=sensor)
+        next_read = trio.current_time()
+        while True:
+            start = perf_counter()
+            try:
+                value = await trio.to_thread.run_sync(self._read, read, lock)
+            except Exception as ex:
+                errors.inc()
+                log.warning("car-sensor-error", sensor=sensor, error=repr(ex))
+            else:
+                self.readings[sensor] = Reading(value, trio.current_time())
+            read_seconds.observe(perf_counter() - start)
+
+            # Own rate, a slow read (e.g. no echo) delays only this sensor
+            next_read = max(next_read + interval, trio.current_time())
+            await trio.sleep_until(next_read)
+
+
+    def _apply(self, actuator: str, value):
+        px = self.px
+        if px is None:
+            if actuator == "motor":
+                log.info("drive", direction="forward" if value > 0 else "backward" if value < 0 else "stop", speed=abs(value))
+            else:
+                log.info("steer", angle=value)
+            return
+
+        with self._i2c_lock:
+            if actuator == "motor":
+                if value < 0:
+                    px.backward(abs(value))
+                else:
+                    px.forward(value)
+            else:
+                px.set_dir_servo_angle(value)
+
+
+    async def _actuator_loop(self):
+        try:
+            while True:
+                await self._pending.wait()
+                self._pending = trio.Event()
+                # Newest command of every actuator, commands arriving meanwhile are coalesced into the next round
+                commands, self._commands = self._commands, {}
+                for actuator, value in commands.items():
+                    await trio.to_thread.run_sync(self._apply, actuator, value)
+                    self._applied[actuator] = value
+                    actuator_commands_total.labels(actuator=actuator, result="applied").inc()
+        finally:
+            if self.px is not None:
+                with trio.CancelScope(shield=True):
+                    await trio.to_thread.run_sync(self._apply, "motor", 0)  # Don't keep driving without control
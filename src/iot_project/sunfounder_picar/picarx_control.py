@@ -1,15 +1,21 @@
 import argparse
+import math
+from time import perf_counter
 
 import trio
 
-from .sunfounder_controller import SunFounderController
+from .sunfounder_controller import SunFounderController, latest
+from .car_io import CarIO
+from .. import logs, metrics
+
+log = logs.get_logger(__name__)
 
 
 
 class DummyOSModule:
     @staticmethod
     def getlogin():
-        print("Login-Overwrite")
+        log.info("login-overwrite")
         return None
 
 
@@ -20,8 +26,27 @@ Adapted from https://github.com/sunfounder/sunfounder-controller/blob/master/exa
 speed_values = [0, 10, 20, 30]
 control_history = []
 
-
-async def car_control_loop(real_picar: bool = True):
+period = 0.02  # Hard deadline of every control-iteration (50 Hz)
+stale_after = 0.2  # Sensor-readings older than this (s) are not trusted
+safe_speed = 10  # Speed-limit close to a wall, or while the distance is unknown
+
+deadline_misses_total = metrics.counter(
+    "iot_car_deadline_misses_total", "Control-iterations, that ended after their 20 ms deadline"
+)
+stale_readings_total = metrics.counter(
+    "iot_car_stale_readings_total", "Control-iterations with a too old (or missing) sensor-reading", labels=("sensor",)
+)
+
+
+async def car_control_loop(real_picar: bool = True, *, task_status=trio.TASK_STATUS_IGNORED):
+    """
+    Drives the car with the controls of the SunFounder Controller-App:
+    the websocket-server and the CarIO (sensor-reads and actuators in worker-threads) run in the nursery of this task.
+    The control-loop itself never blocks: it reacts to new controls right away and, with a real PiCar-X,
+    runs at least every 20 ms on the cached sensor-readings, with a hard deadline per iteration.
+    `task_status.started()` when the websocket-server is listening (main.py runs it with keep_running)
+    """
+    px = None
     if real_picar:
         import picarx.picarx
         picarx.picarx.os = DummyOSModule()
@@ -30,77 +55,75 @@ async def car_control_loop(real_picar: bool = True):
     sc = SunFounderController()
     sc.set_name("Explorer")
     sc.set_type("PiCar-X")
-    sc.start()
-
-    try:
-        current_speed = 0
-        current_direction = 0
-        prev_speed = current_speed
-        prev_dir = current_direction
-        running = True
-
-        while running:
-            k_val = sc.get("K")  # Left Joy-Stick
-            q_val = sc.get("Q")  # Right Joy-Stick
-
-            if k_val is not None and q_val is not None:
-                _, y = k_val  # y-Value
-                x, _ = q_val  # x-Value
-
-                dx = (
-                    sc.get("H", 50) - 50
-                ) // 5  # Slider for Fine-Adjustment of Stearing
-
-                current_direction = (
-                    x * 45 / 100 + dx
-                )  # Steuerwinkel muss von -45 bis +45 gehen
-                current_speed = y
-
-            if real_picar:
-                grayscale_data = px.get_grayscale_data()
-                sc.set("D", grayscale_data)
-
-            if real_picar:
-                distance = px.get_distance()
-                sc.set("F", distance)
-
-                if 0 < distance < 40:
-                    current_speed = min(
-                        max(-100, current_speed), 10
-                    )  # if car is close to a wall, speed-limit is set to 10 when going forward
-
-            sc.set("A", current_speed)
-
-            if current_speed != prev_speed:
-                s = current_speed
-                if s < 0:
-                    if real_picar:
-                        px.backward(abs(s))
-                    else:
-                        print(f"Backward {abs(s)}")
-                elif s > 0:
-                    if real_picar:
-                        px.forward(s)
-                    else:
-                        print(f"Forward {s}")
-                else:
-                    if real_picar:
-                        px.forward(0)
-                    else:
-                        print("Stop")
-                prev_speed = current_speed
-
-            if current_direction != prev_dir:
-                if real_picar:
-                    px.set_dir_servo_angle(current_direction)
-                else:
-                    print(f"Steer {current_direction}")
-                prev_dir = current_direction
-
-            await trio.sleep(0.02)
-
-    finally:
-        sc.close()
+    car = CarIO(px)
+
+    async with trio.open_nursery() as nursery:
+        await nursery.start(sc.serve)
+        nursery.start_soon(car.run)
+        task_status.started()
+        await _control(sc, car)
+        nursery.cancel_scope.cancel()
+
+
+async def _control(sc: SunFounderController, car: CarIO):
+    iteration_seconds = metrics.loop_iteration_seconds.labels(loop="car_control")
+    stale = {sensor: stale_readings_total.labels(sensor=sensor) for sensor in car.sensors}
+
+    current_speed = 0
+    current_direction = 0
+    # Without sensors there is nothing to do between two controls of the app
+    deadline = trio.current_time() + period if car.sensors else math.inf
+
+    while True:
+        await latest(sc.updates, deadline)
+        iteration_start = perf_counter()
+        if trio.current_time() >= deadline:
+            deadline += period
+
+        k_val = sc.get("K")  # Left Joy-Stick
+        q_val = sc.get("Q")  # Right Joy-Stick
+
+        if k_val is not None and q_val is not None:
+            _, y = k_val  # y-Value
+            x, _ = q_val  # x-Value
+
+            dx = (
+                sc.get("H", 50) - 50
+            ) // 5  # Slider for Fine-Adjustment of Stearing
+
+            current_direction = (
+                x * 45 / 100 + dx
+            )  # Steuerwinkel muss von -45 bis +45 gehen
+            current_speed = y
+
+        speed = current_speed
+        for sensor, counter in stale.items():
+            if car.age(sensor) > stale_after:
+                counter.inc()
+
+        if "grayscale" in stale:
+            grayscale = car.reading("grayscale")
+            sc.set("D", None if grayscale is None else grayscale.value)
+
+        if "distance" in stale:
+            distance = car.reading("distance")
+            sc.set("F", None if distance is None else distance.value)
+
+            if car.age("distance") > stale_after or 0 < distance.value < 40:
+                speed = min(
+                    max(-100, speed), safe_speed
+                )  # if car is close to a wall (or the distance is unknown), speed-limit is set to 10 when going forward
+
+        sc.set("A", speed)
+        car.drive(speed)  # Only queued, the newest command is applied by the worker of the CarIO
+        car.steer(current_direction)
+
+        iteration_seconds.observe(perf_counter() - iteration_start)
+        now = trio.current_time()
+        if now > deadline:
+            # Late (e.g. a stall of the trio-loop): count it and continue with the next period from now
+            deadline_misses_total.inc()
+            deadline = now + period
 
 
 async def main(args):
@@ -109,6 +132,7 @@ async def main(args):
 
 
 if __name__ == "__main__":
+    logs.setup_logging()
     parser = argparse.ArgumentParser(prog="recon")
     parser.add_argument("-m", "--mock", default=False, action="store_true")
     args = parser.parse_args()
@@ -1,151 +1,142 @@
 import json
-import time
-import asyncio
-import threading
+import math
 
-import websockets
+import trio
+import trio_websocket
+
+from .. import logs, metrics
+from ..tasks import keep_running
+
+log = logs.get_logger(__name__)
+messages_total = metrics.counter(
+    "iot_controller_messages_total", "Websocket-messages of the SunFounder Controller-App", labels=("direction",)
+)
+updates_dropped_total = metrics.counter(
+    "iot_controller_updates_dropped_total", "Controls not handed to the car_control_loop, because it was behind"
+)
 
 
 class SunFounderController:
     """
-    Class for all Sunfounder Controller
-    Copied from https://github.com/sunfounder/sunfounder-controller/blob/master/sunfounder_controller/sunfounder_controller.py
+    Websocket-server for the SunFounder Controller-App, runs as trio-task (`serve`) in the nursery of the caller
+    Protocol from https://github.com/sunfounder/sunfounder-controller/blob/master/sunfounder_controller/sunfounder_controller.py:
+    the app sends its controls (joysticks, sliders, heartbeat) as JSON-object, the server answers with `send_dict`.
+    - Receiving is event-driven: every message of the app is handed to `updates` (memory-channel) right away
+    - `send_dict` is serialized only when it changes, and sent on changes and as answer to the app,
+      but at most every `min_send_interval` seconds (and at least every `keepalive` seconds)
     """
 
     PORT = 8765
 
-    send_dict = {
-        "Name": "",
-        "Type": None,
-        "Check": "SunFounder Controller",
-    }
-
-    recv_dict = {
-        "A": None,
-        "B": None,
-        "C": None,
-        "D": None,
-        "E": None,
-        "F": None,
-        "G": None,
-        "H": None,
-        "I": None,
-        "J": None,
-        "K": None,
-        "L": None,
-        "M": None,
-        "N": None,
-        "O": None,
-        "P": None,
-        "Q": None,
-        "Heart": None,
-    }
-
-
-    def __init__(self, port=PORT):
+    def __init__(self, port=PORT, *, min_send_interval=0.02, keepalive=1.0, buffer=16):
         self.port = port
-        self.server_thread = threading.Thread(target=self.work)
-        self.server_thread.daemon = True
-        self.client_num = 0
-        self.client = {}
+        self.min_send_interval = min_send_interval
+        self.keepalive = keepalive
+        self.send_dict = {
+            "Name": "",
+            "Type": None,
+            "Check": "SunFounder Controller",
+        }
+        self.recv_dict = {}  # Latest controls of the app
         self.is_received = False
+        self.clients = {}  # Number -> address of the connected apps
+
+        self._payload = None  # Serialized send_dict, None after a change
+        self._changed = trio.Event()  # Set when there is something to send
+        self._version = 0  # Counts the changes, so the send-loops don't miss one during their pause
+        self._update_channel, self.updates = trio.open_memory_channel(buffer)
+
 
+    def _signal(self):
+        self._version += 1
+        self._changed.set()
+        self._changed = trio.Event()
 
-    def start(self):
-        self.work_flag = True
-        self.server_thread.start()
 
+    @property
+    def payload(self) -> str:
+        if self._payload is None:
+            self._payload = json.dumps(self.send_dict)
+        return self._payload
 
-    def close(self):
-        self.server.close()
-        self.work_flag = False
-        # print('close done1')
-        # print( self.server_thread.is_alive())
-        # self.server_thread.join()
-        while len(self.client):
-            time.sleep(0.01)
-        print("close done")
 
+    async def serve(self, *, task_status=trio.TASK_STATUS_IGNORED):
+        """
+        Websocket-server, it runs in the nursery of the alarm (main.py): an error (e.g. the port is in use)
+        is logged and the server started again (see keep_running), it never reaches the caller
+        """
+        await keep_running(f"controller-{self.port}", self._serve, task_status=task_status)
 
-    def work(self):
-        asyncio.run(self.main())
 
+    async def _serve(self, *, task_status=trio.TASK_STATUS_IGNORED):
+        log.info("controller-start", port=self.port)
+        await trio_websocket.serve_websocket(
+            self._handler, "0.0.0.0", self.port, ssl_context=None, task_status=task_status
+        )
 
-    async def main(self):
-        self.server = await websockets.serve(self.handler, "0.0.0.0", self.port)
-        print(f"websocket server start at port {self.port}")
-        async with self.server:
-            await asyncio.Future()  # run forever
-        print("server closed")
 
+    async def _handler(self, request: trio_websocket.WebSocketRequest):
+        websocket = await request.accept()
+        number = len(self.clients) + 1
+        while number in self.clients:
+            number += 1
+        address = websocket.remote.address
+        self.clients[number] = address
+        log.info("controller-connected", client=number, address=address)
 
-    async def handler(self, websocket):
-        _client_num = self.client_num
-        _client_ip = websocket.remote_address[0]
-        self.client_num += 1
-        self.client[str(_client_num)] = _client_ip
-        print(f"client {_client_num, _client_ip} conneted")
-        # print(websocket.remote_address)
+        try:
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(self._send_loop, websocket)
+                await self._receive_loop(websocket)
+                nursery.cancel_scope.cancel()
+        except* trio_websocket.ConnectionClosed as group:
+            # Both loops can see the disconnect, with strict exception-groups (trio >= 0.25) it arrives as group
+            log.info("controller-disconnected", client=number, address=address, reason=repr(group.exceptions[0].reason))
+        finally:
+            del self.clients[number]
 
-        while self.work_flag:
+
+    async def _receive_loop(self, websocket):
+        while True:
+            message = await websocket.get_message()
+            messages_total.labels(direction="received").inc()
+            try:
+                controls = json.loads(message)
+            except json.JSONDecodeError:
+                self.is_received = False
+                log.warning("controller-invalid-message", message=message[:100])
+                continue
+            if not isinstance(controls, dict):
+                log.warning("controller-invalid-message", message=message[:100])
+                continue
+
+            self.recv_dict = controls
+            self.is_received = True
+            self.data_processing()
             try:
-                # recv
-                try:
-                    tmp = await asyncio.wait_for(websocket.recv(), timeout=0.001)
-                    # print("websocket.recv() temp: %s" % tmp)
-                except asyncio.TimeoutError as e:
-                    # print('asyncio.TimeoutError : %s'%e)
-                    pass
-
-                # send
-                try:
-                    # print(json.dumps(self.send_dict))
-                    await websocket.send(json.dumps(self.send_dict))
-                except websockets.exceptions.ConnectionClosed:
-                    raise
-                except Exception as e:
-                    print(f"send Exception: {e!r}")
-
-                #
-                try:
-                    tmp = json.loads(tmp)
-                    if isinstance(tmp, dict):
-                        self.recv_dict = tmp
-                        self.is_received = True
-                        self.data_processing()
-                    else:
-                        print("JSONDecodeError")
-                except json.decoder.JSONDecodeError:
-                    self.is_received = False
-                    print("JSONDecodeError")
-                except Exception as e:
-                    pass
-
-                await asyncio.sleep(0.01)
-
-            except websockets.exceptions.ConnectionClosed as ex:
-                # disconneted flag
-                print(f"{_client_num}: {ex!r}")
-                print(f"client {_client_num, _client_ip} disconneted")
-                break
-
-        self.client.pop(str(_client_num))
-        self.is_closed = True
+                self._update_channel.send_nowait(controls)
+            except trio.WouldBlock:
+                updates_dropped_total.inc()  # car_control_loop is behind, it only needs the latest controls anyway
+            self._signal()  # The app expects an answer
 
 
-    def data_processing(self):
-        if self.recv_dict["Heart"] == "ping":
-            self.send_dict["Heart"] = "pong"
+    async def _send_loop(self, websocket):
+        while True:
+            version = self._version
+            await websocket.send_message(self.payload)
+            messages_total.labels(direction="sent").inc()
+            await trio.sleep(self.min_send_interval)
+            if self._version == version:
+                with trio.move_on_after(self.keepalive):
+                    await self._changed.wait()
 
 
-    def start_work(self):
-        print("Start!")
-        self.loop.run_forever()
+    def data_processing(self):
+        if self.recv_dict.get("Heart") == "ping":
+            self.set("Heart", "pong")
 
 
     def get(self, key="A", default=None):
-        # if not isinstance(self.recv_dict, dict):
-        #     raise ValueError("recv_dict type error. type '%s', value: '%s'" % (type(self.recv_dict), self.recv_dict))
         return self.recv_dict.get(key, default)
 
 
@@ -154,29 +145,43 @@ class SunFounderController:
 
 
     def set(self, key="A_region", value=None):
+        if key in self.send_dict and self.send_dict[key] == value:
+            return
         self.send_dict[key] = value
+        self._payload = None
+        self._signal()
 
 
     def set_name(self, name: str = None):
-        self.send_dict["Name"] = name
+        self.set("Name", name)
 
 
     def set_type(self, type: str = None):
-        self.send_dict["Type"] = type
+        self.set("Type", type)
+
+
+async def latest(channel: trio.MemoryReceiveChannel, deadline=math.inf):
+    """Wait until the trio-time `deadline` for the next controls, newer ones already waiting replace them (None: no controls)"""
+    controls = None
+    with trio.move_on_at(deadline):
+        controls = await channel.receive()
+    if controls is None:
+        return None
+    while True:
+        try:
+            controls = channel.receive_nowait()
+        except trio.WouldBlock:
+            return controls
 
 
 if __name__ == "__main__":
-    sc = SunFounderController()
-    sc.start()
 
-    try:
-        while True:
-            if sc.is_received is True:
-                # get
-                print(sc.recv_dict)
-                # set
-                sc.send_dict = "ok"
-
-            time.sleep(0.1)
-    finally:
-        sc.close()
+    async def main():
+        sc = SunFounderController()
+        async with trio.open_nursery() as nursery:
+            await nursery.start(sc.serve)
+            async for controls in sc.updates:
+                print(controls)
+
+    logs.setup_logging()
+    trio.run(main)
@@ -0,0 +1,190 @@
+"""
+Multi-process mode of main.py (PROCESS_MODE=multi): the safety-path gets its own interpreter and GIL.
+- safety:  SafetySystem, the MultiGas-Sensors, the AlertManager and the sampling, only /metrics on SAFETY_METRICS_PORT
+- storage: StorageWorker, aggregation, DB-writer (spool), HTTP-server and MQTT
+- car:     car_control_loop, websocket-server of the SunFounder Controller-App and the PiCar-X
+The safety-process appends every sample to a SharedSampleRing (shared memory, created and removed here),
+the storage-worker reads it. This process only supervises: every process, that exits, is started again
+(with exponential backoff), independent of the others, so restarting a worker never interrupts the alarm.
+"""
+import collections
+import os
+import multiprocessing
+import signal
+import socket
+from time import perf_counter
+
+import trio
+
+from .gas_sensors.multigas_sensors import MultiGasSensor
+from .gas_sensors.topology import Topology, default_topology, load_topology
+from . import logs, metrics
+
+RING_SECONDS = 600  # Samples kept in the ring, a restarted storage-worker continues from there
+
+log = logs.get_logger(__name__)
+
+
+def _setup():
+    import dotenv
+
+    dotenv.load_dotenv()
+    logs.setup_logging()
+
+
+def _topology() -> Topology:
+    config_file = os.getenv("CONFIG_FILE")
+    return default_topology(socket.gethostname()) if config_file is None else load_topology(config_file)
+
+
+def _run(main, *args):
+    # Optional: report task-steps, that block the event-loop longer than STALL_THRESHOLD seconds (in every process)
+    stall_threshold = os.getenv("STALL_THRESHOLD")
+    instruments = [] if stall_threshold is None else [metrics.StallDetector(float(stall_threshold))]
+    # The supervisor stops the processes with SIGINT -> KeyboardInterrupt, the context-managers clean up
+    try:
+        trio.run(main, *args, instruments=instruments)
+    except KeyboardInterrupt:
+        pass
+
+
+async def _safety_main(ring_name: str):
+    from .gas_sensors.shared_ring import SharedSampleRing
+    from .gas_sensors.workers import SafetySystem
+
+    start = perf_counter()
+    topology = _topology()
+    ring = SharedSampleRing.attach(ring_name, [c.name for c in topology.sensors])
+    try:
+        system = SafetySystem(
+            ring,
+            os.getenv("MONGODB_URI"),
+            topology=topology,
+            capture_dir=os.getenv("CAPTURE_DIR"),
+            metrics_port=int(os.getenv("SAFETY_METRICS_PORT", 8081)),
+        )
+        with system:
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(system.main_task)
+                await system.alert_manager.ready.wait()
+                alarm_ready = perf_counter() - start
+                await system.first_sample.wait()
+                log.info("boot", process="safety", alarm_ready_s=round(alarm_ready, 3), first_sample_s=round(perf_counter() - start, 3))
+    finally:
+        ring.close()
+
+
+def safety_process(ring_name: str):
+    _setup()
+    _run(_safety_main, ring_name)
+
+
+async def _storage_main(ring_name: str):
+    from .gas_sensors.documents import StorageMode
+    from .gas_sensors.gas_monitoring_system import DEFAULT_SPOOL_DIR
+    from .gas_sensors.shared_ring import SharedSampleRing
+    from .gas_sensors.workers import StorageWorker
+
+    topology = _topology()
+    ring = SharedSampleRing.attach(ring_name, [c.name for c in topology.sensors])
+    try:
+        worker = StorageWorker(
+            ring,
+            os.getenv("MONGODB_URI"),
+            topology=topology,
+            spool_dir=os.getenv("SPOOL_DIR", DEFAULT_SPOOL_DIR),
+            storage=StorageMode(os.getenv("STORAGE_MODE", "documents")),
+            http_port=int(os.getenv("HTTP_PORT", 8080)),
+            mqtt_host=os.getenv("MQTT_HOST"),
+        )
+        with worker:
+            await worker.main_task()
+    finally:
+        ring.close()
+
+
+def storage_process(ring_name: str):
+    _setup()
+    _run(_storage_main, ring_name)
+
+
+def car_process():
+    from .sunfounder_picar.picarx_control import car_control_loop
+
+    _setup()
+    _run(car_control_loop)
+
+
+class Supervisor:
+    """
+    Starts the processes and starts every one again, that exits: after `min_backoff` seconds,
+    doubled up to `max_backoff` while it keeps exiting within `stable_after` seconds
+    """
+
+    def __init__(self, *, min_backoff=1.0, max_backoff=60.0, stable_after=60.0, stop_timeout=5.0):
+        # spawn: a fresh interpreter, no trio-state, threads or GPIO-handles of the supervisor in the children
+        self.context = multiprocessing.get_context("spawn")
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.stop_timeout = stop_timeout
+        self.processes: dict[str, multiprocessing.Process] = {}  # Name -> running process
+        self.restarts = collections.Counter()
+
+
+    async def supervise(self, name: str, target, *args):
+        backoff = self.min_backoff
+        while True:
+            process = self.context.Process(target=target, args=args, name=name, daemon=True)
+            await trio.to_thread.run_sync(process.start)
+            self.processes[name] = process
+            started = trio.current_time()
+            log.info("process-start", process=name, pid=process.pid, restarts=self.restarts[name])
+
+            try:
+                await trio.lowlevel.wait_readable(process.sentinel)
+            except BaseException:
+                # Cancelled (shutdown of the supervisor)
+                with trio.CancelScope(shield=True):
+                    await self._stop(process)
+                raise
+            finally:
+                del self.processes[name]
+            await trio.to_thread.run_sync(process.join)
+
+            if trio.current_time() - started > self.stable_after:
+                backoff = self.min_backoff
+            self.restarts[name] += 1
+            log.warning("process-exit", process=name, exitcode=process.exitcode, restart_in_s=backoff)
+            await trio.sleep(backoff)
+            backoff = min(2 * backoff, self.max_backoff)
+
+
+    async def _stop(self, process: multiprocessing.Process):
+        os.kill(process.pid, signal.SIGINT)
+        # join, not the sentinel: it is readable a moment before the exit-code is
+        await trio.to_thread.run_sync(process.join, self.stop_timeout)
+        if process.exitcode is None:
+            log.warning("process-kill", process=process.name, pid=process.pid)
+            process.kill()
+        await trio.to_thread.run_sync(process.join)
+
+
+async def run_processes():
+    from .gas_sensors.shared_ring import SharedSampleRing
+
+    _setup()
+    topology = _topology()
+    # Rows per second: at most one poll per settle-time of every bus, plus the ends of the windows
+    capacity = int(RING_SECONDS * (len(topology.buses()) / MultiGasSensor.settle_time + 1))
+    ring = SharedSampleRing.create([c.name for c in topology.sensors], capacity, name=f"iot_project-{os.getpid()}")
+    log.info("processes", ring=ring.name, ring_rows=capacity)
+
+    supervisor = Supervisor()
+    try:
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(supervisor.supervise, "safety", safety_process, ring.name)
+            nursery.start_soon(supervisor.supervise, "storage", storage_process, ring.name)
+            nursery.start_soon(supervisor.supervise, "car", car_process)
+    finally:
+        ring.close()
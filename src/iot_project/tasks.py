@@ -0,0 +1,44 @@
+"""
+Tasks, that run in the same nursery as the alarm, but must never take it down (HTTP-server, websocket-server):
+`keep_running` logs every error of the task and starts it again after an exponential backoff
+"""
+import trio
+
+from . import logs
+
+log = logs.get_logger(__name__)
+
+
+async def keep_running(
+    name: str,
+    function,
+    *args,
+    min_backoff=1.0,
+    max_backoff=60.0,
+    stable_after=60.0,
+    task_status=trio.TASK_STATUS_IGNORED,
+):
+    """
+    Run `await nursery.start(function, *args)` again and again: after an error (e.g. the port is in use) or a return,
+    after `min_backoff` seconds, doubled up to `max_backoff` while it keeps failing within `stable_after` seconds
+    `task_status.started()` is called after the first successful start of the task (its value is passed on)
+    Only Exceptions are caught, cancellation and KeyboardInterrupt pass through
+    """
+    backoff = min_backoff
+    started = False
+    while True:
+        start = trio.current_time()
+        try:
+            async with trio.open_nursery() as nursery:
+                value = await nursery.start(function, *args)
+                if not started:
+                    started = True
+                    task_status.started(value)
+            log.warning("task-exit", task=name, restart_in_s=backoff)
+        except Exception as ex:
+            log.error("task-failed", task=name, error=repr(ex), restart_in_s=backoff)
+
+        if trio.current_time() - start > stable_after:
+            backoff = min_backoff
+        await trio.sleep(backoff)
+        backoff = min(2 * backoff, max_backoff)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from iot_project.gas_sensors.aggregation import P2Quantile, StreamingAggregator
+
+
+@pytest.mark.parametrize("distribution", ["normal", "exponential", "uniform"])
+@pytest.mark.parametrize("p", [0.5, 0.95])
+def test_p2_quantile(distribution, p):
+    values = getattr(np.random.default_rng(1), distribution)(size=10_000)
+    quantile = P2Quantile(p)
+    for value in values:
+        quantile.add(float(value))
+    exact = np.quantile(values, p)
+    assert quantile.value == pytest.approx(exact, abs=0.02 * (values.max() - values.min()))
+
+
+def test_p2_quantile_of_few_values():
+    quantile = P2Quantile(0.95)
+    assert quantile.value is None
+    for value in (3.0, 1.0, 2.0):
+        quantile.add(value)
+    assert quantile.value == 3.0
+    quantile.reset()
+    assert quantile.value is None
+
+
+def test_aggregator_matches_numpy():
+    values = np.random.default_rng(2).normal(20.0, 3.0, size=600)
+    aggregator = StreamingAggregator()
+    for value in values:
+        aggregator.add(float(value))
+    aggregator.add_failure("checksum")
+    aggregator.add_failure("checksum")
+
+    result = aggregator.result()
+    assert result["count"] == 600
+    assert result["failures"] == 2
+    assert aggregator.errors == {"checksum": 2}
+    assert result["min"] == values.min()
+    assert result["max"] == values.max()
+    assert result["last"] == values[-1]
+    assert result["avg"] == pytest.approx(values.mean())
+    assert result["std"] == pytest.approx(values.std())
+    assert result["p95"] == pytest.approx(np.quantile(values, 0.95), rel=0.02)
+
+
+def test_interval_without_data():
+    aggregator = StreamingAggregator()
+    aggregator.add(1.0)
+    aggregator.reset()
+    aggregator.add_failure()
+    assert aggregator.result() == dict(min=None, max=None, avg=None, std=None, p95=None, last=None, count=0, failures=1)
@@ -0,0 +1,90 @@
+import logging
+
+import pytest
+import trio
+import trio.testing
+
+from iot_project import logs
+from iot_project.gas_sensors import hal
+from iot_project.gas_sensors.alert_handling import (
+    AlertManager, blink_interval, buzzerpin, co_sensor, led_green, nh3_sensor, switch
+)
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(hal, "backend", "sim")
+    return AlertManager(limits={"NH3": (50, None)})
+
+
+def test_rate_limit_per_event():
+    log = logs.get_logger("test.rate", rate=0.1, burst=2, exempt=("alert",))
+    records = []
+    log.logger.addHandler(handler := logging.Handler())
+    handler.emit = records.append
+    log.logger.setLevel(logging.INFO)
+    try:
+        for _ in range(10):
+            log.info("reading-failed")
+            log.info("alert")
+    finally:
+        log.logger.removeHandler(handler)
+    assert [r.msg for r in records].count("reading-failed") == 2
+    assert [r.msg for r in records].count("alert") == 10
+
+
+def test_every_alert_transition_is_logged(manager, caplog):
+    caplog.set_level(logging.INFO, logger="iot_project.gas_sensors.alert_handling")
+    for i in range(20):
+        manager.check_alerts(1000.0 + i, NH3=80.0 if i % 2 == 0 else 10.0)
+    events = [record.msg for record in caplog.records]
+    assert events.count("alert") == 10
+    assert events.count("alert-end") == 10
+    assert not manager._any_alert
+
+
+def test_alert_state(manager):
+    manager.check_alerts(1000.0, NH3=10.0)
+    assert not manager._any_alert
+    manager.check_alerts(1001.0, NH3=51.0)
+    assert manager._active == {"NH3"}
+    manager.check_alerts(1002.0, NH3=None)  # Missing values keep the state
+    assert manager._active == {"NH3"}
+    manager.check_alerts(1003.0, NH3=49.0, CO=1000.0)  # No limits for CO
+    assert not manager._any_alert
+
+
+def test_alarm_and_acknowledge(monkeypatch):
+    monkeypatch.setattr(hal, "backend", "sim")
+    manager = AlertManager()
+    levels = manager.gpio.levels
+
+    async def main():
+        with manager:
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(manager.alert_loop)
+                await manager.ready.wait()
+                assert levels[led_green] == 1 and levels[buzzerpin] == 0
+
+                manager.check_alerts(NH3=80.0)
+                await trio.sleep(0.01)
+                assert (levels[led_green], levels[nh3_sensor], levels[co_sensor], levels[buzzerpin]) == (0, 1, 0, 1)
+                assert manager.alarm_latency_stats()["count"] == 1
+                await trio.sleep(blink_interval)
+                assert (levels[nh3_sensor], levels[buzzerpin]) == (0, 0)  # Blinking
+
+                manager._on_button(switch)  # Acknowledged: the LEDs stay on, the buzzer off
+                await trio.sleep(0.01)
+                for _ in range(5):
+                    assert (levels[nh3_sensor], levels[buzzerpin]) == (1, 0)
+                    await trio.sleep(blink_interval)
+                manager.check_alerts(CO=400.0)  # A new alert during the acknowledge-mode is shown
+                await trio.sleep(0.01)
+                assert (levels[nh3_sensor], levels[co_sensor], levels[buzzerpin]) == (1, 1, 0)
+
+                manager.check_alerts(NH3=10.0, CO=5.0)
+                await trio.sleep(0.01)
+                assert (levels[led_green], levels[nh3_sensor], levels[co_sensor], levels[buzzerpin]) == (1, 0, 0, 0)
+                nursery.cancel_scope.cancel()
+
+    trio.run(main, clock=trio.testing.MockClock(autojump_threshold=0))
@@ -0,0 +1,125 @@
+import collections
+import datetime
+
+import pytest
+import trio
+
+pymongo = pytest.importorskip("pymongo")
+
+from iot_project.gas_sensors.db_connect import DUPLICATE_KEY, StorageMode, bucket_start, write_documents
+from iot_project.gas_sensors.db_writer import BufferedWriter
+
+START = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = FakeRollups()
+        return collection
+
+
+class FakeBuckets:
+    """The bucket-collection with its unique index (meta.device, start), only the operators of bucket_updates"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.database = FakeDatabase()
+
+    def bulk_write(self, updates, ordered=True):
+        errors = []
+        for index, update in enumerate(updates):
+            filter, doc = update._filter, update._doc
+            key = (filter["meta.device"], filter["start"])
+            bucket = self.buckets.get(key)
+            if bucket is not None and any(s["time"] == filter["samples.time"]["$ne"] for s in bucket["samples"]):
+                # No match -> the upsert inserts a second bucket -> unique index
+                errors.append({"index": index, "code": DUPLICATE_KEY, "errmsg": "E11000 duplicate key"})
+                continue
+            if bucket is None:
+                bucket = self.buckets[key] = dict(doc["$setOnInsert"], samples=[], first=doc["$min"]["first"], last=doc["$max"]["last"])
+            bucket["first"] = min(bucket["first"], doc["$min"]["first"])
+            bucket["last"] = max(bucket["last"], doc["$max"]["last"])
+            bucket["samples"].append(doc["$push"]["samples"])
+        if errors:
+            raise pymongo.errors.BulkWriteError({"writeErrors": errors, "nInserted": 0})
+
+
+class FakeRollups:
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def bulk_write(self, updates, ordered=True):
+        for update in updates:
+            for field, value in update._doc["$inc"].items():
+                if field.endswith(".count"):
+                    self.counts[field] += value
+
+
+def document(second, device="pi"):
+    return {
+        "time": START + datetime.timedelta(seconds=second),
+        "meta": {"device": device},
+        "NH3": {"min": 1.0, "max": 3.0, "avg": 2.0, "count": 5},
+    }
+
+
+def test_replayed_samples_are_duplicates():
+    collection = FakeBuckets()
+    first = write_documents(collection, [document(s) for s in (0, 0.5, 1, 61)], StorageMode.buckets)
+    assert (first.written, first.duplicates, first.rejected) == (4, 0, set())
+    assert len(collection.buckets) == 2
+
+    # Replayed from the spool: two samples are stored already, one is new
+    again = write_documents(collection, [document(0.5), document(2), document(61)], StorageMode.buckets)
+    assert (again.written, again.duplicates, again.rejected) == (1, 2, {0, 2})
+    bucket = collection.buckets["pi", bucket_start(START)]
+    assert [s["time"].second for s in bucket["samples"]] == [0, 0, 1, 2]
+    assert bucket["first"] == START and "meta" not in bucket["samples"][0]
+
+
+def test_duplicates_within_a_batch():
+    result = write_documents(FakeBuckets(), [document(5), document(5), document(5, device="other")], StorageMode.buckets)
+    assert (result.written, result.duplicates, result.rejected) == (2, 1, {1})
+
+
+def test_rollups_count_replayed_samples_once():
+    collection = FakeBuckets()
+    writer = BufferedWriter(None, mode=StorageMode.buckets)
+    writer._write(collection, [document(s) for s in range(3)])
+    writer._write(collection, [document(s) for s in range(5)])  # 0..2 again after a spool-replay
+    assert collection.database["Rollup-1min"].counts["NH3.count"] == 5 * 5
+
+
+class FailingBuckets(FakeBuckets):
+    """The connection breaks after the first `applied` updates of the first bulk-write"""
+
+    def __init__(self, applied):
+        super().__init__()
+        self.applied = applied
+
+    def bulk_write(self, updates, ordered=True):
+        if self.applied is None:
+            return super().bulk_write(updates, ordered)
+        super().bulk_write(updates[:self.applied], ordered)
+        self.applied = None
+        raise pymongo.errors.AutoReconnect("connection closed")
+
+
+def test_rollups_after_a_partly_failed_write():
+    collection = FailingBuckets(applied=2)
+    writer = BufferedWriter(None, mode=StorageMode.buckets, retry_interval=0)
+    for s in range(4):
+        writer.put(document(s))
+
+    async def main():
+        assert not await writer.flush(collection)
+        assert await writer.flush(collection)
+
+    trio.run(main)
+    # The samples inserted before the connection broke are duplicates in the retry, but not yet in the rollups
+    assert (writer.stats.written, writer.stats.duplicates, writer.stats.write_errors) == (2, 2, 1)
+    assert collection.database["Rollup-1min"].counts["NH3.count"] == 4 * 5
+    assert not writer._unrolled
@@ -0,0 +1,74 @@
+import math
+
+import trio
+
+from iot_project.sunfounder_picar.car_io import CarIO
+
+
+class FakePicarx:
+    def __init__(self):
+        self.calls = []
+
+    def forward(self, speed):
+        self.calls.append(("forward", speed))
+
+    def backward(self, speed):
+        self.calls.append(("backward", speed))
+
+    def set_dir_servo_angle(self, angle):
+        self.calls.append(("steer", angle))
+
+    def get_distance(self):
+        return 42.0
+
+    def get_grayscale_data(self):
+        raise OSError(121, "Remote I/O error")
+
+
+async def wait_for(condition):
+    with trio.fail_after(5):
+        while not condition():
+            await trio.sleep(0.001)
+
+
+def test_only_the_newest_command_is_applied_and_the_motor_stops():
+    px = FakePicarx()
+    car = CarIO(px, distance_interval=0.01, grayscale_interval=0.01)
+
+    async def main():
+        assert car.age("distance") == math.inf
+        car.drive(10)
+        car.drive(-20)
+        car.steer(5)
+        car.drive(30)
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(car.run)
+            await wait_for(lambda: len(px.calls) == 2 and car.reading("distance") is not None)
+            car.drive(30)  # Same as the applied command
+            assert not car._pending.is_set()
+            car.steer(-5)
+            await wait_for(lambda: len(px.calls) == 3)
+            assert car.age("distance") < 1
+            nursery.cancel_scope.cancel()
+
+    trio.run(main)
+    # Coalesced: only the newest speed, the motor is stopped when the loop ends
+    assert px.calls == [("forward", 30), ("steer", 5), ("steer", -5), ("forward", 0)]
+    assert car.reading("distance").value == 42.0
+    assert car.reading("grayscale") is None  # The errors are counted, not raised
+
+
+def test_without_car_the_commands_are_only_logged(caplog):
+    car = CarIO()
+    assert car.sensors == ()
+
+    async def main():
+        car.drive(-10)
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(car.run)
+            await wait_for(lambda: car._applied)
+            nursery.cancel_scope.cancel()
+
+    caplog.set_level("INFO", logger="iot_project.sunfounder_picar.car_io")
+    trio.run(main)
+    assert [(r.msg, r.fields) for r in caplog.records] == [("drive", dict(direction="backward", speed=10))]
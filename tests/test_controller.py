@@ -0,0 +1,41 @@
+import json
+import logging
+
+import pytest
+import trio
+
+trio_websocket = pytest.importorskip("trio_websocket")
+
+from iot_project.sunfounder_picar.sunfounder_controller import SunFounderController
+
+
+def test_clients_come_and_go(caplog):
+    caplog.set_level(logging.INFO)
+    controller = SunFounderController(0)
+    received = []
+
+    async def client(port, controls):
+        async with trio_websocket.open_websocket("127.0.0.1", port, "/", use_ssl=False, connect_timeout=5) as websocket:
+            await websocket.send_message(json.dumps(controls))
+            answer = json.loads(await websocket.get_message())
+            assert answer["Check"] == "SunFounder Controller"
+            received.append(await controller.updates.receive())
+
+    async def main():
+        async with trio.open_nursery() as nursery:
+            server = await nursery.start(controller.serve)
+            port = server.port
+            # The second client is served by the same server: the disconnect of the first one didn't stop it
+            await client(port, {"Heart": "ping"})
+            with trio.fail_after(5):
+                while controller.clients:
+                    await trio.sleep(0.01)
+            await client(port, {"A": [10, 20]})
+            nursery.cancel_scope.cancel()
+
+    trio.run(main, strict_exception_groups=True)
+    assert received == [{"Heart": "ping"}, {"A": [10, 20]}]
+    assert controller.send_dict["Heart"] == "pong"
+    events = [record.msg for record in caplog.records]
+    assert events.count("controller-disconnected") == 2
+    assert "task-failed" not in events and "task-exit" not in events
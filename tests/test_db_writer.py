@@ -0,0 +1,52 @@
+import contextlib
+
+import pytest
+import trio
+import trio.testing
+
+pymongo = pytest.importorskip("pymongo")
+
+from iot_project.gas_sensors import db_connect, rollups
+from iot_project.gas_sensors.db_writer import BufferedWriter, MemoryQueue
+
+
+def test_failed_setup_closes_the_connection(monkeypatch):
+    clients = []
+
+    @contextlib.contextmanager
+    def connect_to_db(mongo_uri, mode):
+        clients.append("open")
+        try:
+            yield type("Collection", (), {"database": len(clients)})()
+        finally:
+            clients[-1] = "closed"
+
+    def ensure_rollups(database):
+        if database < 3:
+            raise pymongo.errors.ServerSelectionTimeoutError("no DB")
+
+    monkeypatch.setattr(db_connect, "connect_to_db", connect_to_db)
+    monkeypatch.setattr(rollups, "ensure_rollups", ensure_rollups)
+    writer = BufferedWriter("mongodb://test", retry_interval=1.0)
+
+    async def main():
+        with contextlib.ExitStack() as stack:
+            collection = await writer._connect(stack)
+            assert collection.database == 3
+            assert clients == ["closed", "closed", "open"]  # The failed attempts don't leak their client
+        assert clients == ["closed", "closed", "closed"]
+
+    trio.run(main, clock=trio.testing.MockClock(autojump_threshold=0))
+    assert writer.stats.write_errors == 2
+
+
+def test_memory_queue_commits_the_batch_read():
+    queue = MemoryQueue(max_len=4)
+    for i in range(4):
+        queue.append(i)
+    batch, position = queue.peek(3)
+    assert batch == [0, 1, 2]
+    assert not queue.append(4)  # Full: 0 is dropped while the batch is written
+    queue.commit(position)
+    assert queue.peek(10)[0] == [3, 4]
+    assert queue.dropped == 1
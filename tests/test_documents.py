@@ -0,0 +1,40 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from iot_project.gas_sensors.documents import AggregationEncoder
+
+GASES = ("NH3", "CO", "O2")
+START = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def aggregation(encoder, rng, time):
+    result = dict(time=time)
+    for gas in GASES:
+        result[gas] = {name: convert(value) for (name, convert), value in zip(encoder.fields.items(), rng.random(len(encoder.fields)) * 100)}
+    return result
+
+
+def test_encode_array_same_as_encode():
+    rng = np.random.default_rng(0)
+    encoder = AggregationEncoder(GASES)
+    aggregations = [aggregation(encoder, rng, START + datetime.timedelta(seconds=i)) for i in range(20)]
+    values = np.array([[[a[gas][name] for name in encoder.fields] for gas in GASES] for a in aggregations])
+
+    documents = encoder.encode_array([a["time"] for a in aggregations], values, meta={"device": "pi"})
+    assert documents == [dict(encoder.encode(a), meta={"device": "pi"}) for a in aggregations]
+    for name, convert in encoder.fields.items():
+        assert type(documents[0]["NH3"][name]) is convert  # Python-types, not numpy
+
+
+def test_encode_array_nan_is_none():
+    encoder = AggregationEncoder(["NH3"], fields=dict(avg=float, count=int))
+    documents = encoder.encode_array([START], np.array([[[np.nan, 3.0]]]))
+    assert documents == [{"NH3": {"avg": None, "count": 3}, "time": START}]
+
+
+def test_encode_array_checks_the_shape():
+    encoder = AggregationEncoder(GASES)
+    with pytest.raises(AssertionError):
+        encoder.encode_array([START], np.zeros((1, 2, len(encoder.fields))))
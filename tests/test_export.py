@@ -0,0 +1,87 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from iot_project.gas_sensors.documents import StorageMode
+from iot_project.gas_sensors.export import export, load_columns
+
+START = datetime.datetime(2026, 1, 1)  # Naive UTC, like the times from pymongo
+
+
+class FakeCursor(list):
+    def sort(self, key, direction):
+        return FakeCursor(sorted(self, key=lambda document: document[key]))
+
+    def hint(self, index):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection):
+        time = query.get("time", {})
+        return FakeCursor(
+            {key: value for key, value in document.items() if key not in ("_id", "health", "errors", "sampling")}
+            for document in self.documents
+            if ("$gte" not in time or document["time"] >= time["$gte"]) and ("$lt" not in time or document["time"] < time["$lt"])
+        )
+
+
+def aggregation(i, device="pi"):
+    document = {
+        "_id": i,
+        "time": START + datetime.timedelta(seconds=10 * i),
+        "meta": {"device": device},
+        "NH3": dict(min=i, max=i + 2, avg=i + 1.0, std=0.5, p95=i + 1.9, last=i + 1, count=5, failures=0),
+        "health": {},
+    }
+    if i >= 5:  # CO is measured only from the 6th document on
+        document["CO"] = dict(min=1, max=3, avg=2.0, std=0.1, p95=2.9, last=2, count=4, failures=1)
+    return document
+
+
+@pytest.mark.parametrize("format", ["npz", "parquet"])
+def test_round_trip(tmp_path, format):
+    if format == "parquet":
+        pytest.importorskip("pyarrow")
+    collection = FakeCollection([aggregation(i, device="pi" if i % 2 else "car") for i in range(12)])
+    progress = []
+
+    rows = export(
+        collection,
+        tmp_path / "export",
+        since=START + datetime.timedelta(seconds=10),
+        until=datetime.datetime(2026, 1, 1, 0, 1, 50, tzinfo=datetime.timezone.utc),
+        format=format,
+        chunk_size=4,
+        progress=lambda rows, time: progress.append((rows, time)),
+    )
+    assert rows == 10
+    assert [rows for rows, _ in progress] == [4, 8, 10]
+    assert len(list((tmp_path / "export").glob(f"part-*.{format}"))) == 3
+
+    data = load_columns(tmp_path / "export")
+    assert data["time"].dtype == np.dtype("datetime64[ms]")
+    assert data["time"][0] == np.datetime64(START + datetime.timedelta(seconds=10), "ms")
+    assert list(data["device"][:2]) == ["pi", "car"]
+    np.testing.assert_array_equal(data["NH3.avg"], np.arange(1, 11) + 1.0)
+    # CO is missing in the first part and before the 6th document
+    np.testing.assert_array_equal(np.isnan(data["CO.avg"]), np.arange(1, 11) < 5)
+
+    selected = load_columns(tmp_path / "export", ["CO.max"], since=START + datetime.timedelta(seconds=60))
+    assert set(selected) == {"time", "device", "CO.max"}
+    np.testing.assert_array_equal(selected["CO.max"], np.full(5, 3.0))
+
+
+def test_existing_export(tmp_path):
+    export(FakeCollection([aggregation(0)]), tmp_path, format="npz")
+    with pytest.raises(FileExistsError):
+        export(FakeCollection([aggregation(0)]), tmp_path, format="npz")
+    with pytest.raises(ValueError):
+        export(FakeCollection([]), tmp_path / "other", format="csv")
@@ -0,0 +1,82 @@
+import pytest
+
+from iot_project.gas_sensors.exposure import ExposureLimits, ExposureTracker, SlidingIntegral
+
+T0 = 1_800_000_000.0  # A multiple of the bucket sizes
+NIOSH_NH3 = ExposureLimits(twa=25, stel=35)
+
+
+def feed(tracker, start, end, value, interval=1.0, name="NH3"):
+    """Samples every `interval` seconds in [start, end), returns the reasons of the last one"""
+    t, reasons = start, []
+    while t < end:
+        reasons = tracker.add(name, value, t)
+        t += interval
+    return reasons
+
+
+def test_twa_is_divided_by_8_hours():
+    tracker = ExposureTracker({"NH3": NIOSH_NH3})
+    assert feed(tracker, T0, T0 + 4 * 3600, 30.0) == []  # 30 ppm for 4 h: TWA 15, the STEL of 30 is allowed
+    assert tracker.values["NH3"]["twa"] == pytest.approx(15.0, rel=1e-3)
+    # The window starts at a bucket-boundary (10 s), up to one bucket more is counted
+    assert 30.0 <= tracker.values["NH3"]["stel"] <= 30.0 * 910 / 900
+    # 4 more hours: the average of the whole shift is above the TWA-limit
+    assert feed(tracker, T0 + 4 * 3600, T0 + 8 * 3600 + 1, 30.0) == ["twa"]
+    assert tracker.values["NH3"]["twa"] == pytest.approx(30.0, rel=1e-3)
+
+
+def test_stel_window():
+    tracker = ExposureTracker({"NH3": NIOSH_NH3})
+    feed(tracker, T0, T0 + 900, 0.0)
+    assert feed(tracker, T0 + 900, T0 + 1500, 60.0) == ["stel"]  # 10 min at 60 ppm: 40 ppm over 15 min
+    assert tracker.values["NH3"]["stel"] == pytest.approx(40.0, abs=0.5)
+    # 15 minutes later the peak has left the window
+    assert feed(tracker, T0 + 1500, T0 + 2400 + 10, 0.0) == []
+    assert tracker.values["NH3"]["stel"] == pytest.approx(0.0, abs=0.5)
+
+
+def test_gap_is_not_counted():
+    tracker = ExposureTracker({"NH3": NIOSH_NH3}, max_gap=60)
+    tracker.add("NH3", 100.0, T0)
+    tracker.add("NH3", 0.0, T0 + 600)  # Sensor failed for 10 minutes: only the first minute counts
+    assert tracker.values["NH3"]["stel"] == pytest.approx(100.0 * 60 / 900)
+
+
+def test_rate_of_rise():
+    tracker = ExposureTracker({"CO": ExposureLimits(rise=10)})
+    assert feed(tracker, T0, T0 + 60, 5.0, name="CO") == []
+    reasons = feed(tracker, T0 + 60, T0 + 120, 5.0, name="CO")
+    assert tracker.values["CO"]["rise"] == pytest.approx(0.0)
+    for i in range(60):
+        reasons = tracker.add("CO", 5.0 + i * 0.5, T0 + 120 + i)  # 30 ppm/min
+    assert reasons == ["rise"]
+    assert tracker.values["CO"]["rise"] > 10
+
+
+def test_gases_without_limits_are_ignored():
+    tracker = ExposureTracker({"NH3": NIOSH_NH3, "O2": ExposureLimits(), "CO": None})
+    assert set(tracker.gases) == {"NH3"}
+    assert tracker.add("O2", 5.0, T0) == []
+    assert "O2" not in tracker.values
+
+
+def test_restore_before_the_first_sample():
+    """After a restart at 7 h: the 1-minute rollups of the hours before count for the TWA, like without a restart"""
+    restarted = ExposureTracker({"NH3": NIOSH_NH3})
+    feed(restarted, T0 + 7 * 3600, T0 + 7 * 3600 + 1, 30.0)
+    restarted.restore("NH3", [(T0 + 60 * m, T0 + 60 * (m + 1), 30.0) for m in range(7 * 60)])
+    assert feed(restarted, T0 + 7 * 3600 + 1, T0 + 8 * 3600 + 1, 30.0) == ["twa"]
+
+    running = ExposureTracker({"NH3": NIOSH_NH3})
+    feed(running, T0, T0 + 8 * 3600 + 1, 30.0)
+    assert restarted.values["NH3"]["twa"] == pytest.approx(running.values["NH3"]["twa"], rel=1e-3)
+    assert restarted.values["NH3"]["stel"] == pytest.approx(running.values["NH3"]["stel"], rel=1e-3)
+
+
+def test_sliding_integral_memory_is_constant():
+    integral = SlidingIntegral(seconds=3600, bucket=60)
+    for hour in range(48):
+        integral.add(T0 + hour * 3600, T0 + (hour + 1) * 3600, 1.0)
+    assert len(integral._prefix) == 61
+    assert integral.integral(T0 + 48 * 3600) == pytest.approx(3600.0)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from iot_project.gas_sensors.frames import decode_frames, frame_errors
+from iot_project.gas_sensors.multigas_sensors import CmdCode, FrameError, MultiGasSensor, SensorType
+from iot_project.gas_sensors.simulation import SimulatedSensor, sine
+
+
+def scalar_decode(frame: bytes, expected_sensor_type=None):
+    """The per-frame path of MultiGasSensor: the reading or the message of the FrameError"""
+    sensor = MultiGasSensor.__new__(MultiGasSensor)
+    sensor.expected_sensor_type = expected_sensor_type
+    try:
+        return sensor.decode_all(sensor.check_response(CmdCode.read_all, frame))
+    except FrameError as ex:
+        return str(ex)
+
+
+@pytest.fixture
+def frames():
+    sensor = SimulatedSensor(SensorType.NH3, sine(20, 15, 60), temperature=31.5, noise=2.0, crc_error_rate=0.05, seed=3)
+    sensor.write(MultiGasSensor.command_frame(CmdCode.read_all))
+    frames = [bytearray(sensor.response(i * 0.1)) for i in range(2000)]
+    frames[10][0] = 0x00  # Header
+    frames[11][1] = CmdCode.read_temp.value  # Command-code
+    frames[12][4] = SensorType.CO.value  # Sensor-type (with a valid checksum)
+    frames[12][8] = MultiGasSensor.calc_check_sum(frames[12][1:-2])
+    return [bytes(frame) for frame in frames]
+
+
+@pytest.mark.parametrize("expected_sensor_type", [None, SensorType.NH3])
+def test_same_result_as_the_scalar_decoder(frames, expected_sensor_type):
+    buffer = b"".join(frames)
+    readings = decode_frames(buffer, expected_sensor_type=expected_sensor_type)
+    errors = dict(frame_errors(buffer, readings, expected_sensor_type=expected_sensor_type))
+    assert 80 < len(errors) < 150  # The CRC-errors of the simulator and the corrupted frames
+    assert {10, 11} <= set(errors)
+    assert (12 in errors) == (expected_sensor_type is not None)
+
+    for index, (frame, reading) in enumerate(zip(frames, readings)):
+        expected = scalar_decode(frame, expected_sensor_type)
+        if isinstance(expected, str):
+            assert not reading["valid"]
+            # The scalar decoder checks the sensor-type after the frame, the message differs
+            assert errors[index] == expected or "sensor-type" in errors[index]
+        else:
+            assert reading["valid"]
+            assert reading["concentration"] == pytest.approx(expected.gas_concentration)
+            assert reading["sensor_type"] == expected.sensor_type.value
+            assert reading["temperature"] == pytest.approx(expected.temperature)
+    assert np.nanmean(readings["temperature"]) == pytest.approx(31.5, abs=0.5)
+
+
+def test_buffer_size(frames):
+    with pytest.raises(ValueError):
+        decode_frames(b"".join(frames)[:-1])
+    assert decode_frames(b"").size == 0
@@ -0,0 +1,55 @@
+import pytest
+
+from iot_project.gas_sensors.health import ErrorType, SensorHealth, SensorState, error_type
+from iot_project.gas_sensors.multigas_sensors import CRCError, FrameError, HeaderError, SensorTypeError
+
+
+def test_circuit_breaker():
+    health = SensorHealth(degraded_after=3, offline_after=5, backoff=0.1, max_backoff=0.3, probe_interval=5.0, seed=1)
+    now, changes, delays = 0.0, [], []
+    for _ in range(6):
+        assert health.should_poll(now)
+        changes.append(health.failure(now, ErrorType.os_error))
+        delays.append(health.next_poll - now)
+        assert not health.should_poll(now)
+        now = health.next_poll
+
+    # ok -> degraded after 3, -> offline after 5 failures in a row, every change is reported once
+    assert changes == [None, None, SensorState.ok, None, SensorState.degraded, None]
+    assert health.state is SensorState.offline
+    # Jittered exponential backoff up to max_backoff, then only probed every probe_interval
+    for delay, nominal in zip(delays, (0.1, 0.2, 0.3, 0.3, 5.0, 5.0)):
+        assert 0.5 * nominal <= delay <= nominal
+    assert health.errors == {"os_error": 6}
+
+    assert health.success() is SensorState.offline
+    assert health.state is SensorState.ok
+    assert health.should_poll(now) and health.failures == 0
+    assert health.success() is None
+
+
+def test_same_seed_same_retries():
+    """A replay retries at the same times"""
+    first, second = SensorHealth(seed=7), SensorHealth(seed=7)
+    for i in range(12):
+        first.failure(float(i))
+        second.failure(float(i))
+        assert first.next_poll == second.next_poll
+
+
+@pytest.mark.parametrize(
+    "ex, expected",
+    [
+        (CRCError("crc"), ErrorType.crc),
+        (HeaderError("header"), ErrorType.header),
+        (SensorTypeError("type"), ErrorType.sensor_type),
+        (OSError(121, "Remote I/O error"), ErrorType.os_error),
+        (ValueError(), ErrorType.other),
+    ],
+)
+def test_error_type(ex, expected):
+    assert error_type(ex) is expected
+
+
+def test_frame_errors_stay_assertion_errors():
+    assert issubclass(FrameError, AssertionError)
@@ -0,0 +1,76 @@
+import datetime
+import json
+import logging
+import sys
+
+import pytest
+
+from iot_project import logs
+
+
+def record(msg="sensor-problem", fields=None, exc_info=None):
+    record = logging.LogRecord("iot_project.test", logging.WARNING, __file__, 1, msg, (), exc_info)
+    if fields is not None:
+        record.fields = fields
+    return record
+
+
+def test_json_formatter():
+    time = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    event = json.loads(logs.JsonFormatter().format(record(fields=dict(sensor="NH3", failures=3, since=time, error=OSError(5)))))
+    assert event["level"] == "warning"
+    assert event["logger"] == "iot_project.test"
+    assert event["event"] == "sensor-problem"
+    assert event["sensor"] == "NH3" and event["failures"] == 3
+    assert event["since"] == time.isoformat()
+    assert event["error"] == "OSError(5)"
+
+
+def test_json_formatter_exception():
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        line = logs.JsonFormatter().format(record(exc_info=sys.exc_info()))
+    assert "ValueError: broken" in json.loads(line)["exception"]
+
+
+def test_text_formatter():
+    line = logs.TextFormatter().format(record(fields=dict(sensor="NH3", failures=3)))
+    assert line.endswith("WARNING iot_project.test: sensor-problem sensor=NH3 failures=3")
+    assert logs.TextFormatter().format(record("boot")).endswith("iot_project.test: boot")
+
+
+def test_suppressed_records_are_counted():
+    clock = [0.0]
+    limiter = logs.RateLimiter(rate=1.0, burst=2, clock=lambda: clock[0])
+    assert [limiter.allow("a") for _ in range(5)] == [(True, 0), (True, 0), (False, 0), (False, 0), (False, 0)]
+    assert limiter.allow("b") == (True, 0)  # Every event has its own bucket
+    clock[0] = 1.0
+    assert limiter.allow("a") == (True, 3)
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_setup_logging(monkeypatch, root_logger):
+    monkeypatch.delenv("LOG_FORMAT", raising=False)
+    monkeypatch.setenv("LOG_LEVEL", "warning")
+    logs.setup_logging()
+    [handler] = root_logger.handlers
+    assert isinstance(handler.formatter, logs.JsonFormatter)
+    assert root_logger.level == logging.WARNING
+
+    monkeypatch.setenv("LOG_FORMAT", "text")
+    logs.setup_logging("debug")
+    [handler] = root_logger.handlers  # Replaced, not added
+    assert isinstance(handler.formatter, logs.TextFormatter)
+    assert root_logger.level == logging.DEBUG
+
+    logs.setup_logging(format="json")
+    assert isinstance(root_logger.handlers[0].formatter, logs.JsonFormatter)
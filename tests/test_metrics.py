@@ -0,0 +1,55 @@
+import time
+
+import trio
+
+from iot_project import metrics
+
+
+def test_render():
+    registry = metrics.Registry()
+    requests = registry.register(metrics.Counter("requests_total", "Requests", labels=("path",)))
+    requests.labels(path="/latest").inc()
+    requests.labels(path="/latest").inc(2)
+    latency = registry.register(metrics.Histogram("latency_seconds", "Latency", buckets=(0.1, 0.01)))
+    for value in (0.005, 0.01, 0.05, 1.0):
+        latency.observe(value)
+    registry.register(metrics.Callback("queue", "Queue", lambda: {("a",): 3, ("b",): None}, labels=("name",)))
+
+    assert registry.render().decode().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{path="/latest"} 3',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.01"} 2',  # Buckets sorted, the upper bound is inclusive
+        'latency_seconds_bucket{le="0.1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 1.065",
+        "latency_seconds_count 4",
+        "# HELP queue Queue",
+        "# TYPE queue gauge",
+        'queue{name="a"} 3',  # None: no value
+    ]
+
+
+def test_register_replaces_and_a_failing_callback_is_skipped():
+    registry = metrics.Registry()
+    registry.register(metrics.Callback("level", "Old", lambda: 1))
+    registry.register(metrics.Callback("level", "New", lambda: 2))
+    registry.register(metrics.Callback("broken", "Broken", lambda: 1 / 0))
+    assert registry.render().decode().splitlines() == ["# HELP level New", "# TYPE level gauge", "level 2"]
+
+
+def test_stall_detector():
+    steps = []
+    stalls = metrics.stalls_total._default.value
+
+    async def main():
+        await trio.sleep(0)
+        time.sleep(0.03)  # Blocks the event-loop
+        await trio.sleep(0)
+
+    trio.run(main, instruments=[metrics.StallDetector(threshold=0.02, steps=steps)])
+    assert max(steps) >= 0.03
+    assert sum(step > 0.02 for step in steps) == 1
+    assert metrics.stalls_total._default.value == stalls + 1
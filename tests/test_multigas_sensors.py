@@ -0,0 +1,97 @@
+import threading
+
+import trio
+
+from iot_project.gas_sensors import hal
+from iot_project.gas_sensors.multigas_sensors import CmdCode, MultiGasSensor, SensorType, bus_lock
+from iot_project.gas_sensors.simulation import Simulator, constant
+
+
+class CheckedBus:
+    """Simulated bus, that notes if two transfers overlap (the bus-lock of the sensors must prevent it)"""
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.active = 0
+        self.overlaps = 0
+        self._count_lock = threading.Lock()
+
+    def _transfer(self, function, *args):
+        with self._count_lock:
+            self.active += 1
+            self.overlaps += self.active > 1
+        try:
+            return function(*args)
+        finally:
+            with self._count_lock:
+                self.active -= 1
+
+    def write_i2c_block_data(self, address, register, data):
+        return self._transfer(self.bus.write_i2c_block_data, address, register, data)
+
+    def read_i2c_block_data(self, address, register, length):
+        return self._transfer(self.bus.read_i2c_block_data, address, register, length)
+
+
+def sensors(monkeypatch, bus_number=7):
+    monkeypatch.setattr(hal, "backend", "sim")
+    simulator = Simulator()
+    simulator.add_sensor(bus_number, 0x74, SensorType.NH3, curve=constant(12.5))
+    simulator.add_sensor(bus_number, 0x75, SensorType.CO, curve=constant(3.25))
+    bus = simulator.bus(bus_number)
+    bus.latency = 0.002  # Long enough, that unlocked transfers of two threads overlap
+    checked = CheckedBus(bus)
+    result = []
+    for address, sensor_type in ((0x74, SensorType.NH3), (0x75, SensorType.CO)):
+        sensor = MultiGasSensor(bus_number, address, sensor_type)
+        sensor.i2c_bus = checked
+        sensor.settle_time = 0.001
+        result.append(sensor)
+    return checked, result
+
+
+def test_one_lock_per_bus():
+    assert bus_lock(1) is bus_lock(1)
+    assert bus_lock(1) is not bus_lock(2)
+
+
+def test_command_async_transfers_never_overlap(monkeypatch):
+    bus, (nh3, co) = sensors(monkeypatch)
+    readings = []
+
+    async def read(sensor):
+        for _ in range(10):
+            readings.append(await sensor.read_all_async())
+
+    async def main():
+        async with trio.open_nursery() as nursery:
+            for sensor in (nh3, co, nh3, co):
+                nursery.start_soon(read, sensor)
+
+    trio.run(main)
+    assert bus.overlaps == 0
+    assert len(readings) == 40
+    assert {(r.sensor_type, r.gas_concentration) for r in readings} == {(SensorType.NH3, 12.5), (SensorType.CO, 3.25)}
+
+
+def test_command_async_doesnt_block_the_event_loop(monkeypatch):
+    _, (nh3, _) = sensors(monkeypatch)
+    nh3.settle_time = 0.05
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await trio.sleep(0.005)
+            ticks += 1
+
+    async def main():
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(ticker)
+            response = await nh3.command_async(CmdCode.read_all)
+            nursery.cancel_scope.cancel()
+        return response
+
+    response = trio.run(main)
+    assert nh3.decode_all(response).gas_concentration == 12.5
+    assert ticks >= 3  # The other task ran during the settle-time
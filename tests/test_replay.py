@@ -0,0 +1,113 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+import trio
+
+from iot_project import metrics
+from iot_project.gas_sensors import hal
+from iot_project.gas_sensors.capture import MAGIC, READ_ERROR, header_dtype, player, record_dtype
+from iot_project.gas_sensors.multigas_sensors import CmdCode, MultiGasSensor, SensorType
+from iot_project.gas_sensors.replay import FastClock, ReplaySystem
+from iot_project.gas_sensors.simulation import SimulatedSensor, constant, steps
+from iot_project.gas_sensors.topology import parse_topology
+
+SENSORS = {0x75: SensorType.NH3, 0x76: SensorType.CO, 0x77: SensorType.O2}
+
+
+def write_capture(path, seconds=20.0, rate=10):
+    """Capture of the default board: 10 polls/s, NH3 above the threshold from 10 s on, one failed read"""
+    curves = {0x75: steps((0, 10.0), (10, 60.0)), 0x76: constant(5.0), 0x77: constant(20.9)}
+    sensors = {address: SimulatedSensor(gas, curves[address]) for address, gas in SENSORS.items()}
+    command = MultiGasSensor.command_frame(CmdCode.read_all)
+    records = np.zeros(int(seconds * rate) * len(sensors), dtype=record_dtype)
+    for i, record in enumerate(records):
+        poll, address = divmod(i, len(sensors))
+        t = poll / rate + 0.05
+        sensor = sensors[0x75 + address]
+        sensor.write(command)
+        record["time"] = int(t * 1e9) + address * 1000
+        record["bus"] = 1
+        record["address"] = 0x75 + address
+        if poll == 5 and address == 1:
+            record["status"] = READ_ERROR
+        else:
+            record["frame"] = np.frombuffer(sensor.response(t), dtype=np.uint8)
+    with open(path, "wb") as file:
+        file.write(np.array((MAGIC, 1_700_000_000 * 10**9, b"test"), dtype=header_dtype).tobytes())
+        file.write(records.tobytes())
+    return path
+
+
+def replay(path) -> list[dict]:
+    player.load(path)
+    system = ReplaySystem(None)
+    documents = []
+    system.writer.put = documents.append
+    with system:
+        trio.run(system.main_task, clock=FastClock())
+    return documents
+
+
+@pytest.fixture
+def capture(tmp_path, monkeypatch):
+    monkeypatch.setattr(hal, "backend", "replay")
+    return write_capture(tmp_path / "capture.frames")
+
+
+def test_replay_runs_the_capture_through_the_pipeline(capture):
+    documents = replay(capture)
+
+    assert 35 <= len(documents) <= 40  # 0.5 s windows, the last incomplete one is not stored
+    assert documents[0]["meta"]["device"] == "test-replay"
+    assert sum(d["NH3"]["count"] for d in documents) >= 190
+    assert documents[0]["NH3"]["avg"] == pytest.approx(10.0)
+    assert documents[-1]["NH3"]["avg"] == pytest.approx(60.0)
+    assert sum(d["CO"].get("failures", 0) for d in documents) == 1
+    times = [d["time"] for d in documents]
+    assert times == sorted(times)
+    assert times[0].timestamp() == pytest.approx(1_700_000_000, abs=1)
+
+
+def test_replay_is_deterministic(capture):
+    first = replay(capture)
+    second = replay(capture)
+    assert first == second
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="POSIX paths")
+def test_replay_command(capture):
+    # The command runs replay.py as __main__: the hardware-backend must use the same player
+    pytest.importorskip("dotenv")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path), IOT_PROJECT_HARDWARE="sim")
+    result = subprocess.run(
+        [sys.executable, "-m", "iot_project.gas_sensors.replay", str(capture), "--fast", "--quiet"],
+        capture_output=True, text=True, timeout=60, env=env,
+    )
+    assert result.returncode == 0, result.stderr
+    assert "replay-done" in result.stderr
+
+
+def test_sensor_missing_in_the_capture(capture, tmp_path):
+    player.load(capture)
+    topology = parse_topology(dict(devices=[dict(id="test", sensors=[dict(type="NH3", address=0x75), dict(type="H2S", address=0x74)])]))
+    with pytest.raises(ValueError, match="H2S"):
+        ReplaySystem(None, topology=topology)
+
+    empty = tmp_path / "empty.frames"
+    with open(empty, "wb") as file:
+        file.write(np.array((MAGIC, 0, b"test"), dtype=header_dtype).tobytes())
+    player.load(empty)
+    assert player.finished.is_set()
+    with pytest.raises(ValueError, match="empty"):
+        ReplaySystem(None)
+
+
+def test_writer_metrics(capture):
+    player.load(capture)
+    system = ReplaySystem(None)
+    system.writer.put({"time": 0})
+    assert metrics.registry.metrics["iot_documents_total"].function()[("queued",)] == 1
+    assert system.summary()["aggregations"] == 1
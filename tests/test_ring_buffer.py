@@ -0,0 +1,33 @@
+import random
+
+import numpy as np
+
+from iot_project.gas_sensors.ring_buffer import SampleRing
+
+
+def test_rows_of_several_buses_stay_in_time_order():
+    ring = SampleRing(["NH3", "CO"], seconds=10, rate=5)  # 50 rows
+    rng = random.Random(1)
+    times = []
+    for poll in range(200):
+        # Two buses, each appends its poll after a random delay, stamped with the start of the poll
+        for bus in rng.sample([0, 1], 2):
+            time = poll * 100 + bus * 10 + rng.randrange(5)
+            times.append(time)
+            ring.append(time, {"NH3" if bus else "CO": (float(time), 20.0)})
+
+    rows = ring.view()
+    assert len(rows) == ring.capacity
+    assert np.all(np.diff(rows["time"]) >= 0)
+    np.testing.assert_array_equal(rows["time"], sorted(times)[-ring.capacity:])
+
+    selected = ring.between(19_500, 19_800)
+    np.testing.assert_array_equal(selected["time"], [t for t in sorted(times) if 19_500 <= t < 19_800])
+    assert np.shares_memory(selected, ring._data)  # Still a view
+
+
+def test_late_row_before_the_kept_ones():
+    ring = SampleRing(["NH3"], seconds=3, rate=1)
+    for time in (10, 20, 30, 40, 5):
+        ring.append(time, {"NH3": (1.0, 20.0)})
+    assert ring.view()["time"].tolist() == [20, 30, 40]
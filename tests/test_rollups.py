@@ -0,0 +1,91 @@
+import datetime
+
+import pytest
+
+pytest.importorskip("pymongo")
+
+from iot_project.gas_sensors.db_connect import StorageMode
+from iot_project.gas_sensors.rollups import backfill
+
+START = datetime.datetime(2026, 1, 1)  # Naive UTC, like the times from pymongo
+
+
+def naive(time):
+    return time.replace(tzinfo=None)
+
+
+class FakeCursor(list):
+    def sort(self, key, direction):
+        return FakeCursor(sorted(self, key=lambda document: document[key]))
+
+    def batch_size(self, size):
+        return self
+
+
+class FakeRaw:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection=None):
+        since = query.get("time", {}).get("$gte")
+        return FakeCursor(d for d in self.documents if since is None or d["time"] >= since)
+
+
+class FakeRollups:
+    """Rollup-documents per (device, start), only the operators of RollupAccumulator"""
+
+    def __init__(self):
+        self.rollups = {}
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def drop(self):
+        self.rollups.clear()
+
+    def delete_many(self, query):
+        since = query["start"]["$gte"]
+        self.rollups = {key: rollup for key, rollup in self.rollups.items() if key[1] < since}
+
+    def bulk_write(self, updates, ordered=True):
+        for update in updates:
+            key = (update._filter["meta.device"], naive(update._filter["start"]))
+            rollup = self.rollups.setdefault(key, {})
+            for field, value in update._doc["$inc"].items():
+                rollup[field] = rollup.get(field, 0) + value
+
+    def counts(self):
+        return {start: rollup["NH3.count"] for (_, start), rollup in sorted(self.rollups.items())}
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = FakeRollups()
+        return collection
+
+
+def database(hours=72):
+    db = FakeDatabase()
+    db["Raw-Data"] = FakeRaw([
+        {"time": START + datetime.timedelta(minutes=30 * i), "meta": {"device": "pi"}, "NH3": {"min": 1, "max": 3, "avg": 2.0, "count": 5}}
+        for i in range(hours * 2)
+    ])
+    return db
+
+
+def test_backfill_since_keeps_the_older_rollups():
+    db = database()
+    assert backfill(db, StorageMode.documents, chunk_size=7) == 144
+    full = {name: db[name].counts() for name in ("Rollup-1min", "Rollup-1h", "Rollup-1d")}
+    assert list(full["Rollup-1d"].values()) == [48 * 5] * 3
+
+    # Rounded down to the start of the day: the rollups of the 2nd and 3rd day are rebuilt, the first day is kept
+    assert backfill(db, StorageMode.documents, since=START + datetime.timedelta(hours=36), chunk_size=7) == 96
+    assert {name: db[name].counts() for name in full} == full
+
+
+def test_backfill_without_drop_adds():
+    db = database(hours=24)
+    backfill(db, StorageMode.documents)
+    backfill(db, StorageMode.documents, drop=False)
+    assert db["Rollup-1d"].counts() == {START: 2 * 48 * 5}
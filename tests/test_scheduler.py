@@ -0,0 +1,56 @@
+from iot_project.gas_sensors.scheduler import AdaptiveScheduler, SamplingLevel
+
+
+def scheduler(**kwargs):
+    return AdaptiveScheduler({"NH3": (50, None), "O2": (None, 19.5)}, 1.0, 10.0, **kwargs)
+
+
+def feed(scheduler, start, end, **values):
+    """A sample per second, returns the level after every one"""
+    levels = []
+    for t in range(start, end):
+        for name, value in values.items():
+            scheduler.update(name, value, float(t))
+        levels.append(scheduler.level)
+    return levels
+
+
+def test_faster_at_once_slower_after_hold():
+    s = scheduler(hold=30.0)
+    assert set(feed(s, 0, 120, NH3=5.0, O2=20.9)) == {SamplingLevel.calm}
+    assert s.rate.measurement_interval == 10.0
+
+    faster = s.faster
+    s.update("NH3", 30.0, 120.0)  # Close to the threshold
+    assert s.level is SamplingLevel.fast
+    assert faster.is_set()
+    assert s.rate.measurement_interval == 0.5 and s.rate.aggregation_interval == 5.0
+
+    levels = feed(s, 121, 400, NH3=5.0, O2=20.9)
+    first_drop = next(i for i, level in enumerate(levels) if level is not SamplingLevel.fast)
+    assert first_drop >= 29  # Held for `hold` seconds after the last sample, that needed it
+    # One level at a time, never faster again without a reason
+    changes = [level for i, level in enumerate(levels) if i == 0 or level != levels[i - 1]]
+    assert changes == [SamplingLevel.fast, SamplingLevel.normal, SamplingLevel.calm]
+
+
+def test_o2_close_to_the_lower_limit():
+    s = scheduler()
+    feed(s, 0, 60, NH3=5.0, O2=20.9)
+    s.update("O2", 19.9, 60.0)  # Within 2.5 % of 19.5
+    assert s.level is SamplingLevel.fast
+
+
+def test_faster_level_cuts_the_open_window():
+    s = scheduler()
+    s.start(0.0)
+    assert s.window_end(0) == 100.0  # calm: 10 times the aggregation-interval
+    s.update("NH3", 60.0, 20.0)
+    assert s.window_end(0) == 25.0  # Ends one fast aggregation-interval later
+    assert s.window_end(1) == 30.0
+    assert s.close(0) == (25.0, SamplingLevel.fast)
+
+
+def test_not_adaptive():
+    s = scheduler(adaptive=False)
+    assert feed(s, 0, 10, NH3=60.0) == [SamplingLevel.normal] * 10
@@ -0,0 +1,75 @@
+import trio
+import trio.testing
+
+from iot_project.gas_sensors.sensor_bus import SensorBus
+
+
+class FakeSensor:
+    def __init__(self, name, events, *, settle_time=0.1, fail=None):
+        self.name = name
+        self.events = events
+        self.settle_time = settle_time
+        self.fail = fail  # "send", "receive" or "decode"
+
+    def send(self, code):
+        self.events.append(("send", self.name, trio.current_time()))
+        if self.fail == "send":
+            raise OSError(121, "Remote I/O error")
+
+    def receive(self, code):
+        self.events.append(("receive", self.name, trio.current_time()))
+        if self.fail == "receive":
+            raise OSError(121, "Remote I/O error")
+        return self.name
+
+    def decode_all(self, raw):
+        if self.fail == "decode":
+            raise ValueError("Checksum")
+        return f"data-{raw}"
+
+
+def poll(bus, names=None):
+    async def main():
+        return await bus.poll(names)
+
+    return trio.run(main, clock=trio.testing.MockClock(autojump_threshold=0))
+
+
+def test_all_commands_before_the_responses():
+    events = []
+    sensors = {name: FakeSensor(name, events, settle_time=t) for name, t in (("NH3", 0.1), ("CO", 0.3), ("O2", 0.2))}
+    results = poll(SensorBus(sensors, threaded=False))
+
+    assert results == {"NH3": "data-NH3", "CO": "data-CO", "O2": "data-O2"}
+    assert [(kind, name) for kind, name, _ in events] == [
+        ("send", "NH3"), ("send", "CO"), ("send", "O2"), ("receive", "NH3"), ("receive", "CO"), ("receive", "O2")
+    ]
+    # The settle-time is waited once, the longest one of the bus
+    assert {time for kind, _, time in events if kind == "send"} == {0}
+    assert {time for kind, _, time in events if kind == "receive"} == {0.3}
+
+
+def test_results_in_the_order_of_the_names():
+    events = []
+    sensors = {name: FakeSensor(name, events) for name in ("NH3", "CO", "O2")}
+    results = poll(SensorBus(sensors, threaded=False), ["O2", "NH3"])
+    assert list(results) == ["O2", "NH3"]
+    assert {name for _, name, _ in events} == {"O2", "NH3"}
+
+
+def test_failures_are_returned_per_sensor():
+    events = []
+    sensors = {
+        "NH3": FakeSensor("NH3", events, fail="send"),
+        "CO": FakeSensor("CO", events, fail="receive"),
+        "O2": FakeSensor("O2", events, fail="decode"),
+        "H2S": FakeSensor("H2S", events),
+    }
+    results = poll(SensorBus(sensors, threaded=False))
+
+    assert list(results) == ["NH3", "CO", "O2", "H2S"]
+    assert isinstance(results["NH3"], OSError) and isinstance(results["CO"], OSError)
+    assert isinstance(results["O2"], ValueError)
+    assert results["H2S"] == "data-H2S"
+    # A sensor, that didn't get the command, isn't read
+    assert ("receive", "NH3") not in [(kind, name) for kind, name, _ in events]
@@ -0,0 +1,83 @@
+import threading
+
+import numpy as np
+import pytest
+
+from iot_project.gas_sensors.shared_ring import OK, SAMPLE, WINDOW, SharedSampleRing
+
+GASES = ("NH3", "CO", "O2")
+
+
+@pytest.fixture
+def ring():
+    ring = SharedSampleRing.create(GASES, capacity=8)
+    yield ring
+    ring.close()
+
+
+def test_attach_reads_the_rows(ring):
+    ring.append(SAMPLE, time_ns=1, value=[1.0, 2.0, 3.0], status=[OK, OK, OK])
+    ring.append(WINDOW, window=7, polls=10, duration=1.5)
+    reader = SharedSampleRing.attach(ring.name, GASES)
+    try:
+        rows, position, lost = reader.read(0)
+        assert (position, lost) == (2, 0)
+        assert list(rows["kind"]) == [SAMPLE, WINDOW]
+        assert list(rows[0]["value"]) == [1.0, 2.0, 3.0]
+        assert np.isnan(rows[1]["value"]).all()
+        assert rows[1]["window"] == 7
+        reader.stored_window = 7  # Written by the reader, seen by the owner
+        assert ring.stored_window == 7
+    finally:
+        reader.close()
+
+
+def test_attach_checks_the_gases(ring):
+    with pytest.raises(ValueError):
+        SharedSampleRing.attach(ring.name, GASES[:2])
+
+
+def test_slow_reader_loses_the_oldest_rows(ring):
+    for i in range(20):
+        ring.append(SAMPLE, time_ns=i)
+    rows, position, lost = ring.read(5, max_rows=3)
+    assert (position, lost) == (15, 7)
+    assert list(rows["time"]) == [12, 13, 14]  # Wrapped around
+    rows, position, lost = ring.read(position)
+    assert (list(rows["time"]), position, lost) == ([15, 16, 17, 18, 19], 20, 0)
+    assert ring.read(position)[0].size == 0
+
+
+def test_slot_being_written_is_skipped(ring):
+    for i in range(4):
+        ring.append(SAMPLE, time_ns=i)
+    ring._rows[2]["seq"] = -1  # The writer is in the middle of this slot
+    rows, position, lost = ring.read(0)
+    assert list(rows["time"]) == [0, 1, 3]
+    assert (position, lost) == (4, 1)
+
+
+def test_concurrent_writer_no_torn_rows():
+    ring = SharedSampleRing.create(GASES, capacity=64)
+    done = threading.Event()
+
+    def write():
+        for i in range(50_000):
+            ring.append(SAMPLE, time_ns=i, window=i, value=[i, i, i])
+        done.set()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    position = read = lost = 0
+    try:
+        while not done.is_set() or position < ring.head:
+            rows, position, rows_lost = ring.read(position)
+            lost += rows_lost
+            read += len(rows)
+            assert (rows["time"] == rows["seq"]).all()
+            assert (rows["window"] == rows["seq"]).all()
+            assert (rows["value"] == rows["seq"][:, None]).all()
+    finally:
+        writer.join()
+        ring.close()
+    assert read + lost == 50_000
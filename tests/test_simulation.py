@@ -0,0 +1,67 @@
+import pytest
+
+from iot_project.gas_sensors import hal
+from iot_project.gas_sensors.multigas_sensors import CRCError, MultiGasSensor, SensorType
+from iot_project.gas_sensors.simulation import Simulator, constant, ramp, sine, steps
+
+
+def test_curves():
+    assert constant(7.5)(1000) == 7.5
+
+    curve = ramp(10, 50, duration=20, delay=5)
+    assert [curve(t) for t in (0, 5, 15, 25, 100)] == [10, 10, 30, 50, 50]
+
+    curve = sine(20, 5, period=60)
+    assert curve(0) == pytest.approx(20)
+    assert curve(15) == pytest.approx(25)
+    assert curve(45) == pytest.approx(15)
+
+    curve = steps((0, 10), (60, 80), (120, 10))
+    assert [curve(t) for t in (0, 59.9, 60, 119, 120, 1000)] == [10, 10, 80, 80, 10, 10]
+
+
+class Clock:
+    def __init__(self):
+        self.time = 100.0
+
+    def __call__(self):
+        return self.time
+
+
+@pytest.fixture
+def simulator(monkeypatch):
+    monkeypatch.setattr(hal, "backend", "sim")
+    return Simulator(clock=Clock())
+
+
+def sensor(simulator, sensor_type=SensorType.NH3, address=0x74):
+    sensor = MultiGasSensor(3, address, sensor_type)
+    sensor.i2c_bus = simulator.bus(3)
+    sensor.settle_time = 0
+    return sensor
+
+
+def test_sensor_follows_the_curve_in_simulator_time(simulator):
+    simulator.add_sensor(3, 0x74, SensorType.NH3, curve=ramp(0, 100, duration=10), temperature=31.5)
+    nh3 = sensor(simulator)
+
+    reading = nh3.read_all()
+    assert reading.sensor_type is SensorType.NH3
+    assert reading.gas_concentration == 0
+    assert reading.temperature == pytest.approx(31.5, abs=0.5)
+
+    simulator.clock.time += 2.5  # The curves start with the simulator, not with the clock
+    assert nh3.read_all().gas_concentration == pytest.approx(25)
+    simulator.clock.time += 60
+    assert nh3.read_all().gas_concentration == pytest.approx(100)
+
+
+def test_sensor_errors(simulator):
+    simulator.add_sensor(3, 0x74, SensorType.CO, error_rate=1.0)
+    simulator.add_sensor(3, 0x75, SensorType.CO, crc_error_rate=1.0)
+    with pytest.raises(OSError):
+        sensor(simulator, SensorType.CO, 0x74).read_all()
+    with pytest.raises(CRCError):
+        sensor(simulator, SensorType.CO, 0x75).read_all()
+    with pytest.raises(OSError):
+        sensor(simulator, SensorType.CO, 0x76).read_all()  # No sensor at the address
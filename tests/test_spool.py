@@ -0,0 +1,171 @@
+import datetime
+
+import pytest
+import trio
+
+pytest.importorskip("bson")
+
+from iot_project.gas_sensors.db_connect import WriteResult
+from iot_project.gas_sensors.db_writer import BufferedWriter
+from iot_project.gas_sensors.spool import Spool
+
+START = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def document(i):
+    return {"time": START + datetime.timedelta(seconds=i), "NH3": {"avg": float(i), "count": 5}}
+
+
+async def append(spool, document):
+    """Append and wait for the rotation by run() (worker-threads, so in real time)"""
+    assert spool.append(document)
+    while spool._rotate_due:
+        await trio.sleep(0.001)
+
+
+def test_documents_survive_a_crash(tmp_path):
+    spool = Spool(tmp_path)
+    for i in range(10):
+        assert spool.append(document(i))
+    batch, position = spool.peek(4)
+    assert batch == [document(i) for i in range(4)]
+    spool.commit(position)
+    # Crash: no close(), the last line is cut off
+    spool._file.write(b'{"time": {"$date": "2026-01')
+    spool._file.flush()
+
+    restarted = Spool(tmp_path)
+    batch, _ = restarted.peek(100)
+    assert batch == [document(i) for i in range(4, 10)]
+    restarted.append(document(10))  # Goes to a new segment, after the cut-off line
+    batch, _ = restarted.peek(100)
+    assert batch == [document(i) for i in range(4, 11)]
+
+
+def test_commit_deletes_replayed_segments(tmp_path):
+    async def main():
+        spool = Spool(tmp_path, segment_size=200)
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(spool.run)
+            for i in range(20):
+                await append(spool, document(i))
+            assert len(spool._segments()) > 3
+            batch, position = spool.peek(100)
+            assert len(batch) == 20
+            spool.commit(position)
+            assert len(spool) == 0
+            assert len(spool._segments()) == 1
+            nursery.cancel_scope.cancel()
+        spool.close()
+
+    trio.run(main)
+    assert Spool(tmp_path).peek(100)[0] == []
+
+
+def test_disk_limit_drops_the_oldest_documents(tmp_path):
+    async def main():
+        spool = Spool(tmp_path, segment_size=300, max_bytes=900)
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(spool.run)
+            for i in range(100):
+                await append(spool, document(i))
+            nursery.cancel_scope.cancel()
+        return spool
+
+    spool = trio.run(main)
+    assert spool.dropped > 0
+    assert spool.used_bytes <= 900 + 300 + 200
+    batch, _ = spool.peek(1000)
+    assert len(spool) == len(batch) == 100 - spool.dropped
+    assert batch[-1] == document(99)
+
+
+class BrokenFile:
+    def write(self, data):
+        raise OSError(28, "No space left on device")
+
+    def flush(self):
+        pass
+
+
+def test_disk_errors_are_counted_not_raised(tmp_path):
+    spool = Spool(tmp_path)
+    working = spool._file
+    spool._file = BrokenFile()
+    assert not spool.append(document(0))
+    assert spool.dropped == 1 and len(spool) == 0
+    spool._file = working
+    assert spool.append(document(1))
+    assert spool.peek(10)[0] == [document(1)]
+
+
+def test_writer_drains_the_spool(tmp_path):
+    spool = Spool(tmp_path)
+    writer = BufferedWriter(None, queue=spool, batch_size=3)
+    written = []
+
+    def write(collection, batch):
+        written.extend(batch)
+        return WriteResult(written=len(batch)), True
+
+    writer._write = write
+    for i in range(7):
+        writer.put(document(i))
+    assert trio.run(writer.flush, None)
+    assert written == [document(i) for i in range(7)]
+    assert len(spool) == 0 and writer.stats.written == 7
+    writer.close()
+    assert Spool(tmp_path).peek(10)[0] == []
+
+
+def test_restart_counts_the_backlog(tmp_path):
+    spool = Spool(tmp_path)
+    for i in range(10):
+        spool.append(document(i))
+    batch, position = spool.peek(4)
+    spool.commit(position)
+    spool.close()
+
+    restarted = Spool(tmp_path)
+    assert len(restarted) == 6
+    batch, position = restarted.peek(100)
+    restarted.commit(position)
+    assert len(restarted) == 0
+
+
+def test_fill_level_follows_rotation_and_deletion(tmp_path):
+    def on_disk():
+        return sum(p.stat().st_size for p in tmp_path.glob("segment-*.jsonl"))
+
+    async def main():
+        spool = Spool(tmp_path, segment_size=200, max_bytes=10_000)
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(spool.run)
+            for i in range(20):
+                await append(spool, document(i))
+            assert spool.used_bytes == on_disk() > 0
+            batch, position = spool.peek(15)
+            spool.commit(position)
+            assert spool.used_bytes == on_disk()
+            assert spool.fill_level == on_disk() / 10_000
+            nursery.cancel_scope.cancel()
+        spool.close()
+
+    trio.run(main)
+    assert Spool(tmp_path).used_bytes == on_disk()
+
+
+def test_commit_counts_the_lines_read(tmp_path):
+    spool = Spool(tmp_path)
+    spool.append(document(0))
+    spool._file.write(b"not json\n")
+    spool._file.flush()
+    spool.append(document(1))
+    spool.close()
+
+    restarted = Spool(tmp_path)
+    assert len(restarted) == 3
+    batch, position = restarted.peek(100)
+    assert batch == [document(0), document(1)]
+    restarted.commit(position)
+    assert len(restarted) == 0  # The invalid line is acknowledged too
@@ -0,0 +1,64 @@
+import socket
+
+import pytest
+import trio
+import trio.testing
+
+from iot_project.gas_sensors.publisher import LatestReading
+from iot_project.tasks import keep_running
+
+
+def test_keep_running_restarts_after_errors():
+    calls = []
+
+    async def flaky(*, task_status=trio.TASK_STATUS_IGNORED):
+        calls.append(trio.current_time())
+        if len(calls) < 3:
+            raise OSError(98, "Address already in use")
+        task_status.started("up")
+        await trio.sleep_forever()
+
+    async def main():
+        async with trio.open_nursery() as nursery:
+            assert await nursery.start(keep_running, "flaky", flaky) == "up"
+            nursery.cancel_scope.cancel()
+
+    trio.run(main, clock=trio.testing.MockClock(autojump_threshold=0))
+    assert len(calls) == 3
+    assert calls[2] - calls[1] == 2 * (calls[1] - calls[0])  # Exponential backoff
+
+
+def serve_http(port):
+    return LatestReading().serve(port)
+
+
+def serve_controller(port):
+    pytest.importorskip("trio_websocket")
+    from iot_project.sunfounder_picar.sunfounder_controller import SunFounderController
+
+    return SunFounderController(port).serve()
+
+
+@pytest.mark.parametrize("serve", [serve_http, serve_controller])
+def test_busy_port_does_not_stop_the_other_tasks(serve):
+    with socket.socket() as busy:
+        busy.bind(("0.0.0.0", 0))
+        busy.listen()
+        port = busy.getsockname()[1]
+        server = serve(port)
+        ticks = 0
+
+        async def alarm():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await trio.sleep(0.1)
+
+        async def main():
+            with trio.move_on_after(5):
+                async with trio.open_nursery() as nursery:
+                    nursery.start_soon(alarm)
+                    nursery.start_soon(lambda: server)
+
+        trio.run(main, clock=trio.testing.MockClock(autojump_threshold=0))
+    assert ticks >= 49
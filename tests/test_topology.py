@@ -0,0 +1,62 @@
+import pathlib
+
+import pytest
+
+from iot_project.gas_sensors.multigas_sensors import SensorType
+from iot_project.gas_sensors.topology import default_topology, load_topology, parse_topology
+
+
+def sensors(*sensors, thresholds=None):
+    config = dict(devices=[dict(id="lab", sensors=list(sensors))])
+    if thresholds is not None:
+        config["thresholds"] = thresholds
+    return {sensor.name: sensor for sensor in parse_topology(config).sensors}
+
+
+def limits(sensor):
+    return sensor.above, sensor.below, sensor.twa, sensor.stel, sensor.rise
+
+
+def test_defaults():
+    topology = default_topology("pi")
+    assert [(s.name, s.device, s.bus, s.address) for s in topology.sensors] == [
+        ("NH3", "pi", 1, 0x75), ("CO", "pi", 1, 0x76), ("O2", "pi", 1, 0x77)
+    ]
+    by_name = {sensor.name: sensor for sensor in topology.sensors}
+    assert limits(by_name["NH3"]) == (50, None, 25, 35, None)
+    assert limits(by_name["CO"]) == (100, None, 25, None, None)
+    assert limits(by_name["O2"]) == (None, 20, None, None, None)
+
+
+def test_limits_fall_back_one_by_one():
+    configured = sensors(
+        dict(type="NH3", address=0x75),
+        dict(type="CO", address=0x76),
+        dict(type="O2", address=0x77, above=23),
+        dict(type="H2S", address=0x74, twa=1),
+        thresholds=dict(CO=dict(twa=20), NH3=dict(above=35, rise=10)),
+    )
+    # Only exposure-limits for CO: its instantaneous alarm stays
+    assert limits(configured["CO"]) == (100, None, 20, None, None)
+    assert limits(configured["NH3"]) == (35, None, 25, 35, 10)
+    assert limits(configured["O2"]) == (23, 20, None, None, None)
+    assert limits(configured["H2S"]) == (None, None, 1, None, None)
+
+
+def test_invalid_topologies():
+    with pytest.raises(ValueError, match="Unknown sensor-type"):
+        sensors(dict(type="XYZ", address=0x75))
+    with pytest.raises(ValueError, match="used twice"):
+        sensors(dict(type="NH3", address=0x75), dict(type="NH3", address=0x76))
+    with pytest.raises(ValueError, match="used twice"):
+        sensors(dict(type="NH3", address=0x75), dict(type="CO", address=0x75))
+    with pytest.raises(ValueError, match="No sensors"):
+        parse_topology({})
+
+
+def test_example_file():
+    topology = load_topology(pathlib.Path(__file__).parents[1] / "topology.example.toml")
+    assert list(topology.devices) == ["gas-board-1", "gas-board-2"]
+    assert sorted(topology.buses()) == [1, 3]
+    h2s = topology.devices["gas-board-2"][0]
+    assert (h2s.name, h2s.sensor_type, h2s.above) == ("H2S-2", SensorType.H2S, 10)
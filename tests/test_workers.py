@@ -0,0 +1,60 @@
+import socket
+
+import pytest
+import trio
+
+from iot_project.gas_sensors import hal
+from iot_project.gas_sensors.shared_ring import SAMPLE, SharedSampleRing
+from iot_project.gas_sensors.topology import default_topology
+from iot_project.gas_sensors.workers import SafetySystem
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def ring():
+    ring = SharedSampleRing.create([c.name for c in default_topology("test").sensors], capacity=1000)
+    yield ring
+    ring.close()
+
+
+def test_safety_system_serves_its_metrics(monkeypatch, ring):
+    monkeypatch.setattr(hal, "backend", "sim")
+    port = _free_port()
+    system = SafetySystem(ring, device="test", metrics_port=port)
+    # Nothing of the storage-side in the safety-process
+    assert not hasattr(system, "writer") and not hasattr(system, "latest")
+
+    async def get(path):
+        stream = await trio.open_tcp_stream("127.0.0.1", port)
+        await stream.send_all(f"GET {path} HTTP/1.1\r\n\r\n".encode())
+        response = b""
+        while data := await stream.receive_some(65536):
+            response += data
+        return response.decode()
+
+    async def main():
+        with system:
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(system.main_task)
+                await system.first_sample.wait()
+                with trio.fail_after(5):
+                    while True:
+                        try:
+                            response = await get("/metrics")
+                            break
+                        except OSError:
+                            await trio.sleep(0.05)  # Server not started yet
+                assert response.startswith("HTTP/1.1 200")
+                assert "iot_alarm_latency_seconds" in response
+                assert "iot_sampling_level" in response
+                assert (await get("/latest")).startswith("HTTP/1.1 404")
+                nursery.cancel_scope.cancel()
+
+    trio.run(main)
+    rows, _, _ = ring.read(0)
+    assert (rows["kind"] == SAMPLE).any()